@@ -14,9 +14,13 @@ app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET")
 
 # Configure caching
+# Set CACHE_TYPE to FileSystemCache or RedisCache to share the cache between workers
 cache = Cache(app, config={
-    'CACHE_TYPE': 'SimpleCache',
-    'CACHE_DEFAULT_TIMEOUT': 300  # 5 minutes
+    'CACHE_TYPE': os.environ.get("CACHE_TYPE", "SimpleCache"),
+    'CACHE_DEFAULT_TIMEOUT': 300,  # 5 minutes
+    'CACHE_THRESHOLD': int(os.environ.get("CACHE_THRESHOLD", 2000)),
+    'CACHE_DIR': os.environ.get("CACHE_DIR", "/tmp/weatherwizard-cache"),
+    'CACHE_REDIS_URL': os.environ.get("CACHE_REDIS_URL", "redis://localhost:6379/0")
 })
 
 @app.route('/')
@@ -56,7 +60,7 @@ def forecast():
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/heatmap', methods=['GET'])
-@cache.cached(timeout=600)  # 10 minutes
+@cache.cached(timeout=600, query_string=True)  # 10 minutes, per viewport
 def heatmap():
     try:
         type_param = request.args.get('type', 'temperature')
@@ -1,11 +1,26 @@
 import os
 import logging
 from dotenv import load_dotenv
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_caching import Cache
 from flask_cors import CORS
-from services.weather_service import get_weather_data, get_weather_forecast, get_heatmap_data
-from services.ai_service import generate_weather_description
+from services import (
+    circuit_breaker, city_snapshot, conditional, forecast_updates, json_codec, metrics, observation_store,
+    response_encoding, sse, weather_service
+)
+from services.batch import (
+    BatchRequestError, fetch_description_batch, fetch_weather_batch, iter_weather_batch, parse_locations
+)
+from services.cache_backends import cache_config
+from services.cache_keys import quantize_location, location_cache_key
+from services.dashboard import get_dashboard
+from services import heatmap_raster
+from services.heatmap_tiles import get_heatmap_view, response_cache, viewport_cache_key
+from services.data_cache import cached_entry, cached_fetch
+from services.deployment import get_allowed_origins
+from services.rate_limit import upstream_governor
+from services.description_cache import cached_description, stream_description
 
 # Load environment variables
 load_dotenv()
@@ -18,35 +33,44 @@ logger = logging.getLogger(__name__)
 FLASK_ENV = os.environ.get("FLASK_ENV", "development")
 FRONTEND_URL = os.environ.get("FRONTEND_URL", "http://localhost:3000")
 
+class FastJSONProvider(DefaultJSONProvider):
+    """JSON provider serializing with json_codec (orjson when installed)."""
+
+    def dumps(self, obj, **kwargs):
+        # Options such as indent or sort_keys are only supported by the stdlib
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return json_codec.dumps(obj, default=self.default)
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return json_codec.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Pretty-printed in debug mode like the default provider
+        if self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            json_codec.dumps_bytes(obj, default=self.default) + b"\n", mimetype=self.mimetype
+        )
+
 # Create Flask app
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 app.secret_key = os.environ.get("SESSION_SECRET")
 
 # Determine allowed origins based on environment
-if FLASK_ENV == "production":
-    # In production, only allow the deployed Vercel frontend
-    allowed_origins = [
-        "https://weather-app-frontend.vercel.app",  # Production Vercel deployment
-        os.environ.get("FRONTEND_URL", "")  # Allow for custom domain if set
-    ]
-else:
-    # In development, allow localhost with different ports
-    allowed_origins = [
-        "http://localhost:3000",  # Next.js default port
-        "http://localhost:8000",  # Alternative port
-        "http://127.0.0.1:3000",  # IPv4 localhost
-        "http://127.0.0.1:8000"   # Alternative port with IPv4
-    ]
-
-# Filter out empty values
-allowed_origins = [origin for origin in allowed_origins if origin]
+allowed_origins = get_allowed_origins()
 
 # Enable CORS with dynamic configuration
 CORS(app, resources={
     r"/api/*": {
         "origins": allowed_origins,
         "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"],
+        "allow_headers": ["Content-Type", "Authorization", "If-None-Match", "If-Modified-Since"],
+        "expose_headers": ["ETag", "X-Raster-Width", "X-Raster-Height", "X-Raster-Bounds", "X-Heatmap-Missing-Tiles"],
         "supports_credentials": True
     }
 })
@@ -54,14 +78,10 @@ CORS(app, resources={
 # Log the allowed origins
 logger.info(f"CORS configured with allowed origins: {allowed_origins}")
 
-# Configure caching
-cache = Cache(app, config={
-    'CACHE_TYPE': 'SimpleCache',
-    'CACHE_DEFAULT_TIMEOUT': 300  # 5 minutes
-})
+# Configure caching (shared across workers when CACHE_BACKEND is filesystem or redis)
+cache = Cache(app, config=cache_config())
 
 @app.route('/api/weather', methods=['GET'])
-@cache.cached(timeout=300, query_string=True)
 def weather():
     try:
         lat = request.args.get('lat')
@@ -70,14 +90,45 @@ def weather():
         if not lat or not lon:
             return jsonify({"error": "Latitude and longitude are required"}), 400
         
-        weather_data = get_weather_data(lat, lon)
-        return jsonify(weather_data)
+        # Only bad input is a 400; errors from upstream, such as an undecodable body, are a 500
+        try:
+            location = quantize_location(lat, lon)
+        except ValueError as e:
+            return jsonify({"error": f"Invalid coordinates: {str(e)}"}), 400
+        entry = cached_entry(
+            cache, 'weather', location_cache_key('weather', location),
+            lambda: weather_service.get_weather_data(location.lat, location.lon)
+        )
+        # Re-polling clients get 304 until the observation changes
+        body = json_codec.dumps_bytes(entry['value'])
+        status, body, headers = conditional.respond(request.headers, body, conditional.validators(
+            'weather', body, entry['fetched_at'], entry['value'].get('current', {}).get('datetime')
+        ))
+        return Response(body, status=status, mimetype='application/json', headers=headers)
     except Exception as e:
         logger.error(f"Error fetching weather data: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/weather/batch', methods=['POST'])
+def weather_batch():
+    try:
+        locations = parse_locations(request.get_json(silent=True))
+        
+        if request.args.get('stream', 'false').lower() == 'true':
+            # One JSON object per line, in completion order
+            def generate():
+                for index, result in iter_weather_batch(cache, locations):
+                    yield json_codec.dumps({"index": index, **result}) + "\n"
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+        
+        return jsonify({"results": fetch_weather_batch(cache, locations)})
+    except BatchRequestError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error fetching batch weather data: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/forecast', methods=['GET'])
-@cache.cached(timeout=300, query_string=True)
 def forecast():
     try:
         lat = request.args.get('lat')
@@ -86,26 +137,90 @@ def forecast():
         if not lat or not lon:
             return jsonify({"error": "Latitude and longitude are required"}), 400
         
-        forecast_data = get_weather_forecast(lat, lon)
-        return jsonify(forecast_data)
+        # Daily and hourly rollups are precomputed per forecast revision
+        view = request.args.get('view', forecast_updates.RAW)
+        if view not in forecast_updates.VIEWS:
+            return jsonify({"error": f"Unknown forecast view: {view}"}), 400
+        
+        response_format, coding = response_encoding.negotiate(
+            request.args.get('format'), request.headers.get('Accept'), request.headers.get('Accept-Encoding')
+        )
+        try:
+            location = quantize_location(lat, lon)
+        except ValueError as e:
+            return jsonify({"error": f"Invalid coordinates: {str(e)}"}), 400
+        key = location_cache_key('forecast', location)
+        entry = forecast_updates.cached_forecast_entry(cache, location)
+        # Clients holding the previous revision only get the slots that changed
+        since = request.args.get('since') if view == forecast_updates.RAW else None
+        changes = forecast_updates.delta(entry['value'], since) if since else None
+        if changes is not None:
+            return Response(json_codec.dumps_bytes(changes), status=200, mimetype='application/json', headers={
+                'Cache-Control': conditional.cache_control('forecast', entry['fetched_at'], stale_at=entry.get('stale_at'))
+            })
+        # Encoded and compressed once per forecast revision, then served as stored bytes
+        encoded = response_encoding.encoded_body(
+            cache, 'forecast', key if view == forecast_updates.RAW else f"{key}:{view}", entry['value']['revision'],
+            lambda shape: forecast_updates.document(entry['value'], view, shape),
+            response_format, coding
+        )
+        status, body, headers = conditional.respond(request.headers, encoded.body, {
+            **encoded.headers, **conditional.validators(
+                'forecast', encoded.body, entry['fetched_at'], entry['value']['issued_at'], entry.get('stale_at')
+            )
+        })
+        return Response(body, status=status, mimetype=encoded.mimetype, headers=headers)
+    except response_encoding.UnsupportedFormatError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Error fetching forecast data: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/heatmap', methods=['GET'])
-@cache.cached(timeout=600)  # 10 minutes
 def heatmap():
     try:
         type_param = request.args.get('type', 'temperature')
-        bounds = {
-            'north': float(request.args.get('north', 60)),
-            'south': float(request.args.get('south', 20)),
-            'east': float(request.args.get('east', -60)),
-            'west': float(request.args.get('west', -130))
-        }
-        
-        heatmap_data = get_heatmap_data(type_param, bounds)
-        return jsonify(heatmap_data)
+        format_param = request.args.get('format')
+        try:
+            bounds = {
+                'north': float(request.args.get('north', 60)),
+                'south': float(request.args.get('south', 20)),
+                'east': float(request.args.get('east', -60)),
+                'west': float(request.args.get('west', -130))
+            }
+        except ValueError as e:
+            return jsonify({"error": f"Invalid bounds: {str(e)}"}), 400
+        
+        if format_param in heatmap_raster.RASTER_FORMATS:
+            try:
+                width, height = heatmap_raster.parse_size(request.args.get('width'), request.args.get('height'))
+            except ValueError as e:
+                return jsonify({"error": f"Invalid raster size: {str(e)}"}), 400
+            # Interpolated server-side into a binary raster instead of JSON points
+            view = get_heatmap_view(cache, bounds)
+            body, mimetype, headers = heatmap_raster.cached_render(
+                response_cache(cache, view), view, type_param, bounds, format_param, width, height,
+                response_encoding.negotiate(accept_encoding=request.headers.get('Accept-Encoding'))[1]
+            )
+            return Response(body, mimetype=mimetype, headers={**headers, **view.headers})
+        
+        response_format, coding = response_encoding.negotiate(
+            format_param, request.headers.get('Accept'), request.headers.get('Accept-Encoding')
+        )
+        # Assembled from per-tile caches, so panning reuses what's already fetched
+        view = get_heatmap_view(cache, bounds)
+        # Partial views aren't stored, so the next request retries the missing tiles
+        encoded = response_encoding.encoded_body(
+            response_cache(cache, view), 'heatmap', viewport_cache_key(type_param, bounds), view.version,
+            lambda shape: (
+                city_snapshot.heatmap_columns(view.snapshot(), type_param) if shape == 'columnar'
+                else city_snapshot.heatmap_points(view.snapshot(), type_param)
+            ),
+            response_format, coding
+        )
+        return Response(encoded.body, mimetype=encoded.mimetype, headers={**encoded.headers, **view.headers})
+    except response_encoding.UnsupportedFormatError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Error fetching heatmap data: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -119,16 +234,129 @@ def weather_description():
         if not lat or not lon:
             return jsonify({"error": "Latitude and longitude are required"}), 400
         
-        weather_data = get_weather_data(lat, lon)
-        description = generate_weather_description(weather_data)
+        try:
+            location = quantize_location(lat, lon)
+        except ValueError as e:
+            return jsonify({"error": f"Invalid coordinates: {str(e)}"}), 400
+        weather_data = cached_fetch(
+            cache, 'weather', location_cache_key('weather', location),
+            lambda: weather_service.get_weather_data(location.lat, location.lon)
+        )
+        description = cached_description(weather_data)
         return jsonify({"description": description})
     except Exception as e:
         logger.error(f"Error generating weather description: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/weather_description/stream', methods=['GET'])
+def weather_description_stream():
+    try:
+        lat = request.args.get('lat')
+        lon = request.args.get('lon')
+        
+        if not lat or not lon:
+            return jsonify({"error": "Latitude and longitude are required"}), 400
+        
+        try:
+            location = quantize_location(lat, lon)
+        except ValueError as e:
+            return jsonify({"error": f"Invalid coordinates: {str(e)}"}), 400
+        weather_data = cached_fetch(
+            cache, 'weather', location_cache_key('weather', location),
+            lambda: weather_service.get_weather_data(location.lat, location.lon)
+        )
+        # Tokens are forwarded as Server-Sent Events while gpt-4o generates them
+        def generate():
+            for name, data in stream_description(weather_data):
+                yield sse.event(name, data)
+        return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=sse.STREAM_HEADERS)
+    except Exception as e:
+        logger.error(f"Error generating weather description: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/weather_description/batch', methods=['POST'])
+def weather_description_batch():
+    try:
+        locations = parse_locations(request.get_json(silent=True))
+        # Missing descriptions are generated a few locations per OpenAI call
+        return jsonify({"results": fetch_description_batch(cache, locations)})
+    except BatchRequestError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error generating batch weather descriptions: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/dashboard', methods=['GET'])
+def dashboard():
+    try:
+        lat = request.args.get('lat')
+        lon = request.args.get('lon')
+        
+        if not lat or not lon:
+            return jsonify({"error": "Latitude and longitude are required"}), 400
+        
+        try:
+            location = quantize_location(lat, lon)
+        except ValueError as e:
+            return jsonify({"error": f"Invalid coordinates: {str(e)}"}), 400
+        # Clients streaming the description from /api/weather_description/stream pass description=false
+        describe = request.args.get('description', 'true').lower() != 'false'
+        forecast_view = request.args.get('forecast_view', forecast_updates.RAW)
+        if forecast_view not in forecast_updates.VIEWS:
+            return jsonify({"error": f"Unknown forecast view: {forecast_view}"}), 400
+        return jsonify(get_dashboard(cache, location, describe, forecast_view))
+    except Exception as e:
+        logger.error(f"Error fetching dashboard data: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/history', methods=['GET'])
+def history():
+    try:
+        lat = request.args.get('lat')
+        lon = request.args.get('lon')
+        
+        if not lat or not lon:
+            return jsonify({"error": "Latitude and longitude are required"}), 400
+        if not observation_store.enabled():
+            return jsonify({"error": "Observation history is disabled"}), 503
+        
+        try:
+            location = quantize_location(lat, lon)
+            hours = float(request.args.get('hours', 24))
+            if hours <= 0:
+                raise ValueError("hours must be positive")
+        except ValueError as e:
+            return jsonify({"error": f"Invalid parameters: {str(e)}"}), 400
+        return jsonify({
+            "location": {"lat": location.lat, "lon": location.lon},
+            "hours": hours,
+            "observations": observation_store.history(location.lat, location.lon, hours)
+        })
+    except Exception as e:
+        logger.error(f"Error fetching observation history: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     return jsonify({"status": "ok"}), 200
 
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    return jsonify({
+        "counters": metrics.snapshot(),
+        "cache_hit_rates": metrics.hit_rates(),
+        "upstream_quota": upstream_governor.status()
+    }), 200
+
+@app.route('/api/status', methods=['GET'])
+def status_endpoint():
+    circuits = circuit_breaker.status()
+    degraded = any(circuit['state'] != circuit_breaker.CLOSED for circuit in circuits.values())
+    return jsonify({
+        "status": "degraded" if degraded else "ok",
+        "circuits": circuits,
+        "upstream_quota": upstream_governor.status()
+    }), 200
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,360 @@
+"""
+ASGI serving mode.
+
+Exposes the same /api/* routes as app.py, but upstream calls to
+OpenWeatherMap and OpenAI are non-blocking, so a single process can keep
+hundreds of requests in flight instead of one per worker:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+Both modes share the same cache tier (see CACHE_BACKEND), key normalization
+and stale-while-revalidate behaviour.
+"""
+
+import logging
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse as StarletteJSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from services import (
+    circuit_breaker, city_snapshot, conditional, forecast_updates, heatmap_raster, http_client, json_codec, metrics,
+    observation_store, response_encoding, sse, weather_service
+)
+from services.batch import (
+    BatchRequestError, async_fetch_description_batch, async_fetch_weather_batch, async_iter_weather_batch,
+    parse_locations
+)
+from services.cache_backends import create_cache
+from services.cache_keys import quantize_location, location_cache_key
+from services.dashboard import async_get_dashboard
+from services.heatmap_tiles import async_get_heatmap_view, response_cache, viewport_cache_key
+from services.data_cache import async_cached_entry
+from services.deployment import get_allowed_origins
+from services.rate_limit import upstream_governor
+from services.description_cache import async_cached_description, async_stream_description
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+class JSONResponse(StarletteJSONResponse):
+    """JSON response serialized with json_codec (orjson when installed)."""
+
+    def render(self, content):
+        return json_codec.dumps_bytes(content)
+
+# Shared with the Flask app when a filesystem or redis cache tier is configured
+cache = create_cache()
+
+async def _cached_weather_entry(location):
+    return await async_cached_entry(
+        cache, 'weather', location_cache_key('weather', location),
+        lambda: weather_service.async_get_weather_data(location.lat, location.lon)
+    )
+
+async def _cached_weather(location):
+    return (await _cached_weather_entry(location))['value']
+
+async def weather(request):
+    try:
+        lat = request.query_params.get('lat')
+        lon = request.query_params.get('lon')
+
+        if not lat or not lon:
+            return JSONResponse({"error": "Latitude and longitude are required"}, status_code=400)
+
+        # Only bad input is a 400; errors from upstream, such as an undecodable body, are a 500
+        try:
+            location = quantize_location(lat, lon)
+        except ValueError as e:
+            return JSONResponse({"error": f"Invalid coordinates: {str(e)}"}, status_code=400)
+        entry = await _cached_weather_entry(location)
+        body = json_codec.dumps_bytes(entry['value'])
+        status, body, headers = conditional.respond(request.headers, body, conditional.validators(
+            'weather', body, entry['fetched_at'], entry['value'].get('current', {}).get('datetime')
+        ))
+        return Response(body, status_code=status, media_type='application/json', headers=headers)
+    except Exception as e:
+        logger.error(f"Error fetching weather data: {str(e)}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+async def weather_batch(request):
+    try:
+        try:
+            body = json_codec.loads(await request.body())
+        except ValueError:
+            body = None
+        locations = parse_locations(body)
+
+        if request.query_params.get('stream', 'false').lower() == 'true':
+            # One JSON object per line, in completion order
+            async def generate():
+                async for index, result in async_iter_weather_batch(cache, locations):
+                    yield json_codec.dumps({"index": index, **result}) + "\n"
+            return StreamingResponse(generate(), media_type='application/x-ndjson')
+
+        return JSONResponse({"results": await async_fetch_weather_batch(cache, locations)})
+    except BatchRequestError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except Exception as e:
+        logger.error(f"Error fetching batch weather data: {str(e)}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+async def forecast(request):
+    try:
+        lat = request.query_params.get('lat')
+        lon = request.query_params.get('lon')
+
+        if not lat or not lon:
+            return JSONResponse({"error": "Latitude and longitude are required"}, status_code=400)
+
+        # Daily and hourly rollups are precomputed per forecast revision
+        view = request.query_params.get('view', forecast_updates.RAW)
+        if view not in forecast_updates.VIEWS:
+            return JSONResponse({"error": f"Unknown forecast view: {view}"}, status_code=400)
+        
+        response_format, coding = response_encoding.negotiate(
+            request.query_params.get('format'), request.headers.get('Accept'), request.headers.get('Accept-Encoding')
+        )
+        try:
+            location = quantize_location(lat, lon)
+        except ValueError as e:
+            return JSONResponse({"error": f"Invalid coordinates: {str(e)}"}, status_code=400)
+        key = location_cache_key('forecast', location)
+        entry = await forecast_updates.async_cached_forecast_entry(cache, location)
+        # Clients holding the previous revision only get the slots that changed
+        since = request.query_params.get('since') if view == forecast_updates.RAW else None
+        changes = forecast_updates.delta(entry['value'], since) if since else None
+        if changes is not None:
+            return Response(json_codec.dumps_bytes(changes), status_code=200, media_type='application/json', headers={
+                'Cache-Control': conditional.cache_control('forecast', entry['fetched_at'], stale_at=entry.get('stale_at'))
+            })
+        # Reading, encoding and compressing the body happens off the event loop
+        encoded = await run_in_threadpool(
+            response_encoding.encoded_body, cache, 'forecast',
+            key if view == forecast_updates.RAW else f"{key}:{view}", entry['value']['revision'],
+            lambda shape: forecast_updates.document(entry['value'], view, shape),
+            response_format, coding
+        )
+        status, body, headers = conditional.respond(request.headers, encoded.body, {
+            **encoded.headers, **conditional.validators(
+                'forecast', encoded.body, entry['fetched_at'], entry['value']['issued_at'], entry.get('stale_at')
+            )
+        })
+        return Response(body, status_code=status, media_type=encoded.mimetype, headers=headers)
+    except response_encoding.UnsupportedFormatError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except Exception as e:
+        logger.error(f"Error fetching forecast data: {str(e)}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+async def heatmap(request):
+    try:
+        type_param = request.query_params.get('type', 'temperature')
+        format_param = request.query_params.get('format')
+        try:
+            bounds = {
+                'north': float(request.query_params.get('north', 60)),
+                'south': float(request.query_params.get('south', 20)),
+                'east': float(request.query_params.get('east', -60)),
+                'west': float(request.query_params.get('west', -130))
+            }
+        except ValueError as e:
+            return JSONResponse({"error": f"Invalid bounds: {str(e)}"}, status_code=400)
+
+        if format_param in heatmap_raster.RASTER_FORMATS:
+            try:
+                width, height = heatmap_raster.parse_size(
+                    request.query_params.get('width'), request.query_params.get('height')
+                )
+            except ValueError as e:
+                return JSONResponse({"error": f"Invalid raster size: {str(e)}"}, status_code=400)
+            view = await async_get_heatmap_view(cache, bounds)
+            # Interpolating is CPU-bound, so it runs off the event loop
+            body, media_type, headers = await run_in_threadpool(
+                heatmap_raster.cached_render, response_cache(cache, view), view, type_param, bounds,
+                format_param, width, height,
+                response_encoding.negotiate(accept_encoding=request.headers.get('Accept-Encoding'))[1]
+            )
+            return Response(body, media_type=media_type, headers={**headers, **view.headers})
+
+        response_format, coding = response_encoding.negotiate(
+            format_param, request.headers.get('Accept'), request.headers.get('Accept-Encoding')
+        )
+        view = await async_get_heatmap_view(cache, bounds)
+        encoded = await run_in_threadpool(
+            response_encoding.encoded_body, response_cache(cache, view), 'heatmap',
+            viewport_cache_key(type_param, bounds), view.version,
+            lambda shape: (
+                city_snapshot.heatmap_columns(view.snapshot(), type_param) if shape == 'columnar'
+                else city_snapshot.heatmap_points(view.snapshot(), type_param)
+            ),
+            response_format, coding
+        )
+        return Response(encoded.body, media_type=encoded.mimetype, headers={**encoded.headers, **view.headers})
+    except response_encoding.UnsupportedFormatError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except Exception as e:
+        logger.error(f"Error fetching heatmap data: {str(e)}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+async def weather_description(request):
+    try:
+        lat = request.query_params.get('lat')
+        lon = request.query_params.get('lon')
+
+        if not lat or not lon:
+            return JSONResponse({"error": "Latitude and longitude are required"}, status_code=400)
+
+        try:
+            location = quantize_location(lat, lon)
+        except ValueError as e:
+            return JSONResponse({"error": f"Invalid coordinates: {str(e)}"}, status_code=400)
+        weather_data = await _cached_weather(location)
+        description = await async_cached_description(weather_data)
+        return JSONResponse({"description": description})
+    except Exception as e:
+        logger.error(f"Error generating weather description: {str(e)}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+async def weather_description_stream(request):
+    try:
+        lat = request.query_params.get('lat')
+        lon = request.query_params.get('lon')
+
+        if not lat or not lon:
+            return JSONResponse({"error": "Latitude and longitude are required"}, status_code=400)
+
+        try:
+            location = quantize_location(lat, lon)
+        except ValueError as e:
+            return JSONResponse({"error": f"Invalid coordinates: {str(e)}"}, status_code=400)
+        weather_data = await _cached_weather(location)
+
+        async def generate():
+            async for name, data in async_stream_description(weather_data):
+                yield sse.event(name, data)
+        return StreamingResponse(generate(), media_type='text/event-stream', headers=sse.STREAM_HEADERS)
+    except Exception as e:
+        logger.error(f"Error generating weather description: {str(e)}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+async def weather_description_batch(request):
+    try:
+        try:
+            body = json_codec.loads(await request.body())
+        except ValueError:
+            body = None
+        locations = parse_locations(body)
+        return JSONResponse({"results": await async_fetch_description_batch(cache, locations)})
+    except BatchRequestError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except Exception as e:
+        logger.error(f"Error generating batch weather descriptions: {str(e)}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+async def dashboard(request):
+    try:
+        lat = request.query_params.get('lat')
+        lon = request.query_params.get('lon')
+
+        if not lat or not lon:
+            return JSONResponse({"error": "Latitude and longitude are required"}, status_code=400)
+
+        try:
+            location = quantize_location(lat, lon)
+        except ValueError as e:
+            return JSONResponse({"error": f"Invalid coordinates: {str(e)}"}, status_code=400)
+        describe = request.query_params.get('description', 'true').lower() != 'false'
+        forecast_view = request.query_params.get('forecast_view', forecast_updates.RAW)
+        if forecast_view not in forecast_updates.VIEWS:
+            return JSONResponse({"error": f"Unknown forecast view: {forecast_view}"}, status_code=400)
+        return JSONResponse(await async_get_dashboard(cache, location, describe, forecast_view))
+    except Exception as e:
+        logger.error(f"Error fetching dashboard data: {str(e)}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+async def history(request):
+    try:
+        lat = request.query_params.get('lat')
+        lon = request.query_params.get('lon')
+
+        if not lat or not lon:
+            return JSONResponse({"error": "Latitude and longitude are required"}, status_code=400)
+        if not observation_store.enabled():
+            return JSONResponse({"error": "Observation history is disabled"}, status_code=503)
+
+        try:
+            location = quantize_location(lat, lon)
+            hours = float(request.query_params.get('hours', 24))
+            if hours <= 0:
+                raise ValueError("hours must be positive")
+        except ValueError as e:
+            return JSONResponse({"error": f"Invalid parameters: {str(e)}"}, status_code=400)
+        return JSONResponse({
+            "location": {"lat": location.lat, "lon": location.lon},
+            "hours": hours,
+            "observations": await observation_store.async_history(location.lat, location.lon, hours)
+        })
+    except Exception as e:
+        logger.error(f"Error fetching observation history: {str(e)}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+async def health_check(request):
+    return JSONResponse({"status": "ok"}, status_code=200)
+
+async def metrics_endpoint(request):
+    return JSONResponse({
+        "counters": metrics.snapshot(),
+        "cache_hit_rates": metrics.hit_rates(),
+        "upstream_quota": await run_in_threadpool(upstream_governor.status)
+    }, status_code=200)
+
+async def status_endpoint(request):
+    circuits = circuit_breaker.status()
+    degraded = any(circuit['state'] != circuit_breaker.CLOSED for circuit in circuits.values())
+    return JSONResponse({
+        "status": "degraded" if degraded else "ok",
+        "circuits": circuits,
+        "upstream_quota": await run_in_threadpool(upstream_governor.status)
+    }, status_code=200)
+
+routes = [
+    Route('/api/weather', weather, methods=['GET']),
+    Route('/api/weather/batch', weather_batch, methods=['POST']),
+    Route('/api/forecast', forecast, methods=['GET']),
+    Route('/api/heatmap', heatmap, methods=['GET']),
+    Route('/api/weather_description', weather_description, methods=['GET']),
+    Route('/api/weather_description/stream', weather_description_stream, methods=['GET']),
+    Route('/api/weather_description/batch', weather_description_batch, methods=['POST']),
+    Route('/api/dashboard', dashboard, methods=['GET']),
+    Route('/api/history', history, methods=['GET']),
+    Route('/api/health', health_check, methods=['GET']),
+    Route('/api/metrics', metrics_endpoint, methods=['GET']),
+    Route('/api/status', status_endpoint, methods=['GET'])
+]
+
+middleware = [
+    Middleware(
+        CORSMiddleware,
+        allow_origins=get_allowed_origins(),
+        allow_methods=["GET", "POST", "OPTIONS"],
+        allow_headers=["Content-Type", "Authorization", "If-None-Match", "If-Modified-Since"],
+        expose_headers=["ETag", "X-Raster-Width", "X-Raster-Height", "X-Raster-Bounds", "X-Heatmap-Missing-Tiles"],
+        allow_credentials=True
+    )
+]
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await http_client.close_async_client()
+
+app = Starlette(routes=routes, middleware=middleware, lifespan=lifespan)
@@ -0,0 +1,69 @@
+"""
+Microbenchmark of the JSON backends on representative payloads.
+
+Times encoding the forecast and heatmap responses and decoding the upstream
+forecast and /box/city payloads with the standard library and with orjson:
+
+    cd backend && python -m benchmarks.bench_json --number 500
+"""
+
+import json
+import timeit
+import argparse
+import orjson
+from services import city_snapshot, weather_service
+from benchmarks.stub_upstream import box_payload
+
+def _upstream_forecast():
+    # Shaped like a 5 day / 3 hour OpenWeatherMap forecast
+    return {
+        "city": {"name": "New York", "country": "US", "coord": {"lat": 40.7128, "lon": -74.006}},
+        "list": [
+            {
+                "dt": 1700000000 + i * 10800,
+                "main": {
+                    "temp": 10 + i * 0.37, "feels_like": 9 + i * 0.31, "temp_min": 8 + i * 0.29,
+                    "temp_max": 12 + i * 0.41, "humidity": 40 + i % 50, "pressure": 1000 + i % 30
+                },
+                "weather": [{"id": 800 + i % 4, "main": "Clouds", "description": "scattered clouds", "icon": "03d"}],
+                "wind": {"speed": 2 + i * 0.13, "deg": (i * 37) % 360},
+                "clouds": {"all": (i * 11) % 100},
+                "pop": round((i % 10) / 10, 1)
+            }
+            for i in range(40)
+        ]
+    }
+
+def _payloads():
+    upstream_forecast = _upstream_forecast()
+    upstream_box = box_payload(-130, 20, -60, 60)
+    heatmap = city_snapshot.heatmap_points(city_snapshot.from_box_response(upstream_box), "temperature")
+    return {
+        "encode forecast": ("dumps", weather_service._parse_forecast(upstream_forecast)),
+        "encode heatmap": ("dumps", heatmap),
+        "decode forecast": ("loads", json.dumps(upstream_forecast).encode()),
+        "decode box/city": ("loads", json.dumps(upstream_box).encode())
+    }
+
+def _time(fn, payload, number):
+    return min(timeit.repeat(lambda: fn(payload), number=number, repeat=3)) / number * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--number", type=int, default=500, help="Calls per timing run")
+    args = parser.parse_args()
+
+    backends = {
+        "dumps": {"json": lambda obj: json.dumps(obj, separators=(",", ":")).encode(), "orjson": orjson.dumps},
+        "loads": {"json": json.loads, "orjson": orjson.loads}
+    }
+
+    print(f"{'payload':<18}{'bytes':>9}{'json us':>10}{'orjson us':>11}{'speedup':>9}")
+    for name, (operation, payload) in _payloads().items():
+        size = len(payload) if operation == "loads" else len(orjson.dumps(payload))
+        stdlib = _time(backends[operation]["json"], payload, args.number)
+        fast = _time(backends[operation]["orjson"], payload, args.number)
+        print(f"{name:<18}{size:>9}{stdlib:>10.1f}{fast:>11.1f}{stdlib / fast:>8.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Load benchmark comparing the sync (gunicorn) and async (uvicorn) serving modes.
+
+Both modes are started as real servers pointed at a local stub upstream, then
+hit with the same number of concurrent /api/weather requests for distinct
+locations, so every request is a cache miss bound by upstream latency:
+
+    cd backend && python -m benchmarks.bench_serving --requests 400 --concurrency 200
+"""
+
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import statistics
+import subprocess
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _wait_until_healthy(url, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{url}/api/health", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not become healthy")
+
+def _start_stub(port, latency):
+    # Own process, so the stub doesn't compete with the load generator for the GIL
+    return subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.stub_upstream", "--port", str(port), "--latency", str(latency)],
+        cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+def _start_server(mode, port, upstream_url, workers):
+    env = dict(
+        os.environ,
+        OPENWEATHER_BASE_URL=upstream_url,
+        OPENWEATHER_API_KEY="benchmark",
+        OPENAI_API_KEY="benchmark",
+        CACHE_BACKEND="simple",
+        FLASK_ENV="production",
+        # The stub has no quota, and the benchmark measures serving capacity
+        UPSTREAM_CALLS_PER_MINUTE="0"
+    )
+    if mode == "sync":
+        command = [sys.executable, "-m", "gunicorn", "--workers", str(workers),
+                   "--bind", f"127.0.0.1:{port}", "--log-level", "warning", "main:app"]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "asgi:app", "--workers", "1",
+                   "--port", str(port), "--log-level", "warning"]
+    return subprocess.Popen(command, cwd=BACKEND_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+async def _run_load(url, requests, concurrency, offset):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+    # Small clients, so the generator isn't slowed by one huge connection pool
+    shard_size = 10
+    limits = httpx.Limits(max_connections=shard_size, max_keepalive_connections=shard_size)
+    clients = [httpx.AsyncClient(limits=limits, timeout=60) for _ in range(-(-concurrency // shard_size))]
+
+    try:
+        async def one(i):
+            nonlocal errors
+            # Distinct grid cells so every request misses the cache
+            params = {"lat": f"{offset + (i // 100) * 0.05:.2f}", "lon": f"{(i % 100) * 0.05:.2f}"}
+            async with semaphore:
+                started = time.perf_counter()
+                client = clients[i % len(clients)]
+                response = await client.get(f"{url}/api/weather", params=params)
+                latencies.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*[one(i) for i in range(requests)])
+        elapsed = time.perf_counter() - started
+    finally:
+        for client in clients:
+            await client.aclose()
+
+    latencies.sort()
+    return {
+        "throughput": requests / elapsed,
+        "p50": statistics.median(latencies),
+        "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "errors": errors
+    }
+
+def benchmark(mode, upstream_url, requests, concurrency, workers, offset):
+    port = _free_port()
+    server = _start_server(mode, port, upstream_url, workers)
+    try:
+        url = f"http://127.0.0.1:{port}"
+        _wait_until_healthy(url)
+        return asyncio.run(_run_load(url, requests, concurrency, offset))
+    finally:
+        server.terminate()
+        server.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare sync and async serving modes")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn sync workers")
+    parser.add_argument("--latency", type=float, default=0.2, help="stub upstream latency in seconds")
+    args = parser.parse_args()
+
+    stub_port = _free_port()
+    stub = _start_stub(stub_port, args.latency)
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    time.sleep(1)
+    print(f"{args.requests} requests, concurrency {args.concurrency}, upstream latency {args.latency}s")
+    print(f"{'mode':<28}{'req/s':>10}{'p50 (ms)':>12}{'p99 (ms)':>12}{'errors':>8}")
+
+    try:
+        for index, (mode, label) in enumerate([
+            ("sync", f"sync (gunicorn x{args.workers})"),
+            ("async", "async (uvicorn x1)")
+        ]):
+            result = benchmark(mode, stub_url, args.requests, args.concurrency, args.workers, offset=index * 20)
+            print(f"{label:<28}{result['throughput']:>10.1f}{result['p50'] * 1000:>12.1f}"
+                  f"{result['p99'] * 1000:>12.1f}{result['errors']:>8}")
+    finally:
+        stub.terminate()
+        stub.wait()
+
+if __name__ == "__main__":
+    main()
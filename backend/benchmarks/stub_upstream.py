@@ -0,0 +1,145 @@
+"""
+Stub OpenWeatherMap server for local benchmarks.
+
+Answers /weather, /forecast and /box/city with realistic payloads after a
+configurable delay, so benchmarks measure how the backend handles upstream
+latency without touching the real API:
+
+    python -m benchmarks.stub_upstream --port 8900 --latency 0.2
+"""
+
+import json
+import time
+import asyncio
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+
+def weather_payload(lat, lon):
+    return {
+        "coord": {"lat": lat, "lon": lon},
+        "weather": [{"id": 800, "main": "Clear", "description": "clear sky", "icon": "01d"}],
+        "main": {"temp": 20.5, "feels_like": 19.8, "temp_min": 18.1, "temp_max": 22.3,
+                 "pressure": 1013, "humidity": 60},
+        "visibility": 10000,
+        "wind": {"speed": 3.6, "deg": 250},
+        "clouds": {"all": 5},
+        "dt": int(time.time()),
+        "sys": {"country": "US"},
+        "name": "Stubville"
+    }
+
+def forecast_payload(lat, lon):
+    now = int(time.time())
+    return {
+        "list": [
+            {
+                "dt": now + i * 10800,
+                "main": {"temp": 15 + i % 8, "feels_like": 14 + i % 8, "temp_min": 13 + i % 8,
+                         "temp_max": 17 + i % 8, "pressure": 1010 + i % 5, "humidity": 50 + i % 30},
+                "weather": [{"id": 500 if i % 6 == 0 else 800, "main": "Rain" if i % 6 == 0 else "Clear",
+                             "description": "light rain" if i % 6 == 0 else "clear sky", "icon": "01d"}],
+                "clouds": {"all": (i * 7) % 100},
+                "wind": {"speed": 2 + i % 5, "deg": (i * 30) % 360},
+                "pop": (i % 10) / 10
+            }
+            for i in range(40)
+        ],
+        "city": {"name": "Stubville", "country": "US", "coord": {"lat": lat, "lon": lon}}
+    }
+
+def box_payload(west, south, east, north):
+    cities = []
+    for i in range(200):
+        cities.append({
+            "coord": {"lat": south + (north - south) * ((i * 37) % 200) / 200,
+                      "lon": west + (east - west) * ((i * 91) % 200) / 200},
+            "main": {"temp": -10 + (i * 13) % 45, "humidity": (i * 17) % 100, "pressure": 990 + (i * 3) % 40},
+            "clouds": {"all": (i * 29) % 100},
+            "weather": [{"id": 500 if i % 4 == 0 else 800}]
+        })
+    return {"list": cities}
+
+def _payload_for(path, query):
+    if path.endswith("/weather"):
+        return weather_payload(float(query.get("lat", 0)), float(query.get("lon", 0)))
+    if path.endswith("/forecast"):
+        return forecast_payload(float(query.get("lat", 0)), float(query.get("lon", 0)))
+    if path.endswith("/box/city"):
+        west, south, east, north = [float(part) for part in query["bbox"].split(",")[:4]]
+        return box_payload(west, south, east, north)
+    return None
+
+class StubServer:
+    """Keep-alive HTTP/1.1 stub server running on its own event loop thread."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.request_count = 0
+        self.connection_count = 0
+        self.port = None
+        self._started = threading.Event()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    async def _handle(self, reader, writer):
+        self.connection_count += 1
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                target = head.split(b" ", 2)[1].decode()
+                url = urlparse(target)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+                await asyncio.sleep(self.latency)
+                payload = _payload_for(url.path, query)
+                self.request_count += 1
+
+                status = b"200 OK" if payload is not None else b"404 Not Found"
+                body = json.dumps(payload if payload is not None else {"message": "not found"}).encode()
+                writer.write(
+                    b"HTTP/1.1 " + status + b"\r\nContent-Type: application/json\r\n"
+                    b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _serve(self, port):
+        server = await asyncio.start_server(self._handle, "127.0.0.1", port, backlog=1024)
+        self.port = server.sockets[0].getsockname()[1]
+        self._started.set()
+        async with server:
+            await server.serve_forever()
+
+    def serve_forever(self, port=0):
+        asyncio.run(self._serve(port))
+
+def start_stub(port=0, latency=0.2):
+    """
+    Start the stub server in a background thread.
+
+    Args:
+        port: Port to listen on, 0 picks a free one
+        latency: Delay in seconds before every response
+
+    Returns:
+        StubServer: The running server
+    """
+    server = StubServer(latency)
+    threading.Thread(target=server.serve_forever, args=(port,), daemon=True).start()
+    server._started.wait()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub OpenWeatherMap server")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    print(f"Stub upstream listening on http://127.0.0.1:{args.port} with {args.latency}s latency")
+    StubServer(args.latency).serve_forever(args.port)
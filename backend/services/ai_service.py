@@ -1,7 +1,11 @@
 import os
 import json
+import time
 import logging
-from openai import OpenAI
+import asyncio
+from openai import AsyncOpenAI, OpenAI
+from services import json_codec
+from services.circuit_breaker import openai_breaker
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -9,77 +13,402 @@ logger = logging.getLogger(__name__)
 
 # OpenAI configuration
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+# Upper bound on a single OpenAI call, which may keep running after its request gave up
+OPENAI_TIMEOUT = float(os.environ.get("OPENAI_TIMEOUT", 30))
 # Initialize the OpenAI client without any additional parameters to avoid errors
 # The 'proxies' parameter was causing issues in the deployment environment
-openai = OpenAI(api_key=OPENAI_API_KEY)
+openai = OpenAI(api_key=OPENAI_API_KEY, timeout=OPENAI_TIMEOUT)
+# Async client used by the ASGI serving mode
+async_openai = AsyncOpenAI(api_key=OPENAI_API_KEY, timeout=OPENAI_TIMEOUT)
 
-def generate_weather_description(weather_data):
+SYSTEM_PROMPT = "You are a helpful meteorologist providing weather insights."
+
+# Locations described per request by the batch API; the instructions are sent once per request
+AI_BATCH_SIZE = int(os.environ.get("AI_BATCH_SIZE", 20))
+# Output tokens budgeted per location in a batch request
+AI_BATCH_TOKENS_PER_LOCATION = int(os.environ.get("AI_BATCH_TOKENS_PER_LOCATION", 200))
+
+def _build_prompt(weather_data):
+    # Extract relevant weather information for the prompt
+    location_name = weather_data["location"]["name"]
+    country = weather_data["location"]["country"]
+    temp = weather_data["current"]["temp"]
+    feels_like = weather_data["current"]["feels_like"]
+    humidity = weather_data["current"]["humidity"]
+    wind_speed = weather_data["current"]["wind_speed"]
+    weather_main = weather_data["current"]["weather"]["main"]
+    weather_desc = weather_data["current"]["weather"]["description"]
+    
+    # Create prompt for OpenAI
+    return f"""As a meteorologist, provide a helpful, informative, and conversational description of the current weather in {location_name}, {country}.
+    
+    Current conditions:
+    - Temperature: {temp}°C (feels like {feels_like}°C)
+    - Weather: {weather_main} ({weather_desc})
+    - Humidity: {humidity}%
+    - Wind Speed: {wind_speed} m/s
+    
+    Include:
+    1. A brief summary of the current conditions
+    2. How it feels outside (hot, cold, pleasant, etc.)
+    3. Any relevant advice based on the weather (e.g., umbrella needed, sunscreen recommended)
+    4. A brief comment on how this weather might affect outdoor activities
+    
+    Keep your response concise (3-4 sentences) and friendly. Do not include any data beyond what's provided.
     """
-    Generate an AI-powered description of the weather.
+
+def request_ai_description(weather_data):
+    """
+    Request a weather description from OpenAI without falling back.
     
     Args:
         weather_data: Weather data for a location
         
     Returns:
         str: AI-generated weather description
+        
+    Raises:
+        CircuitOpenError: If OpenAI's circuit breaker is open
+        Exception: If the API call fails or returns an incomplete response
     """
+    prompt = _build_prompt(weather_data)
+    
+    # Fail fast while OpenAI is known to be down or slow
+    openai_breaker.before_call()
+    started = time.monotonic()
     try:
-        # Extract relevant weather information for the prompt
-        location_name = weather_data["location"]["name"]
-        country = weather_data["location"]["country"]
-        temp = weather_data["current"]["temp"]
-        feels_like = weather_data["current"]["feels_like"]
-        humidity = weather_data["current"]["humidity"]
-        wind_speed = weather_data["current"]["wind_speed"]
-        weather_main = weather_data["current"]["weather"]["main"]
-        weather_desc = weather_data["current"]["weather"]["description"]
-        
-        # Create prompt for OpenAI
-        prompt = f"""As a meteorologist, provide a helpful, informative, and conversational description of the current weather in {location_name}, {country}.
-        
-        Current conditions:
-        - Temperature: {temp}°C (feels like {feels_like}°C)
-        - Weather: {weather_main} ({weather_desc})
-        - Humidity: {humidity}%
-        - Wind Speed: {wind_speed} m/s
-        
-        Include:
-        1. A brief summary of the current conditions
-        2. How it feels outside (hot, cold, pleasant, etc.)
-        3. Any relevant advice based on the weather (e.g., umbrella needed, sunscreen recommended)
-        4. A brief comment on how this weather might affect outdoor activities
-        
-        Keep your response concise (3-4 sentences) and friendly. Do not include any data beyond what's provided.
-        """
-        
         # Call the OpenAI API
         # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
         # do not change this unless explicitly requested by the user
         response = openai.chat.completions.create(
             model="gpt-4o",
             messages=[
-                {"role": "system", "content": "You are a helpful meteorologist providing weather insights."},
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=200,
+            temperature=0.7,
+        )
+        description = _extract_description(response)
+    except Exception:
+        openai_breaker.record_failure()
+        raise
+    openai_breaker.record_success(time.monotonic() - started)
+    return description
+
+def _extract_description(response):
+    # Extract the generated description with proper error handling
+    if response and response.choices and len(response.choices) > 0:
+        if response.choices[0].message and response.choices[0].message.content:
+            return response.choices[0].message.content.strip()
+    
+    raise ValueError("Incomplete response from OpenAI API")
+
+async def async_request_ai_description(weather_data):
+    """
+    Request a weather description from OpenAI without blocking or falling back.
+    
+    Args:
+        weather_data: Weather data for a location
+        
+    Returns:
+        str: AI-generated weather description
+        
+    Raises:
+        CircuitOpenError: If OpenAI's circuit breaker is open
+        Exception: If the API call fails or returns an incomplete response
+    """
+    prompt = _build_prompt(weather_data)
+    
+    openai_breaker.before_call()
+    started = time.monotonic()
+    try:
+        response = await async_openai.chat.completions.create(
+            model="gpt-4o",
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
                 {"role": "user", "content": prompt}
             ],
             max_tokens=200,
             temperature=0.7,
         )
+        description = _extract_description(response)
+    except Exception:
+        openai_breaker.record_failure()
+        raise
+    openai_breaker.record_success(time.monotonic() - started)
+    return description
+
+def _extract_delta(chunk):
+    # Stream chunks carry the next piece of text, if any, in choices[0].delta
+    if chunk and chunk.choices and chunk.choices[0].delta:
+        return chunk.choices[0].delta.content
+    return None
+
+def stream_ai_description(weather_data):
+    """
+    Stream a weather description from OpenAI as it is generated.
+    
+    Args:
+        weather_data: Weather data for a location
+        
+    Yields:
+        str: Next piece of the AI-generated description
+        
+    Raises:
+        CircuitOpenError: If OpenAI's circuit breaker is open
+        Exception: If the API call fails
+    """
+    prompt = _build_prompt(weather_data)
+    
+    openai_breaker.before_call()
+    started = time.monotonic()
+    first_token = None
+    try:
+        with openai.chat.completions.create(
+            model="gpt-4o",
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=200,
+            temperature=0.7,
+            stream=True,
+        ) as stream:
+            for chunk in stream:
+                text = _extract_delta(chunk)
+                if text:
+                    if first_token is None:
+                        first_token = time.monotonic() - started
+                    yield text
+    except Exception:
+        openai_breaker.record_failure()
+        raise
+    except BaseException:
+        # Closed before the end, e.g. the client disconnected, so there is no outcome to record
+        openai_breaker.release_probe()
+        raise
+    # The latency SLO applies to the time to first token when streaming
+    openai_breaker.record_success(first_token)
+
+async def async_stream_ai_description(weather_data):
+    """
+    Async counterpart of stream_ai_description for the ASGI serving mode.
+    
+    Args:
+        weather_data: Weather data for a location
         
-        # Extract the generated description with proper error handling
-        if response and response.choices and len(response.choices) > 0:
-            if response.choices[0].message and response.choices[0].message.content:
-                description = response.choices[0].message.content.strip()
-                return description
+    Yields:
+        str: Next piece of the AI-generated description
+        
+    Raises:
+        CircuitOpenError: If OpenAI's circuit breaker is open
+        Exception: If the API call fails
+    """
+    prompt = _build_prompt(weather_data)
+    
+    openai_breaker.before_call()
+    started = time.monotonic()
+    first_token = None
+    try:
+        stream = await async_openai.chat.completions.create(
+            model="gpt-4o",
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=200,
+            temperature=0.7,
+            stream=True,
+        )
+        async with stream:
+            async for chunk in stream:
+                text = _extract_delta(chunk)
+                if text:
+                    if first_token is None:
+                        first_token = time.monotonic() - started
+                    yield text
+    except Exception:
+        openai_breaker.record_failure()
+        raise
+    except BaseException:
+        # Closed before the end, e.g. the client disconnected, so there is no outcome to record
+        openai_breaker.release_probe()
+        raise
+    openai_breaker.record_success(first_token)
+
+def generate_weather_description(weather_data):
+    """
+    Generate an AI-powered description of the weather.
+    
+    Args:
+        weather_data: Weather data for a location
         
-        # If we get here, something went wrong with the response structure
-        logger.warning("Incomplete response from OpenAI API, using fallback")
+    Returns:
+        str: AI-generated weather description
+    """
+    try:
+        return request_ai_description(weather_data)
+    except Exception as e:
+        logger.error(f"Error generating weather description with OpenAI: {str(e)}")
+        # Fallback to a basic description if AI fails
         return generate_fallback_description(weather_data)
+
+async def async_generate_weather_description(weather_data):
+    """
+    Generate an AI-powered description of the weather without blocking.
     
+    Args:
+        weather_data: Weather data for a location
+        
+    Returns:
+        str: AI-generated weather description
+    """
+    try:
+        return await async_request_ai_description(weather_data)
     except Exception as e:
         logger.error(f"Error generating weather description with OpenAI: {str(e)}")
         # Fallback to a basic description if AI fails
         return generate_fallback_description(weather_data)
 
+def _build_batch_prompt(weather_list):
+    # One line of conditions per location, numbered so results can be matched back
+    lines = []
+    for index, weather_data in enumerate(weather_list):
+        location = weather_data["location"]
+        current = weather_data["current"]
+        lines.append(
+            f"{index}. {location['name']}, {location['country']}: "
+            f"{current['temp']}°C (feels like {current['feels_like']}°C), "
+            f"{current['weather']['main']} ({current['weather']['description']}), "
+            f"humidity {current['humidity']}%, wind {current['wind_speed']} m/s"
+        )
+    conditions = "\n".join(lines)
+    
+    return f"""As a meteorologist, provide a helpful, informative, and conversational description of the current weather at each of the numbered locations below.
+    
+    For each location include a brief summary of the conditions, how it feels outside, any relevant advice (e.g., umbrella needed, sunscreen recommended) and how the weather might affect outdoor activities.
+    
+    Keep each description concise (3-4 sentences) and friendly. Do not include any data beyond what's provided.
+    
+    Answer with a JSON object of the form {{"descriptions": [{{"id": <number>, "description": "<text>"}}]}} with one entry per location.
+    
+    Locations:
+    {conditions}
+    """
+
+def _extract_batch_descriptions(response, count):
+    # Missing, duplicate or malformed entries are left as None
+    descriptions = [None] * count
+    items = json_codec.loads(_extract_description(response)).get("descriptions")
+    if not isinstance(items, list):
+        raise ValueError("Batch response from OpenAI API has no descriptions")
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        index, text = item.get("id"), item.get("description")
+        if isinstance(index, int) and 0 <= index < count and isinstance(text, str) and text.strip():
+            descriptions[index] = text.strip()
+    return descriptions
+
+def _batch_request_kwargs(weather_list):
+    return {
+        "model": "gpt-4o",
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": _build_batch_prompt(weather_list)}
+        ],
+        "max_tokens": AI_BATCH_TOKENS_PER_LOCATION * len(weather_list),
+        "temperature": 0.7,
+        "response_format": {"type": "json_object"},
+    }
+
+def _chunks(weather_list):
+    size = max(1, AI_BATCH_SIZE)
+    return [weather_list[start:start + size] for start in range(0, len(weather_list), size)]
+
+def _request_batch(weather_list):
+    openai_breaker.before_call()
+    try:
+        response = openai.chat.completions.create(**_batch_request_kwargs(weather_list))
+        descriptions = _extract_batch_descriptions(response, len(weather_list))
+    except Exception:
+        openai_breaker.record_failure()
+        raise
+    # The latency SLO is for single descriptions, so batches don't count against it
+    openai_breaker.record_success()
+    return descriptions
+
+async def _async_request_batch(weather_list):
+    openai_breaker.before_call()
+    try:
+        response = await async_openai.chat.completions.create(**_batch_request_kwargs(weather_list))
+        descriptions = _extract_batch_descriptions(response, len(weather_list))
+    except Exception:
+        openai_breaker.record_failure()
+        raise
+    openai_breaker.record_success()
+    return descriptions
+
+def _log_batch_failure(chunk, error):
+    logger.error(f"Error generating {len(chunk)} weather descriptions with OpenAI: {str(error)}")
+    return [None] * len(chunk)
+
+def request_ai_descriptions(weather_list):
+    """
+    Request descriptions for many locations from OpenAI, AI_BATCH_SIZE per call.
+    
+    Each call carries the instructions once and asks for a JSON object with
+    one description per location, so the prompt overhead is shared.
+    
+    Args:
+        weather_list: Weather data for each location
+        
+    Returns:
+        list: AI-generated description per location, in order, or None where
+        the call failed or its response had no usable entry for the location
+    """
+    descriptions = []
+    for chunk in _chunks(weather_list):
+        try:
+            descriptions.extend(_request_batch(chunk))
+        except Exception as e:
+            descriptions.extend(_log_batch_failure(chunk, e))
+    return descriptions
+
+async def async_request_ai_descriptions(weather_list):
+    """
+    Async counterpart of request_ai_descriptions; the calls run concurrently.
+    
+    Args:
+        weather_list: Weather data for each location
+        
+    Returns:
+        list: AI-generated description or None per location, in order
+    """
+    chunks = _chunks(weather_list)
+    results = await asyncio.gather(*[_async_request_batch(chunk) for chunk in chunks], return_exceptions=True)
+    descriptions = []
+    for chunk, result in zip(chunks, results):
+        descriptions.extend(_log_batch_failure(chunk, result) if isinstance(result, Exception) else result)
+    return descriptions
+
+def generate_weather_descriptions(weather_list):
+    """
+    Generate AI-powered descriptions for many locations in batched calls.
+    
+    Args:
+        weather_list: Weather data for each location
+        
+    Returns:
+        list: Description per location, falling back to a basic description
+        for locations the AI didn't describe
+    """
+    return [
+        description if description is not None else generate_fallback_description(weather_data)
+        for weather_data, description in zip(weather_list, request_ai_descriptions(weather_list))
+    ]
+
 def generate_fallback_description(weather_data):
     """
     Generate a basic weather description without AI as a fallback.
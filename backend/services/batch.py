@@ -0,0 +1,276 @@
+"""
+Batch current-weather lookups for many locations.
+
+Locations are quantized and deduplicated, cached entries are served
+directly, and only the misses are fetched from OpenWeatherMap through a
+bounded worker pool behind a shared rate limit, so a client polling
+hundreds of saved locations can't burst past the upstream quota.
+
+Description batches build on the weather batch and generate the missing AI
+descriptions with a few batched OpenAI calls instead of one per location.
+"""
+
+import os
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from services import metrics, weather_service
+from services.cache_backends import async_call
+from services.cache_keys import quantize_location, location_cache_key
+from services.data_cache import async_cached_fetch, cached_fetch
+from services.description_cache import async_cached_descriptions, cached_descriptions
+from services.rate_limit import RateLimiter
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Batch configuration
+BATCH_MAX_LOCATIONS = int(os.environ.get("BATCH_MAX_LOCATIONS", 500))
+BATCH_MAX_WORKERS = int(os.environ.get("BATCH_MAX_WORKERS", 8))
+# Upstream calls per second made by batch requests, 0 disables the limit
+BATCH_RATE_LIMIT = float(os.environ.get("BATCH_RATE_LIMIT", 20))
+
+_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS, thread_name_prefix="weather-batch")
+_rate_limiter = RateLimiter(BATCH_RATE_LIMIT) if BATCH_RATE_LIMIT > 0 else None
+
+class BatchRequestError(ValueError):
+    """The batch request body is malformed or too large."""
+
+def parse_locations(body):
+    """
+    Validate a batch request body.
+
+    Accepts {"locations": [...]} or a bare list, where each item is either
+    {"lat": ..., "lon": ...} or a [lat, lon] pair.
+
+    Args:
+        body: Decoded JSON request body
+
+    Returns:
+        list: (lat, lon) tuple per item, or None for items that aren't coordinates
+
+    Raises:
+        BatchRequestError: If the body isn't a list of locations or is too large
+    """
+    items = body.get("locations") if isinstance(body, dict) else body
+    if not isinstance(items, list):
+        raise BatchRequestError("Request body must contain a list of locations")
+    if len(items) > BATCH_MAX_LOCATIONS:
+        raise BatchRequestError(f"At most {BATCH_MAX_LOCATIONS} locations are allowed per request")
+
+    locations = []
+    for item in items:
+        if isinstance(item, dict):
+            locations.append((item.get("lat"), item.get("lon")))
+        elif isinstance(item, (list, tuple)) and len(item) == 2:
+            locations.append(tuple(item))
+        else:
+            locations.append(None)
+    return locations
+
+def _plan(locations):
+    """
+    Quantize the requested locations and group them by cache key.
+
+    Returns:
+        tuple: (results, groups) where results holds the per-item errors for
+        invalid coordinates and groups maps each cache key to its location
+        and the indexes of the items that asked for it
+    """
+    results = [None] * len(locations)
+    groups = {}
+    for index, coordinates in enumerate(locations):
+        try:
+            if coordinates is None:
+                raise ValueError("Expected {\"lat\": ..., \"lon\": ...} or [lat, lon]")
+            location = quantize_location(*coordinates)
+        except (TypeError, ValueError) as e:
+            results[index] = {"error": f"Invalid coordinates: {str(e)}"}
+            continue
+        key = location_cache_key('weather', location)
+        groups.setdefault(key, (location, []))[1].append(index)
+
+    metrics.incr("batch.locations", len(locations))
+    metrics.incr("batch.unique", len(groups))
+    return results, groups
+
+def _item(location, data=None, error=None):
+    item = {"lat": location.lat, "lon": location.lon}
+    if error is None:
+        item["data"] = data
+    else:
+        item["error"] = error
+    return item
+
+def _limited_fetch(location):
+    if _rate_limiter is not None:
+        _rate_limiter.acquire()
+    return weather_service.get_weather_data(location.lat, location.lon)
+
+async def _async_limited_fetch(location):
+    if _rate_limiter is not None:
+        await _rate_limiter.async_acquire()
+    return await weather_service.async_get_weather_data(location.lat, location.lon)
+
+def _fetch_one(cache, key, location):
+    try:
+        data = cached_fetch(cache, 'weather', key, lambda: _limited_fetch(location))
+        return _item(location, data=data)
+    except Exception as e:
+        logger.error(f"Error fetching batch weather for {key}: {str(e)}")
+        metrics.incr("batch.failed")
+        return _item(location, error=str(e))
+
+async def _async_fetch_one(cache, key, location, semaphore):
+    try:
+        async with semaphore:
+            data = await async_cached_fetch(cache, 'weather', key, lambda: _async_limited_fetch(location))
+        return _item(location, data=data)
+    except Exception as e:
+        logger.error(f"Error fetching batch weather for {key}: {str(e)}")
+        metrics.incr("batch.failed")
+        return _item(location, error=str(e))
+
+def iter_weather_batch(cache, locations):
+    """
+    Fetch current weather for many locations, yielding results as they complete.
+
+    Cached locations are yielded first without touching the worker pool.
+
+    Args:
+        cache: Flask-Caching or cachelib cache instance
+        locations: Output of parse_locations
+
+    Yields:
+        tuple: (index, result) where result holds "lat", "lon" and either
+        "data" or "error"
+    """
+    results, groups = _plan(locations)
+    for index, result in enumerate(results):
+        if result is not None:
+            yield index, result
+
+    futures = {}
+    for key, (location, indexes) in groups.items():
+        if cache.has(key):
+            result = _fetch_one(cache, key, location)
+            for index in indexes:
+                yield index, result
+        else:
+            futures[_executor.submit(_fetch_one, cache, key, location)] = indexes
+
+    metrics.incr("batch.fetched", len(futures))
+    for future in as_completed(futures):
+        result = future.result()
+        for index in futures[future]:
+            yield index, result
+
+def fetch_weather_batch(cache, locations):
+    """
+    Fetch current weather for many locations.
+
+    Args:
+        cache: Flask-Caching or cachelib cache instance
+        locations: Output of parse_locations
+
+    Returns:
+        list: One result per requested location, in request order
+    """
+    results = [None] * len(locations)
+    for index, result in iter_weather_batch(cache, locations):
+        results[index] = result
+    return results
+
+async def async_iter_weather_batch(cache, locations):
+    """
+    Async counterpart of iter_weather_batch for the ASGI serving mode.
+
+    Args:
+        cache: cachelib cache instance
+        locations: Output of parse_locations
+
+    Yields:
+        tuple: (index, result) in completion order
+    """
+    results, groups = _plan(locations)
+    for index, result in enumerate(results):
+        if result is not None:
+            yield index, result
+
+    semaphore = asyncio.Semaphore(BATCH_MAX_WORKERS)
+    tasks = {}
+    for key, (location, indexes) in groups.items():
+        if await async_call(cache, 'has', key):
+            result = await _async_fetch_one(cache, key, location, semaphore)
+            for index in indexes:
+                yield index, result
+        else:
+            tasks[asyncio.ensure_future(_async_fetch_one(cache, key, location, semaphore))] = indexes
+
+    metrics.incr("batch.fetched", len(tasks))
+    pending = set(tasks)
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            result = task.result()
+            for index in tasks[task]:
+                yield index, result
+
+async def async_fetch_weather_batch(cache, locations):
+    """
+    Async counterpart of fetch_weather_batch for the ASGI serving mode.
+
+    Args:
+        cache: cachelib cache instance
+        locations: Output of parse_locations
+
+    Returns:
+        list: One result per requested location, in request order
+    """
+    results = [None] * len(locations)
+    async for index, result in async_iter_weather_batch(cache, locations):
+        results[index] = result
+    return results
+
+def _describe(results, descriptions):
+    # Weather results are shared between duplicate locations, so build new items
+    described = iter(descriptions)
+    items = []
+    for result in results:
+        if "data" in result:
+            items.append({"lat": result["lat"], "lon": result["lon"], "description": next(described)})
+        else:
+            items.append(result)
+    return items
+
+def fetch_description_batch(cache, locations):
+    """
+    Get weather descriptions for many locations, e.g. to precompute popular cities.
+
+    Args:
+        cache: Flask-Caching or cachelib cache instance
+        locations: Output of parse_locations
+
+    Returns:
+        list: One result per requested location, in request order, holding
+        "lat", "lon" and either "description" or "error"
+    """
+    results = fetch_weather_batch(cache, locations)
+    descriptions = cached_descriptions([result["data"] for result in results if "data" in result])
+    return _describe(results, descriptions)
+
+async def async_fetch_description_batch(cache, locations):
+    """
+    Async counterpart of fetch_description_batch for the ASGI serving mode.
+
+    Args:
+        cache: cachelib cache instance
+        locations: Output of parse_locations
+
+    Returns:
+        list: One result per requested location, in request order
+    """
+    results = await async_fetch_weather_batch(cache, locations)
+    descriptions = await async_cached_descriptions([result["data"] for result in results if "data" in result])
+    return _describe(results, descriptions)
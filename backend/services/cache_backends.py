@@ -0,0 +1,342 @@
+"""
+Shared cache backends for Flask-Caching.
+
+Under gunicorn every worker used to warm its own SimpleCache. These backends
+let all workers share one cache tier instead:
+
+- ``SharedFileCache``: a size-bounded on-disk store shared by the workers of a
+  single host. Pointing ``CACHE_DIR`` at a tmpfs such as ``/dev/shm`` keeps the
+  entries in memory-backed pages.
+- ``CompactRedisCache``: any Redis-compatible server. Size is bounded by the
+  server's ``maxmemory`` setting with an LRU eviction policy.
+
+Both store values with a compact serializer (pickle, zlib-compressed above a
+small size threshold). Byte strings, such as pre-encoded response bodies, are
+stored as they are.
+
+Calls on either backend wait on file or network I/O, so the ASGI mode makes
+them through async_call, which runs them in a worker thread.
+"""
+
+import os
+import time
+import asyncio
+import fcntl
+import pickle
+import struct
+import zlib
+import logging
+import tempfile
+import cachelib
+from cachelib.serializers import BaseSerializer
+from flask_caching.backends.filesystemcache import FileSystemCache
+from flask_caching.backends.rediscache import RedisCache
+from flask_caching.backends.simplecache import SimpleCache
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Cache tier configuration
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "simple")
+CACHE_DEFAULT_TIMEOUT = int(os.environ.get("CACHE_DEFAULT_TIMEOUT", 300))
+CACHE_THRESHOLD = int(os.environ.get("CACHE_THRESHOLD", 2000))
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", 64 * 1024 * 1024))
+CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL", "redis://localhost:6379/0")
+CACHE_KEY_PREFIX = os.environ.get("CACHE_KEY_PREFIX", "weatherwizard:")
+
+# Values smaller than this are stored uncompressed
+COMPRESS_MIN_BYTES = 512
+# Writes between full scans of the shared file cache, which pick up other workers' writes
+EVICTION_SCAN_WRITES = 100
+
+_PICKLED = b"p"
+_COMPRESSED = b"z"
+_RAW = b"b"
+
+def default_cache_dir():
+    """
+    Get the default directory for the shared file cache.
+
+    Returns:
+        str: A directory under /dev/shm when available, else the temp dir
+    """
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, "weatherwizard-cache")
+
+class CompactSerializer(BaseSerializer):
+    """Pickle with the highest protocol, zlib-compressed for larger values; bytes as-is."""
+
+    def dumps(self, value, protocol=pickle.HIGHEST_PROTOCOL):
+        # Integers stay plain so Redis INCR/DECR keep working
+        if type(value) is int:
+            return str(value).encode("ascii")
+        # Bytes are usually compressed already, so don't pickle or compress again
+        if type(value) is bytes:
+            return _RAW + value
+
+        data = pickle.dumps(value, protocol)
+        if len(data) >= COMPRESS_MIN_BYTES:
+            return _COMPRESSED + zlib.compress(data)
+        return _PICKLED + data
+
+    def loads(self, bvalue):
+        if bvalue is None:
+            return None
+        try:
+            if bvalue.startswith(_COMPRESSED):
+                return pickle.loads(zlib.decompress(bvalue[1:]))
+            if bvalue.startswith(_PICKLED):
+                return pickle.loads(bvalue[1:])
+            if bvalue.startswith(_RAW):
+                return bvalue[1:]
+            return int(bvalue)
+        except (pickle.PickleError, zlib.error, ValueError, EOFError) as e:
+            logger.warning(f"Could not deserialize cached value: {str(e)}")
+            return None
+
+    def dump(self, value, f, protocol=pickle.HIGHEST_PROTOCOL):
+        f.write(self.dumps(value, protocol))
+
+    def load(self, f):
+        return self.loads(f.read())
+
+class SharedFileCache(FileSystemCache):
+    """
+    File cache shared by all workers on a host, bounded by item count and total bytes.
+
+    Writes are atomic (temp file + rename), so concurrent workers never read
+    partial entries. When the directory grows beyond ``max_bytes`` the least
+    recently written entries are evicted first. Each worker tracks the size
+    from its own writes and only scans the directory when that estimate
+    crosses the budget, or every EVICTION_SCAN_WRITES writes. Counters updated with inc()
+    and dec() keep their expiry and don't lose updates between workers.
+    """
+
+    serializer = CompactSerializer()
+
+    def __init__(self, cache_dir, threshold=500, max_bytes=0, **kwargs):
+        super().__init__(cache_dir, threshold=threshold, **kwargs)
+        self._max_bytes = max_bytes
+        self._estimated_bytes = None
+        self._writes_since_scan = 0
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        args.insert(0, config["CACHE_DIR"])
+        kwargs.update(
+            dict(
+                threshold=config["CACHE_THRESHOLD"],
+                max_bytes=config.get("CACHE_MAX_BYTES", 0),
+                ignore_errors=config["CACHE_IGNORE_ERRORS"],
+            )
+        )
+        return cls(*args, **kwargs)
+
+    def _entries(self):
+        entries = []
+        for fname in self._list_dir():
+            try:
+                stat = os.stat(fname)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, fname))
+        return entries
+
+    def total_bytes(self):
+        """
+        Get the total size of all cache entries.
+
+        Returns:
+            int: Size in bytes
+        """
+        return sum(size for _, size, _ in self._entries())
+
+    def set(self, key, value, timeout=None, mgmt_element=False):
+        result = super().set(key, value, timeout, mgmt_element)
+        if result and not mgmt_element:
+            self._evict_over_budget(keep=self._get_filename(key))
+        return result
+
+    def inc(self, key, delta=1):
+        """
+        Increment a counter, keeping the expiry it was created with.
+
+        Args:
+            key: Cache key of the counter
+            delta: Amount to add
+
+        Returns:
+            int: The new value, or None if it couldn't be written
+        """
+        lock_name = os.path.join(self._path, "counters" + self._fs_transaction_suffix)
+        with open(lock_name, "a") as lock:
+            # Serialize read-modify-write across workers
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            timeout = None
+            value = 0
+            try:
+                with open(self._get_filename(key), "rb") as f:
+                    expires = struct.unpack("I", f.read(4))[0]
+                    if expires == 0 or expires >= time.time():
+                        value = self.serializer.load(f) or 0
+                        timeout = max(1, int(expires - time.time())) if expires else 0
+            except (OSError, EOFError, struct.error):
+                pass
+            value += delta
+            return value if self.set(key, value, timeout) else None
+
+    def dec(self, key, delta=1):
+        """
+        Decrement a counter, keeping the expiry it was created with.
+
+        Args:
+            key: Cache key of the counter
+            delta: Amount to subtract
+
+        Returns:
+            int: The new value, or None if it couldn't be written
+        """
+        return self.inc(key, -delta)
+
+    def _evict_over_budget(self, keep):
+        if not self._max_bytes:
+            return
+
+        self._writes_since_scan += 1
+        if self._estimated_bytes is not None and self._writes_since_scan < EVICTION_SCAN_WRITES:
+            try:
+                # Overwrites count twice, which only makes the next scan come sooner
+                self._estimated_bytes += os.stat(keep).st_size
+            except FileNotFoundError:
+                pass
+            if self._estimated_bytes <= self._max_bytes:
+                return
+
+        self._writes_since_scan = 0
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        self._estimated_bytes = total
+        if total <= self._max_bytes:
+            return
+
+        # Oldest writes go first until we're back under the byte budget
+        for _, size, fname in sorted(entries):
+            if fname == keep:
+                continue
+            try:
+                os.remove(fname)
+                self._update_count(delta=-1)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                logger.warning(f"Could not evict cache file {fname}")
+                continue
+            total -= size
+            self._estimated_bytes = total
+            if total <= self._max_bytes:
+                break
+
+class CompactRedisCache(RedisCache):
+    """Redis-compatible cache storing values with the compact serializer."""
+
+    serializer = CompactSerializer()
+
+def cache_config(backend=None):
+    """
+    Build the Flask-Caching configuration for the selected cache tier.
+
+    Creating the cache never contacts the upstream weather API, and Redis
+    connections are only opened on first use.
+
+    Args:
+        backend: "simple", "filesystem" or "redis", defaults to CACHE_BACKEND
+
+    Returns:
+        dict: Flask-Caching configuration
+    """
+    backend = backend or CACHE_BACKEND
+    config = {
+        'CACHE_DEFAULT_TIMEOUT': CACHE_DEFAULT_TIMEOUT,
+        'CACHE_THRESHOLD': CACHE_THRESHOLD
+    }
+
+    if backend == "filesystem":
+        config.update({
+            'CACHE_TYPE': 'services.cache_backends.SharedFileCache',
+            'CACHE_DIR': os.environ.get("CACHE_DIR") or default_cache_dir(),
+            'CACHE_MAX_BYTES': CACHE_MAX_BYTES
+        })
+    elif backend == "redis":
+        config.update({
+            'CACHE_TYPE': 'services.cache_backends.CompactRedisCache',
+            'CACHE_REDIS_URL': CACHE_REDIS_URL,
+            'CACHE_KEY_PREFIX': CACHE_KEY_PREFIX
+        })
+    elif backend == "simple":
+        config['CACHE_TYPE'] = 'SimpleCache'
+    else:
+        raise ValueError(f"Unknown cache backend: {backend}")
+
+    logger.info(f"Using {backend} cache backend")
+    return config
+
+def create_cache(backend=None):
+    """
+    Create a cache instance for the selected tier without a Flask app.
+
+    Used by the ASGI serving mode, which shares the same cache tier (and
+    therefore the same entries) as the Flask app.
+
+    Args:
+        backend: "simple", "filesystem" or "redis", defaults to CACHE_BACKEND
+
+    Returns:
+        Cache backend instance
+    """
+    config = cache_config(backend)
+    cache_type = config['CACHE_TYPE']
+
+    if cache_type.endswith("SharedFileCache"):
+        return SharedFileCache(
+            config['CACHE_DIR'],
+            threshold=config['CACHE_THRESHOLD'],
+            max_bytes=config['CACHE_MAX_BYTES'],
+            default_timeout=config['CACHE_DEFAULT_TIMEOUT']
+        )
+    if cache_type.endswith("CompactRedisCache"):
+        from redis import from_url as redis_from_url
+        return CompactRedisCache(
+            host=redis_from_url(config['CACHE_REDIS_URL']),
+            key_prefix=config['CACHE_KEY_PREFIX'],
+            default_timeout=config['CACHE_DEFAULT_TIMEOUT']
+        )
+    return SimpleCache(threshold=config['CACHE_THRESHOLD'], default_timeout=config['CACHE_DEFAULT_TIMEOUT'])
+
+def blocks(cache):
+    """
+    Check whether calls on a cache wait on file or network I/O.
+
+    Args:
+        cache: Cache instance
+
+    Returns:
+        bool: True for filesystem and Redis caches, False for in-process ones
+    """
+    return isinstance(cache, (cachelib.FileSystemCache, cachelib.RedisCache))
+
+async def async_call(cache, method, *args, **kwargs):
+    """
+    Call a cache method without blocking the event loop.
+
+    Args:
+        cache: Cache instance
+        method: Name of the method, e.g. "get" or "set"
+        *args, **kwargs: Arguments of the method
+
+    Returns:
+        The method's return value
+    """
+    if not blocks(cache):
+        return getattr(cache, method)(*args, **kwargs)
+    return await asyncio.to_thread(getattr(cache, method), *args, **kwargs)
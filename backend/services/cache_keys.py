@@ -0,0 +1,173 @@
+"""
+Cache key normalization for location-based endpoints.
+
+Coordinates are snapped to a configurable grid (or geohash cell) before they
+are used as cache keys, so requests for the same place that differ only in
+formatting or by a few meters share one cached upstream result.
+"""
+
+import os
+from collections import namedtuple
+
+# Grid size in degrees used to snap coordinates (0.01° is roughly 1.1 km)
+CACHE_GRID_DEGREES = float(os.environ.get("CACHE_GRID_DEGREES", 0.01))
+# Geohash precision to use instead of the degree grid (0 disables geohash keys)
+CACHE_GEOHASH_PRECISION = int(os.environ.get("CACHE_GEOHASH_PRECISION", 0))
+
+_GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+# A snapped location: the cell identifier used in cache keys and the
+# representative coordinates used for the upstream call
+Location = namedtuple("Location", ["cell", "lat", "lon"])
+
+def parse_coordinates(lat, lon):
+    """
+    Parse and validate raw latitude/longitude values.
+
+    Args:
+        lat: Latitude as a string or number
+        lon: Longitude as a string or number
+
+    Returns:
+        tuple: (lat, lon) as floats
+
+    Raises:
+        ValueError: If the values are not numbers or are out of range
+    """
+    lat = float(lat)
+    lon = float(lon)
+    if not -90 <= lat <= 90 or not -180 <= lon <= 180:
+        raise ValueError("Latitude must be between -90 and 90 and longitude between -180 and 180")
+    return lat, lon
+
+def _grid_decimals(grid):
+    fraction = f"{grid:.10f}".rstrip("0").split(".")[1]
+    return len(fraction)
+
+def snap_to_grid(lat, lon, grid=None):
+    """
+    Snap coordinates to the nearest point of a regular degree grid.
+
+    Args:
+        lat: Latitude in degrees
+        lon: Longitude in degrees
+        grid: Grid size in degrees, defaults to CACHE_GRID_DEGREES
+
+    Returns:
+        tuple: (lat, lon) snapped to the grid
+    """
+    grid = grid or CACHE_GRID_DEGREES
+    decimals = _grid_decimals(grid)
+    snapped_lat = round(round(lat / grid) * grid, decimals)
+    snapped_lon = round(round(lon / grid) * grid, decimals)
+    # Avoid "-0.0" producing a different key than "0.0"
+    return snapped_lat + 0.0, snapped_lon + 0.0
+
+def geohash_encode(lat, lon, precision):
+    """
+    Encode coordinates as a geohash string.
+
+    Args:
+        lat: Latitude in degrees
+        lon: Longitude in degrees
+        precision: Number of geohash characters
+
+    Returns:
+        str: Geohash of the given precision
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even = True
+
+    while len(geohash) < precision:
+        value, value_range = (lon, lon_range) if even else (lat, lat_range)
+        mid = (value_range[0] + value_range[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            value_range[0] = mid
+        else:
+            bits = bits << 1
+            value_range[1] = mid
+        even = not even
+        bit_count += 1
+
+        if bit_count == 5:
+            geohash.append(_GEOHASH_BASE32[bits])
+            bits = 0
+            bit_count = 0
+
+    return "".join(geohash)
+
+def geohash_bounds(geohash):
+    """
+    Decode a geohash into the bounds of its cell.
+
+    Args:
+        geohash: Geohash string
+
+    Returns:
+        dict: Cell bounds (north, south, east, west)
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+
+    for char in geohash:
+        bits = _GEOHASH_BASE32.index(char)
+        for shift in range(4, -1, -1):
+            value_range = lon_range if even else lat_range
+            mid = (value_range[0] + value_range[1]) / 2
+            if (bits >> shift) & 1:
+                value_range[0] = mid
+            else:
+                value_range[1] = mid
+            even = not even
+
+    return {
+        'north': lat_range[1],
+        'south': lat_range[0],
+        'east': lon_range[1],
+        'west': lon_range[0]
+    }
+
+def quantize_location(lat, lon):
+    """
+    Normalize raw request coordinates into a cache cell.
+
+    Args:
+        lat: Latitude as a string or number
+        lon: Longitude as a string or number
+
+    Returns:
+        Location: Cell identifier and representative coordinates
+
+    Raises:
+        ValueError: If the coordinates are invalid
+    """
+    lat, lon = parse_coordinates(lat, lon)
+
+    if CACHE_GEOHASH_PRECISION > 0:
+        cell = geohash_encode(lat, lon, CACHE_GEOHASH_PRECISION)
+        bounds = geohash_bounds(cell)
+        center_lat = round((bounds['north'] + bounds['south']) / 2, 6)
+        center_lon = round((bounds['east'] + bounds['west']) / 2, 6)
+        return Location(cell, center_lat, center_lon)
+
+    snapped_lat, snapped_lon = snap_to_grid(lat, lon)
+    return Location(f"{snapped_lat},{snapped_lon}", snapped_lat, snapped_lon)
+
+def location_cache_key(namespace, location):
+    """
+    Build the cache key for a location-based endpoint.
+
+    Args:
+        namespace: Endpoint namespace (e.g. "weather", "forecast")
+        location: Location returned by quantize_location
+
+    Returns:
+        str: Cache key
+    """
+    return f"{namespace}:{location.cell}"
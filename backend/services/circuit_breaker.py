@@ -0,0 +1,197 @@
+"""
+Circuit breakers around the upstream services.
+
+Each upstream (OpenAI, OpenWeatherMap) has a breaker that counts consecutive
+failures, where a call that succeeds but takes longer than the upstream's
+latency SLO counts as a failure too. After FAILURE_THRESHOLD of them the
+breaker opens and calls fail immediately with CircuitOpenError, so callers
+return their fallback description or stale cache entry instead of waiting
+out the client timeout on every request.
+
+Once the reset timeout has passed the breaker is half-open: a single probe
+call is let through, closing the breaker if it succeeds and re-opening it if
+it fails.
+"""
+
+import os
+import time
+import logging
+import threading
+from services import metrics
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose breaker is open."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"Circuit for {name} is open")
+        self.name = name
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """Thread-safe closed/open/half-open breaker for one upstream."""
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0, latency_slo=None):
+        """
+        Args:
+            name: Upstream name, used in errors, metrics and the status
+            failure_threshold: Consecutive failures that open the breaker, 0 disables it
+            reset_timeout: Seconds the breaker stays open before a probe is let through
+            latency_slo: Seconds after which a successful call counts as a failure
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.latency_slo = latency_slo
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Close the breaker and forget past failures."""
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._opened_at = 0.0
+            self._probe_started = None
+
+    def _current_state(self):
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._probe_started = None
+        return self._state
+
+    def _open(self):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._probe_started = None
+        metrics.incr(f"circuit.{self.name}.opened")
+        logger.warning(f"Circuit for {self.name} opened after {self._failures} failures")
+
+    def before_call(self):
+        """
+        Check that a call may go ahead, admitting a probe when half-open.
+
+        Raises:
+            CircuitOpenError: If the breaker is open or a probe is already running
+        """
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return
+            now = time.monotonic()
+            # A probe that never reported back (e.g. it was cancelled) expires
+            if state == HALF_OPEN and (
+                self._probe_started is None or now - self._probe_started >= self.reset_timeout
+            ):
+                self._probe_started = now
+                metrics.incr(f"circuit.{self.name}.probe")
+                return
+            retry_after = max(0.0, self._opened_at + self.reset_timeout - now)
+        metrics.incr(f"circuit.{self.name}.rejected")
+        raise CircuitOpenError(self.name, retry_after)
+
+    def release_probe(self):
+        """Give back an admitted probe whose call was never made, so the next call can probe."""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probe_started = None
+
+    def record_success(self, latency=None):
+        """
+        Record a completed call.
+
+        Args:
+            latency: Seconds the call took; over the latency SLO it counts as a failure
+        """
+        if self.latency_slo and latency is not None and latency > self.latency_slo:
+            metrics.incr(f"circuit.{self.name}.slow")
+            self.record_failure()
+            return
+        with self._lock:
+            if self._state == HALF_OPEN:
+                logger.info(f"Circuit for {self.name} closed")
+                metrics.incr(f"circuit.{self.name}.closed")
+            self._state = CLOSED
+            self._failures = 0
+            self._probe_started = None
+
+    def record_failure(self):
+        """Record a failed call, opening the breaker once the threshold is reached."""
+        metrics.incr(f"circuit.{self.name}.failure")
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            self._failures += 1
+            state = self._current_state()
+            if state == HALF_OPEN or (state == CLOSED and self._failures >= self.failure_threshold):
+                self._open()
+
+    def available(self):
+        """
+        Check whether a call would be let through right now, without admitting it.
+
+        Returns:
+            bool: True unless the breaker is open or busy probing
+        """
+        if self.failure_threshold <= 0:
+            return True
+        with self._lock:
+            state = self._current_state()
+            return state == CLOSED or (state == HALF_OPEN and self._probe_started is None)
+
+    def status(self):
+        """
+        Get the breaker state.
+
+        Returns:
+            dict: State, consecutive failures, thresholds and the seconds
+            until a probe is let through while open
+        """
+        with self._lock:
+            state = self._current_state()
+            retry_after = self._opened_at + self.reset_timeout - time.monotonic() if state == OPEN else 0.0
+            return {
+                "state": state,
+                "consecutive_failures": self._failures,
+                "failure_threshold": self.failure_threshold,
+                "latency_slo": self.latency_slo,
+                "retry_after": round(max(0.0, retry_after), 1)
+            }
+
+def _breaker_from_env(name, failures, reset_timeout, latency_slo):
+    prefix = name.upper()
+    return CircuitBreaker(
+        name,
+        failure_threshold=int(os.environ.get(f"{prefix}_CIRCUIT_FAILURES", failures)),
+        reset_timeout=float(os.environ.get(f"{prefix}_CIRCUIT_RESET", reset_timeout)),
+        latency_slo=float(os.environ.get(f"{prefix}_LATENCY_SLO", latency_slo)) or None
+    )
+
+# One breaker per upstream and worker process
+openai_breaker = _breaker_from_env('openai', 5, 30, 8)
+openweather_breaker = _breaker_from_env('openweather', 5, 30, 3)
+
+BREAKERS = (openai_breaker, openweather_breaker)
+
+def status():
+    """
+    Get the state of every upstream's breaker.
+
+    Returns:
+        dict: Breaker status by upstream name
+    """
+    return {breaker.name: breaker.status() for breaker in BREAKERS}
+
+def reset():
+    """Close every upstream's breaker."""
+    for breaker in BREAKERS:
+        breaker.reset()
@@ -0,0 +1,160 @@
+"""
+Columnar snapshot of city observations for the heatmap.
+
+A /box/city response is parsed once into NumPy arrays, one per field. Every
+heatmap layer is then derived from the same snapshot with vectorized
+normalization, so switching layers never re-parses or re-fetches anything.
+"""
+
+from collections import namedtuple
+import numpy as np
+
+CitySnapshot = namedtuple(
+    "CitySnapshot", ["lat", "lon", "temp", "humidity", "pressure", "clouds", "weather_id"]
+)
+
+# Heatmap intensities are rounded so float32 readings don't leak noise into responses
+INTENSITY_DECIMALS = 4
+
+def _readings(cities, field):
+    return [(city.get("main") or {}).get(field) for city in cities]
+
+def from_box_response(data):
+    """
+    Parse a /box/city response into a snapshot.
+
+    Missing temperature, humidity and pressure readings are stored as NaN.
+
+    Args:
+        data: Decoded /box/city JSON
+
+    Returns:
+        CitySnapshot: One array per field, one element per city with coordinates
+    """
+    cities = []
+    for city in data.get("list", []):
+        coord = city.get("coord") or {}
+        if coord.get("lat") is not None and coord.get("lon") is not None:
+            cities.append(city)
+
+    clouds = [(city.get("clouds") or {}).get("all") for city in cities]
+    weather_ids = [((city.get("weather") or [{}])[0]).get("id") for city in cities]
+    return _build(
+        lat=[city["coord"]["lat"] for city in cities],
+        lon=[city["coord"]["lon"] for city in cities],
+        temp=_readings(cities, "temp"),
+        humidity=_readings(cities, "humidity"),
+        pressure=_readings(cities, "pressure"),
+        clouds=[0 if value is None else value for value in clouds],
+        weather_id=[800 if value is None else value for value in weather_ids]
+    )
+
+def _build(lat, lon, temp, humidity, pressure, clouds, weather_id):
+    # Coordinates keep full precision; readings don't need more than float32,
+    # which keeps cached tiles small (None becomes NaN)
+    return CitySnapshot(
+        lat=np.asarray(lat, dtype=np.float64),
+        lon=np.asarray(lon, dtype=np.float64),
+        temp=np.asarray(temp, dtype=np.float32),
+        humidity=np.asarray(humidity, dtype=np.float32),
+        pressure=np.asarray(pressure, dtype=np.float32),
+        clouds=np.asarray(clouds, dtype=np.float32),
+        weather_id=np.asarray(weather_id, dtype=np.int16)
+    )
+
+def empty():
+    """
+    Get a snapshot without any cities.
+
+    Returns:
+        CitySnapshot: Snapshot with empty arrays
+    """
+    return _build([], [], [], [], [], [], [])
+
+def concat(snapshots, lon_offsets=None):
+    """
+    Join several snapshots into one.
+
+    Args:
+        snapshots: Snapshots to join
+        lon_offsets: Optional degrees to add to each snapshot's longitudes
+
+    Returns:
+        CitySnapshot: Snapshot with the cities of all inputs
+    """
+    snapshots = list(snapshots)
+    if not snapshots:
+        return empty()
+
+    offsets = lon_offsets or [0] * len(snapshots)
+    return CitySnapshot(*[
+        np.concatenate([
+            getattr(snapshot, field) + offset if field == "lon" and offset else getattr(snapshot, field)
+            for snapshot, offset in zip(snapshots, offsets)
+        ])
+        for field in CitySnapshot._fields
+    ])
+
+def intensities(snapshot, data_type):
+    """
+    Normalize one heatmap layer to intensities between 0 and 1.
+
+    Args:
+        snapshot: City snapshot
+        data_type: Type of weather data (temperature, precipitation, humidity, pressure)
+
+    Returns:
+        numpy.ndarray: Intensity per city, NaN where the reading is missing
+    """
+    return np.round(_normalize(snapshot, data_type).astype(np.float64), INTENSITY_DECIMALS)
+
+def _normalize(snapshot, data_type):
+    if data_type == 'temperature':
+        # Assuming temp range from -20 to 40 degrees Celsius
+        return np.clip((snapshot.temp + 20) / 60, 0, 1)
+    if data_type == 'precipitation':
+        # Approximate precipitation from clouds and weather conditions;
+        # weather codes 200-531 are precipitation conditions
+        has_precipitation = (snapshot.weather_id >= 200) & (snapshot.weather_id <= 531)
+        return (snapshot.clouds / 100) * np.where(has_precipitation, 1.0, 0.1)
+    if data_type == 'humidity':
+        return snapshot.humidity / 100
+    if data_type == 'pressure':
+        # Normalize pressure around 1013.25 hPa (standard pressure)
+        return np.clip((snapshot.pressure - 950) / 150, 0, 1)
+    return np.full(len(snapshot.lat), np.nan, dtype=np.float32)
+
+def heatmap_points(snapshot, data_type):
+    """
+    Build the points of one heatmap layer.
+
+    Args:
+        snapshot: City snapshot
+        data_type: Type of weather data (temperature, precipitation, humidity, pressure)
+
+    Returns:
+        list: [lat, lon, intensity] points, skipping cities without a reading
+    """
+    values = intensities(snapshot, data_type)
+    present = ~np.isnan(values)
+    return np.column_stack((snapshot.lat[present], snapshot.lon[present], values[present])).tolist()
+
+def heatmap_columns(snapshot, data_type):
+    """
+    Build one heatmap layer as columns instead of points.
+
+    Args:
+        snapshot: City snapshot
+        data_type: Type of weather data (temperature, precipitation, humidity, pressure)
+
+    Returns:
+        dict: Equal-length "lat", "lon" and "intensity" lists, skipping cities
+        without a reading
+    """
+    values = intensities(snapshot, data_type)
+    present = ~np.isnan(values)
+    return {
+        "lat": snapshot.lat[present].tolist(),
+        "lon": snapshot.lon[present].tolist(),
+        "intensity": values[present].tolist()
+    }
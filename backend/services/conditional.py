@@ -0,0 +1,115 @@
+"""
+HTTP conditional requests for re-polled endpoints.
+
+Responses carry a strong ETag (a digest of the exact body bytes), a
+Last-Modified time and a Cache-Control header aligned with the server-side
+soft/hard TTLs: clients may reuse a response until the cached entry turns
+stale and keep showing it while revalidating until the entry expires.
+
+A request whose If-None-Match (or, without it, If-Modified-Since) matches is
+answered with 304 Not Modified and no body.
+"""
+
+import time
+import hashlib
+from email.utils import formatdate, parsedate_to_datetime
+from services.data_cache import ttl_for
+
+# Headers a 304 response repeats from the full response
+_NOT_MODIFIED_HEADERS = ('ETag', 'Last-Modified', 'Cache-Control', 'Vary')
+
+def etag(body):
+    """
+    Build a strong entity tag for a response body.
+
+    Args:
+        body: Response body bytes
+
+    Returns:
+        str: Quoted entity tag
+    """
+    return f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+
+def cache_control(namespace, fetched_at, now=None, stale_at=None):
+    """
+    Build a Cache-Control header matching the server-side TTLs of an entry.
+
+    Args:
+        namespace: Endpoint namespace, selects the soft/hard TTL
+        fetched_at: Unix time the entry was fetched
+        now: Current Unix time, defaults to now
+        stale_at: Unix time a scheduled entry turns stale, defaults to the soft TTL
+
+    Returns:
+        str: Cache-Control header value
+    """
+    ttl = ttl_for(namespace)
+    now = time.time() if now is None else now
+    max_age = max(0, int((fetched_at + ttl.soft if stale_at is None else stale_at) - now))
+    return f"public, max-age={max_age}, stale-while-revalidate={max(0, ttl.hard - ttl.soft)}"
+
+def validators(namespace, body, fetched_at, modified_at=None, stale_at=None):
+    """
+    Build the caching headers of a response.
+
+    Args:
+        namespace: Endpoint namespace, selects the soft/hard TTL
+        body: Response body bytes
+        fetched_at: Unix time the data was fetched
+        modified_at: Unix time the data last changed (e.g. when an observation
+            was taken), defaults to fetched_at
+        stale_at: Unix time a scheduled entry turns stale, defaults to the soft TTL
+
+    Returns:
+        dict: ETag, Last-Modified and Cache-Control headers
+    """
+    return {
+        'ETag': etag(body),
+        'Last-Modified': formatdate(modified_at or fetched_at, usegmt=True),
+        'Cache-Control': cache_control(namespace, fetched_at, stale_at=stale_at)
+    }
+
+def _strip_weak(tag):
+    return tag[2:] if tag.startswith("W/") else tag
+
+def is_not_modified(request_headers, headers):
+    """
+    Check whether a request's validators match the response it would get.
+
+    Args:
+        request_headers: Request headers (case-insensitive mapping)
+        headers: Headers of the full response, as built by validators
+
+    Returns:
+        bool: True if the client's copy is current
+    """
+    if_none_match = request_headers.get('If-None-Match')
+    if if_none_match:
+        current = _strip_weak(headers['ETag'])
+        tags = [_strip_weak(tag.strip()) for tag in if_none_match.split(",")]
+        return "*" in tags or current in tags
+
+    if_modified_since = request_headers.get('If-Modified-Since')
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return parsedate_to_datetime(headers['Last-Modified']).timestamp() <= since
+    return False
+
+def respond(request_headers, body, headers):
+    """
+    Answer a request with the full body or 304 Not Modified.
+
+    Args:
+        request_headers: Request headers (case-insensitive mapping)
+        body: Full response body bytes
+        headers: Headers of the full response, including its validators
+
+    Returns:
+        tuple: (status, body, headers) to send
+    """
+    if is_not_modified(request_headers, headers):
+        return 304, b"", {name: value for name, value in headers.items() if name in _NOT_MODIFIED_HEADERS}
+    return 200, body, headers
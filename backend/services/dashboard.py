@@ -0,0 +1,129 @@
+"""
+Combined dashboard payload for a location.
+
+A page load needs the current weather, the forecast and the AI description.
+Fetching them from one endpoint lets the current weather and forecast be
+fetched concurrently, and the description is generated from the same
+current-weather result instead of fetching it a second time.
+"""
+
+import os
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from services import forecast_updates, metrics, weather_service
+from services.cache_keys import location_cache_key
+from services.data_cache import async_cached_fetch, cached_fetch
+from services.description_cache import async_cached_description, cached_description
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Threads used to fetch the forecast alongside the current weather
+DASHBOARD_MAX_WORKERS = int(os.environ.get("DASHBOARD_MAX_WORKERS", 8))
+
+_executor = ThreadPoolExecutor(max_workers=DASHBOARD_MAX_WORKERS, thread_name_prefix="dashboard")
+
+def _fetch_weather(cache, location):
+    return cached_fetch(
+        cache, 'weather', location_cache_key('weather', location),
+        lambda: weather_service.get_weather_data(location.lat, location.lon)
+    )
+
+def _fetch_forecast(cache, location, view):
+    return forecast_updates.view(forecast_updates.cached_forecast_entry(cache, location)['value'], view)
+
+def _async_fetch_weather(cache, location):
+    return async_cached_fetch(
+        cache, 'weather', location_cache_key('weather', location),
+        lambda: weather_service.async_get_weather_data(location.lat, location.lon)
+    )
+
+async def _async_fetch_forecast(cache, location, view):
+    return forecast_updates.view((await forecast_updates.async_cached_forecast_entry(cache, location))['value'], view)
+
+def _record_error(payload, section, error):
+    logger.error(f"Error fetching dashboard {section}: {str(error)}")
+    metrics.incr(f"dashboard.{section}.failed")
+    payload[section] = None
+    payload["errors"][section] = str(error)
+
+def _finish(payload):
+    if payload["weather"] is None and payload["forecast"] is None:
+        raise Exception("Failed to fetch dashboard data: " + "; ".join(payload["errors"].values()))
+    if not payload["errors"]:
+        del payload["errors"]
+    return payload
+
+def get_dashboard(cache, location, describe=True, forecast_view=forecast_updates.RAW):
+    """
+    Get current weather, forecast and description for a location.
+
+    The forecast is fetched on a worker thread while the current weather is
+    fetched and described on the calling thread.
+
+    Args:
+        cache: Flask-Caching or cachelib cache instance
+        location: Quantized location from quantize_location
+        describe: Include the description, False when the client streams it
+        forecast_view: View of the forecast to include, one of forecast_updates.VIEWS
+
+    Returns:
+        dict: Payload with "weather", "forecast" and "description"; sections
+        that failed are None and their messages are listed under "errors"
+
+    Raises:
+        Exception: If neither the current weather nor the forecast could be fetched
+    """
+    payload = {"weather": None, "forecast": None, "description": None, "errors": {}}
+    forecast_future = _executor.submit(_fetch_forecast, cache, location, forecast_view)
+
+    try:
+        payload["weather"] = _fetch_weather(cache, location)
+        if describe:
+            payload["description"] = cached_description(payload["weather"])
+    except Exception as e:
+        _record_error(payload, "weather" if payload["weather"] is None else "description", e)
+
+    try:
+        payload["forecast"] = forecast_future.result()
+    except Exception as e:
+        _record_error(payload, "forecast", e)
+
+    return _finish(payload)
+
+async def async_get_dashboard(cache, location, describe=True, forecast_view=forecast_updates.RAW):
+    """
+    Async counterpart of get_dashboard for the ASGI serving mode.
+
+    Args:
+        cache: cachelib cache instance
+        location: Quantized location from quantize_location
+        describe: Include the description, False when the client streams it
+        forecast_view: View of the forecast to include, one of forecast_updates.VIEWS
+
+    Returns:
+        dict: Payload with "weather", "forecast" and "description"
+
+    Raises:
+        Exception: If neither the current weather nor the forecast could be fetched
+    """
+    payload = {"weather": None, "forecast": None, "description": None, "errors": {}}
+
+    async def weather_and_description():
+        try:
+            payload["weather"] = await _async_fetch_weather(cache, location)
+            if describe:
+                payload["description"] = await async_cached_description(payload["weather"])
+        except Exception as e:
+            _record_error(payload, "weather" if payload["weather"] is None else "description", e)
+
+    async def forecast():
+        try:
+            payload["forecast"] = await _async_fetch_forecast(cache, location, forecast_view)
+        except Exception as e:
+            _record_error(payload, "forecast", e)
+
+    await asyncio.gather(weather_and_description(), forecast())
+    return _finish(payload)
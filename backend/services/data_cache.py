@@ -0,0 +1,502 @@
+"""
+Data-level caching for upstream results.
+
+Instead of caching whole Flask responses, handlers cache the upstream data
+itself under normalized keys and record hit/miss counters per namespace.
+
+Entries have a soft and a hard TTL. Past the soft TTL an entry is stale: it
+is still served immediately while a background refresh fetches a new value.
+Past the hard TTL it is gone and the next caller fetches it in the
+foreground. Frequently read entries are refreshed ahead of their soft TTL.
+
+Concurrent misses for the same key are coalesced so only one upstream fetch
+runs per worker, and optionally per host/cluster through a lock entry in the
+shared cache.
+
+Namespaces whose upstream publishes on a known cadence can register a
+schedule that decides when each entry turns stale, instead of the fixed soft
+TTL (see register_schedule).
+
+Background refreshes run at the governor's REFRESH priority and are skipped
+while the upstream quota is nearly spent, so entries keep being served stale
+until they expire instead of eating into the budget of interactive calls.
+They are skipped as well while the upstream's circuit breaker is open.
+Fetch functions can check refreshing() to go to the upstream during a
+refresh instead of answering from an older observation that would be stored
+as new.
+
+Every entry point has an ``async_`` counterpart for the ASGI serving mode
+that takes coroutine functions and never blocks the event loop on upstream
+I/O.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor
+from services import metrics
+from services.cache_backends import async_call
+from services.circuit_breaker import openweather_breaker
+from services.rate_limit import REFRESH, priority, upstream_governor
+from services.singleflight import SingleFlight
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+CacheTTL = namedtuple("CacheTTL", ["soft", "hard"])
+
+def _ttl_from_env(namespace, soft, hard):
+    prefix = namespace.upper()
+    return CacheTTL(
+        int(os.environ.get(f"{prefix}_SOFT_TTL", soft)),
+        int(os.environ.get(f"{prefix}_HARD_TTL", hard))
+    )
+
+# Soft/hard TTLs in seconds per endpoint namespace
+CACHE_TTLS = {
+    'weather': _ttl_from_env('weather', 300, 900),
+    'forecast': _ttl_from_env('forecast', 300, 1800),
+    'heatmap': _ttl_from_env('heatmap', 600, 600)
+}
+DEFAULT_TTL = CacheTTL(300, 300)
+
+# Background refresh configuration
+REFRESH_MAX_CONCURRENCY = int(os.environ.get("REFRESH_MAX_CONCURRENCY", 4))
+# Hot entries are refreshed once they reach this fraction of their soft TTL
+REFRESH_AHEAD_RATIO = float(os.environ.get("REFRESH_AHEAD_RATIO", 0.8))
+# Number of reads within an entry's lifetime that makes it hot
+REFRESH_HOT_THRESHOLD = int(os.environ.get("REFRESH_HOT_THRESHOLD", 5))
+
+# Cross-worker coalescing through a lock stored in the shared cache
+SINGLEFLIGHT_CROSS_WORKER = os.environ.get("SINGLEFLIGHT_CROSS_WORKER", "false").lower() == "true"
+# How long a lock may be held before it expires, in seconds
+SINGLEFLIGHT_LOCK_TIMEOUT = int(os.environ.get("SINGLEFLIGHT_LOCK_TIMEOUT", 15))
+# How long other workers wait for the lock holder before fetching themselves
+SINGLEFLIGHT_WAIT_TIMEOUT = float(os.environ.get("SINGLEFLIGHT_WAIT_TIMEOUT", 10))
+SINGLEFLIGHT_POLL_INTERVAL = 0.05
+
+# Upper bound on tracked access counters before they are reset
+_MAX_TRACKED_KEYS = 10000
+
+_flight = SingleFlight()
+_refresh_executor = ThreadPoolExecutor(max_workers=REFRESH_MAX_CONCURRENCY, thread_name_prefix="cache-refresh")
+_refresh_lock = threading.Lock()
+_refreshing = set()
+_access_counts = {}
+# Set inside background refreshes, see refreshing()
+_in_refresh = ContextVar("cache_refresh", default=False)
+
+# In-flight tasks of the ASGI mode, keyed like the sync single-flight
+_async_flights = {}
+# Strong references to background refresh tasks so they aren't collected
+_background_tasks = set()
+# Functions deciding when entries of a namespace turn stale
+_schedules = {}
+
+def ttl_for(namespace):
+    """
+    Get the soft/hard TTL configured for a namespace.
+
+    Args:
+        namespace: Endpoint namespace (e.g. "weather")
+
+    Returns:
+        CacheTTL: Soft and hard TTL in seconds
+    """
+    return CACHE_TTLS.get(namespace, DEFAULT_TTL)
+
+def register_schedule(namespace, stale_at):
+    """
+    Let a namespace decide per entry when it turns stale.
+
+    Scheduled entries turn stale at the time the schedule returns instead of
+    after the soft TTL, are kept until the hard TTL has passed beyond that
+    time, and are never refreshed ahead.
+
+    Args:
+        namespace: Endpoint namespace
+        stale_at: Callable taking the value and the Unix time it was fetched,
+            returning the Unix time it turns stale
+    """
+    _schedules[namespace] = stale_at
+
+def coalesced(key, fn):
+    """
+    Run fn once for all concurrent callers in this worker sharing the key.
+
+    Args:
+        key: Deduplication key
+        fn: Zero-argument callable to run
+
+    Returns:
+        The shared result of fn
+    """
+    return _flight.do(key, fn)
+
+async def async_coalesced(key, fn):
+    """
+    Await fn once for all concurrent callers on the event loop sharing the key.
+
+    Args:
+        key: Deduplication key
+        fn: Zero-argument coroutine function to run
+
+    Returns:
+        The shared result of fn
+    """
+    task = _async_flights.get(key)
+    if task is None:
+        task = asyncio.ensure_future(fn())
+        _async_flights[key] = task
+        task.add_done_callback(lambda _: _async_flights.pop(key, None))
+    else:
+        metrics.incr("singleflight.shared")
+    # Shield so one cancelled waiter doesn't cancel the fetch for the others
+    return await asyncio.shield(task)
+
+@contextmanager
+def _refresh_context():
+    token = _in_refresh.set(True)
+    try:
+        yield
+    finally:
+        _in_refresh.reset(token)
+
+def refreshing():
+    """
+    Check whether the current context is a background refresh.
+
+    Returns:
+        bool: True inside schedule_refresh and async_schedule_refresh
+    """
+    return _in_refresh.get()
+
+def _record_access(key):
+    with _refresh_lock:
+        if len(_access_counts) >= _MAX_TRACKED_KEYS:
+            _access_counts.clear()
+        _access_counts[key] = _access_counts.get(key, 0) + 1
+        return _access_counts[key]
+
+def _is_newer(entry, requested_at):
+    return entry is not None and entry['fetched_at'] >= requested_at
+
+def _new_entry(namespace, key, value):
+    # Returns the entry and its cache timeout
+    entry = {'value': value, 'fetched_at': time.time()}
+    ttl = ttl_for(namespace)
+    timeout = ttl.hard
+    schedule = _schedules.get(namespace)
+    if schedule is not None:
+        entry['stale_at'] = schedule(value, entry['fetched_at'])
+        timeout = max(timeout, int(entry['stale_at'] - entry['fetched_at']) + ttl.hard - ttl.soft)
+    with _refresh_lock:
+        _access_counts.pop(key, None)
+    return entry, timeout
+
+def _store(cache, namespace, key, value):
+    entry, timeout = _new_entry(namespace, key, value)
+    cache.set(key, entry, timeout=timeout)
+    return entry
+
+async def _async_store(cache, namespace, key, value):
+    entry, timeout = _new_entry(namespace, key, value)
+    await async_call(cache, 'set', key, entry, timeout=timeout)
+    return entry
+
+def _lookup(cache, namespace, key, requested_at):
+    # Returns the cached entry (or None) and whether it should be refreshed
+    return _check(cache.get(key), namespace, key, requested_at)
+
+async def _async_lookup(cache, namespace, key, requested_at):
+    return _check(await async_call(cache, 'get', key), namespace, key, requested_at)
+
+def _check(entry, namespace, key, requested_at):
+    if entry is None:
+        metrics.incr(f"cache.{namespace}.miss")
+        return None, False
+
+    ttl = ttl_for(namespace)
+    age = requested_at - entry['fetched_at']
+    reads = _record_access(key)
+    refresh = False
+
+    if 'stale_at' in entry:
+        # Refreshing a scheduled entry early would only fetch the same data again
+        if requested_at >= entry['stale_at']:
+            metrics.incr(f"cache.{namespace}.stale")
+            refresh = True
+    elif age >= ttl.soft:
+        metrics.incr(f"cache.{namespace}.stale")
+        refresh = True
+    elif age >= ttl.soft * REFRESH_AHEAD_RATIO and reads >= REFRESH_HOT_THRESHOLD:
+        metrics.incr(f"cache.{namespace}.refresh_ahead")
+        refresh = True
+
+    metrics.incr(f"cache.{namespace}.hit")
+    return entry, refresh
+
+def _reserve_refresh(namespace, key, quota_available):
+    if not quota_available or not openweather_breaker.available():
+        metrics.incr(f"refresh.{namespace}.deferred")
+        return False
+    with _refresh_lock:
+        if key in _refreshing:
+            return False
+        if len(_refreshing) >= REFRESH_MAX_CONCURRENCY:
+            metrics.incr(f"refresh.{namespace}.skipped")
+            return False
+        _refreshing.add(key)
+    metrics.incr(f"refresh.{namespace}.scheduled")
+    return True
+
+def _release_refresh(key):
+    with _refresh_lock:
+        _refreshing.discard(key)
+
+def _wait_for_lock_holder(cache, key, lock_key, requested_at):
+    deadline = time.monotonic() + SINGLEFLIGHT_WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        entry = cache.get(key)
+        if _is_newer(entry, requested_at):
+            return entry
+        if not cache.has(lock_key):
+            # The holder finished (or failed) without leaving a newer value
+            return None
+        time.sleep(SINGLEFLIGHT_POLL_INTERVAL)
+    return None
+
+async def _async_wait_for_lock_holder(cache, key, lock_key, requested_at):
+    deadline = time.monotonic() + SINGLEFLIGHT_WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        entry = await async_call(cache, 'get', key)
+        if _is_newer(entry, requested_at):
+            return entry
+        if not await async_call(cache, 'has', lock_key):
+            return None
+        await asyncio.sleep(SINGLEFLIGHT_POLL_INTERVAL)
+    return None
+
+def _fetch_and_store(cache, namespace, key, fetch, requested_at, cross_worker, wait=True):
+    # Another leader may have stored a newer value since we decided to fetch
+    entry = cache.get(key)
+    if _is_newer(entry, requested_at):
+        return entry
+
+    lock_key = f"lock:{key}"
+    locked = False
+    if cross_worker:
+        locked = cache.add(lock_key, os.getpid(), timeout=SINGLEFLIGHT_LOCK_TIMEOUT)
+        if not locked:
+            if not wait:
+                # Another worker is already refreshing this entry
+                return entry
+            metrics.incr("singleflight.cross_worker_wait")
+            entry = _wait_for_lock_holder(cache, key, lock_key, requested_at)
+            if entry is not None:
+                return entry
+            logger.warning(f"No result from another worker for {key}, fetching it here")
+
+    try:
+        return _store(cache, namespace, key, fetch())
+    finally:
+        if locked:
+            cache.delete(lock_key)
+
+async def _async_fetch_and_store(cache, namespace, key, fetch, requested_at, cross_worker, wait=True):
+    entry = await async_call(cache, 'get', key)
+    if _is_newer(entry, requested_at):
+        return entry
+
+    lock_key = f"lock:{key}"
+    locked = False
+    if cross_worker:
+        locked = await async_call(cache, 'add', lock_key, os.getpid(), timeout=SINGLEFLIGHT_LOCK_TIMEOUT)
+        if not locked:
+            if not wait:
+                return entry
+            metrics.incr("singleflight.cross_worker_wait")
+            entry = await _async_wait_for_lock_holder(cache, key, lock_key, requested_at)
+            if entry is not None:
+                return entry
+            logger.warning(f"No result from another worker for {key}, fetching it here")
+
+    try:
+        return await _async_store(cache, namespace, key, await fetch())
+    finally:
+        if locked:
+            await async_call(cache, 'delete', lock_key)
+
+def schedule_refresh(cache, namespace, key, fetch, cross_worker=None):
+    """
+    Refresh an entry in the background unless the refresh cap is reached.
+
+    Args:
+        cache: Flask-Caching cache instance
+        namespace: Endpoint namespace
+        key: Cache key
+        fetch: Zero-argument callable producing the new value
+        cross_worker: Skip the refresh if another worker holds the key's lock
+
+    Returns:
+        bool: True if a refresh was scheduled
+    """
+    if not _reserve_refresh(namespace, key, upstream_governor.available(REFRESH)):
+        return False
+
+    if cross_worker is None:
+        cross_worker = SINGLEFLIGHT_CROSS_WORKER
+    requested_at = time.time()
+
+    def run():
+        try:
+            with priority(REFRESH), _refresh_context():
+                coalesced(key, lambda: _fetch_and_store(
+                    cache, namespace, key, fetch, requested_at, cross_worker, wait=False
+                ))
+            metrics.incr(f"refresh.{namespace}.completed")
+        except Exception as e:
+            logger.warning(f"Background refresh of {key} failed: {str(e)}")
+            metrics.incr(f"refresh.{namespace}.failed")
+        finally:
+            _release_refresh(key)
+
+    _refresh_executor.submit(run)
+    return True
+
+async def async_schedule_refresh(cache, namespace, key, fetch, cross_worker=None):
+    """
+    Refresh an entry in a background task on the running event loop.
+
+    Args:
+        cache: Cache instance
+        namespace: Endpoint namespace
+        key: Cache key
+        fetch: Zero-argument coroutine function producing the new value
+        cross_worker: Skip the refresh if another worker holds the key's lock
+
+    Returns:
+        bool: True if a refresh was scheduled
+    """
+    if not _reserve_refresh(namespace, key, await upstream_governor.async_available(REFRESH)):
+        return False
+
+    if cross_worker is None:
+        cross_worker = SINGLEFLIGHT_CROSS_WORKER
+    requested_at = time.time()
+
+    async def run():
+        try:
+            with priority(REFRESH), _refresh_context():
+                await async_coalesced(key, lambda: _async_fetch_and_store(
+                    cache, namespace, key, fetch, requested_at, cross_worker, wait=False
+                ))
+            metrics.incr(f"refresh.{namespace}.completed")
+        except Exception as e:
+            logger.warning(f"Background refresh of {key} failed: {str(e)}")
+            metrics.incr(f"refresh.{namespace}.failed")
+        finally:
+            _release_refresh(key)
+
+    task = asyncio.ensure_future(run())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return True
+
+def cached_entry(cache, namespace, key, fetch, cross_worker=None):
+    """
+    Return a cached entry, refreshing it in the background when stale or hot.
+
+    Args:
+        cache: Flask-Caching cache instance
+        namespace: Endpoint namespace, selects TTLs and hit/miss counters
+        key: Cache key
+        fetch: Zero-argument callable producing the value on a miss
+        cross_worker: Also coalesce across workers through a cache lock,
+            defaults to SINGLEFLIGHT_CROSS_WORKER
+
+    Returns:
+        dict: The entry's "value", the Unix time it was "fetched_at" and,
+        for scheduled namespaces, the Unix time it turns stale ("stale_at")
+    """
+    requested_at = time.time()
+    entry, refresh = _lookup(cache, namespace, key, requested_at)
+    if entry is not None:
+        if refresh:
+            schedule_refresh(cache, namespace, key, fetch, cross_worker)
+        return entry
+
+    if cross_worker is None:
+        cross_worker = SINGLEFLIGHT_CROSS_WORKER
+    return coalesced(key, lambda: _fetch_and_store(
+        cache, namespace, key, fetch, requested_at, cross_worker
+    ))
+
+def cached_fetch(cache, namespace, key, fetch, cross_worker=None):
+    """
+    Return a cached value, refreshing it in the background when stale or hot.
+
+    Args:
+        cache: Flask-Caching cache instance
+        namespace: Endpoint namespace, selects TTLs and hit/miss counters
+        key: Cache key
+        fetch: Zero-argument callable producing the value on a miss
+        cross_worker: Also coalesce across workers through a cache lock,
+            defaults to SINGLEFLIGHT_CROSS_WORKER
+
+    Returns:
+        The cached or freshly fetched value
+    """
+    return cached_entry(cache, namespace, key, fetch, cross_worker)['value']
+
+async def async_cached_entry(cache, namespace, key, fetch, cross_worker=None):
+    """
+    Async counterpart of cached_entry for the ASGI serving mode.
+
+    Args:
+        cache: Cache instance
+        namespace: Endpoint namespace, selects TTLs and hit/miss counters
+        key: Cache key
+        fetch: Zero-argument coroutine function producing the value on a miss
+        cross_worker: Also coalesce across workers through a cache lock,
+            defaults to SINGLEFLIGHT_CROSS_WORKER
+
+    Returns:
+        dict: The entry's "value", the Unix time it was "fetched_at" and,
+        for scheduled namespaces, the Unix time it turns stale ("stale_at")
+    """
+    requested_at = time.time()
+    entry, refresh = await _async_lookup(cache, namespace, key, requested_at)
+    if entry is not None:
+        if refresh:
+            await async_schedule_refresh(cache, namespace, key, fetch, cross_worker)
+        return entry
+
+    if cross_worker is None:
+        cross_worker = SINGLEFLIGHT_CROSS_WORKER
+    return await async_coalesced(key, lambda: _async_fetch_and_store(
+        cache, namespace, key, fetch, requested_at, cross_worker
+    ))
+
+async def async_cached_fetch(cache, namespace, key, fetch, cross_worker=None):
+    """
+    Async counterpart of cached_fetch for the ASGI serving mode.
+
+    Args:
+        cache: Cache instance
+        namespace: Endpoint namespace, selects TTLs and hit/miss counters
+        key: Cache key
+        fetch: Zero-argument coroutine function producing the value on a miss
+        cross_worker: Also coalesce across workers through a cache lock,
+            defaults to SINGLEFLIGHT_CROSS_WORKER
+
+    Returns:
+        The cached or freshly fetched value
+    """
+    return (await async_cached_entry(cache, namespace, key, fetch, cross_worker))['value']
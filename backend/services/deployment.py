@@ -40,3 +40,29 @@ def setup_openai_client():
     except Exception as e:
         logger.error(f"Error initializing OpenAI client: {str(e)}")
         raise
+
+
+def get_allowed_origins():
+    """
+    Get the CORS origins allowed for the current environment.
+    
+    Returns:
+        list: Allowed origin URLs
+    """
+    if os.environ.get("FLASK_ENV", "development") == "production":
+        # In production, only allow the deployed Vercel frontend
+        allowed_origins = [
+            "https://weather-app-frontend.vercel.app",  # Production Vercel deployment
+            os.environ.get("FRONTEND_URL", "")  # Allow for custom domain if set
+        ]
+    else:
+        # In development, allow localhost with different ports
+        allowed_origins = [
+            "http://localhost:3000",  # Next.js default port
+            "http://localhost:8000",  # Alternative port
+            "http://127.0.0.1:3000",  # IPv4 localhost
+            "http://127.0.0.1:8000"   # Alternative port with IPv4
+        ]
+    
+    # Filter out empty values
+    return [origin for origin in allowed_origins if origin]
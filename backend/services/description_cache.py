@@ -0,0 +1,427 @@
+"""
+Cache for AI weather descriptions.
+
+Descriptions are keyed on a fingerprint of the prompt inputs with the
+continuous values bucketed, so identical conditions at a location reuse the
+generated text across users instead of paying for another gpt-4o call.
+
+With the tiered engine, common weather regimes don't reach the cache or
+OpenAI at all: they are rendered from the description_templates table, and
+only unusual conditions are described by gpt-4o.
+
+Generation on a miss is bounded by AI_DESCRIPTION_DEADLINE. If gpt-4o hasn't
+answered in time the caller gets the fallback description right away, while
+the OpenAI call keeps running in the background and fills the cache for the
+next caller. Late completions are counted under description.background.*.
+
+stream_description yields the description as it is generated for the
+Server-Sent Events endpoint: "delta" events with each new piece of text,
+then a "done" event with the complete description. A cached description
+is sent as a single "done" event.
+
+cached_descriptions describes many locations at once, e.g. to precompute
+popular cities: cached fingerprints are reused and the misses are described
+through ai_service's batch API, a few calls for all of them.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from services import ai_service, description_templates, metrics
+from services.data_cache import async_coalesced, coalesced
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Cache configuration
+DESCRIPTION_CACHE_SIZE = int(os.environ.get("DESCRIPTION_CACHE_SIZE", 1024))
+DESCRIPTION_CACHE_TTL = int(os.environ.get("DESCRIPTION_CACHE_TTL", 1800))
+
+# "ai" always asks gpt-4o, "tiered" renders common regimes from templates and asks gpt-4o about the rest
+DESCRIPTION_ENGINE = os.environ.get("DESCRIPTION_ENGINE", "ai")
+
+# Seconds a request waits for gpt-4o before answering with the fallback, 0 waits indefinitely
+AI_DESCRIPTION_DEADLINE = float(os.environ.get("AI_DESCRIPTION_DEADLINE", 4))
+# OpenAI calls that may run at once, including ones that outlived their request
+AI_DESCRIPTION_WORKERS = int(os.environ.get("AI_DESCRIPTION_WORKERS", 8))
+
+# Bucket sizes for the fingerprint
+HUMIDITY_BUCKET = 10  # percent
+WIND_BUCKET = 2.0  # m/s
+
+def _bucket(value, size):
+    if value is None:
+        return None
+    return int(value // size)
+
+def weather_fingerprint(weather_data):
+    """
+    Build a cache key from the inputs of the description prompt.
+
+    Args:
+        weather_data: Weather data for a location
+
+    Returns:
+        str: Fingerprint of the bucketed weather conditions
+    """
+    location = weather_data["location"]
+    current = weather_data["current"]
+    temp = current.get("temp")
+
+    parts = [
+        location.get("name"),
+        location.get("country"),
+        None if temp is None else int(round(temp)),
+        current["weather"].get("main"),
+        current["weather"].get("description"),
+        _bucket(current.get("humidity"), HUMIDITY_BUCKET),
+        _bucket(current.get("wind_speed"), WIND_BUCKET)
+    ]
+    return "description:" + "|".join("" if part is None else str(part) for part in parts)
+
+class DescriptionCache:
+    """Thread-safe LRU cache with a per-entry TTL."""
+
+    def __init__(self, max_size=None, ttl=None):
+        self.max_size = DESCRIPTION_CACHE_SIZE if max_size is None else max_size
+        self.ttl = DESCRIPTION_CACHE_TTL if ttl is None else ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get a description, counting the lookup as a hit or miss.
+
+        Args:
+            key: Weather fingerprint
+
+        Returns:
+            str: Cached description, or None if missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                metrics.incr("cache.description.hit")
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+        metrics.incr("cache.description.miss")
+        return None
+
+    def set(self, key, description):
+        """
+        Store a description, evicting the least recently used entries if full.
+
+        Args:
+            key: Weather fingerprint
+            description: Generated description
+        """
+        with self._lock:
+            self._entries[key] = (description, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                metrics.incr("cache.description.evicted")
+
+    def clear(self):
+        """Remove all cached descriptions."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+description_cache = DescriptionCache()
+
+_executor = ThreadPoolExecutor(max_workers=AI_DESCRIPTION_WORKERS, thread_name_prefix="ai-description")
+
+# In-flight generations per fingerprint, and fingerprints whose callers gave up waiting
+_generations = {}
+_async_generations = {}
+_late = set()
+_generations_lock = threading.Lock()
+
+def _from_template(weather_data):
+    if DESCRIPTION_ENGINE != "tiered":
+        return None
+    description = description_templates.render(weather_data)
+    metrics.incr("description.template.rendered" if description is not None else "description.template.unusual")
+    return description
+
+def _fallback(weather_data, error):
+    logger.error(f"Error generating weather description with OpenAI: {str(error)}")
+    # Fallbacks aren't cached so the next request retries the AI
+    return ai_service.generate_fallback_description(weather_data)
+
+def _request_and_store(key, weather_data):
+    description = ai_service.request_ai_description(weather_data)
+    description_cache.set(key, description)
+    return description
+
+async def _async_request_and_store(key, weather_data):
+    description = await ai_service.async_request_ai_description(weather_data)
+    description_cache.set(key, description)
+    return description
+
+def _generate(key, weather_data):
+    try:
+        return _request_and_store(key, weather_data)
+    except Exception as e:
+        return _fallback(weather_data, e)
+
+async def _async_generate(key, weather_data):
+    try:
+        return await _async_request_and_store(key, weather_data)
+    except Exception as e:
+        return _fallback(weather_data, e)
+
+def _finish(registry, key, future):
+    with _generations_lock:
+        if registry.get(key) is future:
+            del registry[key]
+        late = key in _late
+        _late.discard(key)
+    failed = future.cancelled() or future.exception() is not None
+    if late:
+        metrics.incr("description.background.failed" if failed else "description.background.filled")
+
+def _deadline_exceeded(key, weather_data, generation):
+    with _generations_lock:
+        if not generation.done():
+            _late.add(key)
+    metrics.incr("description.deadline.exceeded")
+    logger.warning(f"OpenAI missed the {AI_DESCRIPTION_DEADLINE}s description deadline, answering with the fallback")
+    return ai_service.generate_fallback_description(weather_data)
+
+def _generation(key, weather_data):
+    # One background OpenAI call per fingerprint, shared by every waiting request
+    with _generations_lock:
+        future = _generations.get(key)
+        started = future is None
+        if started:
+            future = _executor.submit(_request_and_store, key, weather_data)
+            _generations[key] = future
+    if started:
+        future.add_done_callback(lambda done: _finish(_generations, key, done))
+    return future
+
+def _async_generation(key, weather_data):
+    loop = asyncio.get_running_loop()
+    with _generations_lock:
+        task = _async_generations.get(key)
+        started = task is None or task.get_loop() is not loop
+        if started:
+            task = asyncio.ensure_future(_async_request_and_store(key, weather_data))
+            _async_generations[key] = task
+    if started:
+        task.add_done_callback(lambda done: _finish(_async_generations, key, done))
+    return task
+
+def cached_description(weather_data, deadline=None):
+    """
+    Get the description for the given conditions, generating it on a miss.
+
+    Concurrent misses for the same fingerprint share one OpenAI call. When the
+    call outlives the deadline the fallback is returned and the call completes
+    in the background, caching its description.
+
+    Args:
+        weather_data: Weather data for a location
+        deadline: Seconds to wait for OpenAI, defaults to AI_DESCRIPTION_DEADLINE
+
+    Returns:
+        str: Template, cached, AI-generated or fallback description
+    """
+    description = _from_template(weather_data)
+    if description is not None:
+        return description
+    key = weather_fingerprint(weather_data)
+    description = description_cache.get(key)
+    if description is not None:
+        return description
+
+    deadline = AI_DESCRIPTION_DEADLINE if deadline is None else deadline
+    if deadline <= 0:
+        return coalesced(key, lambda: _generate(key, weather_data))
+    generation = _generation(key, weather_data)
+    try:
+        return generation.result(timeout=deadline)
+    except FuturesTimeoutError:
+        return _deadline_exceeded(key, weather_data, generation)
+    except Exception as e:
+        return _fallback(weather_data, e)
+
+async def async_cached_description(weather_data, deadline=None):
+    """
+    Async counterpart of cached_description for the ASGI serving mode.
+
+    Args:
+        weather_data: Weather data for a location
+        deadline: Seconds to wait for OpenAI, defaults to AI_DESCRIPTION_DEADLINE
+
+    Returns:
+        str: Template, cached, AI-generated or fallback description
+    """
+    description = _from_template(weather_data)
+    if description is not None:
+        return description
+    key = weather_fingerprint(weather_data)
+    description = description_cache.get(key)
+    if description is not None:
+        return description
+
+    deadline = AI_DESCRIPTION_DEADLINE if deadline is None else deadline
+    if deadline <= 0:
+        return await async_coalesced(key, lambda: _async_generate(key, weather_data))
+    generation = _async_generation(key, weather_data)
+    try:
+        # Shield so the OpenAI call outlives the deadline
+        return await asyncio.wait_for(asyncio.shield(generation), deadline)
+    except asyncio.TimeoutError:
+        return _deadline_exceeded(key, weather_data, generation)
+    except Exception as e:
+        return _fallback(weather_data, e)
+
+def _stream_done(key, weather_data, parts):
+    description = "".join(parts).strip()
+    if not description:
+        return _stream_fallback(weather_data, ValueError("Empty response from OpenAI API"))
+    description_cache.set(key, description)
+    metrics.incr("description.stream.ai")
+    return "done", {"description": description, "source": "ai"}
+
+def _stream_fallback(weather_data, error):
+    metrics.incr("description.stream.fallback")
+    # Replaces whatever text was streamed before the failure
+    return "done", {"description": _fallback(weather_data, error), "source": "fallback"}
+
+def _stream_ready(key, weather_data):
+    # A template or cached description is sent as one event
+    description = _from_template(weather_data)
+    source = "template"
+    if description is None:
+        description = description_cache.get(key)
+        source = "cache"
+    if description is None:
+        return None
+    metrics.incr(f"description.stream.{source}")
+    return "done", {"description": description, "source": source}
+
+def stream_description(weather_data):
+    """
+    Stream the description for the given conditions as it is generated.
+
+    Args:
+        weather_data: Weather data for a location
+
+    Yields:
+        tuple: (event, data) pairs, "delta" events with the next piece of
+        text followed by one "done" event with the complete description and
+        its source ("template", "cache", "ai" or "fallback")
+    """
+    key = weather_fingerprint(weather_data)
+    cached = _stream_ready(key, weather_data)
+    if cached is not None:
+        yield cached
+        return
+
+    parts = []
+    try:
+        for text in ai_service.stream_ai_description(weather_data):
+            parts.append(text)
+            yield "delta", {"text": text}
+    except Exception as e:
+        yield _stream_fallback(weather_data, e)
+        return
+    yield _stream_done(key, weather_data, parts)
+
+async def async_stream_description(weather_data):
+    """
+    Async counterpart of stream_description for the ASGI serving mode.
+
+    Args:
+        weather_data: Weather data for a location
+
+    Yields:
+        tuple: (event, data) pairs as yielded by stream_description
+    """
+    key = weather_fingerprint(weather_data)
+    cached = _stream_ready(key, weather_data)
+    if cached is not None:
+        yield cached
+        return
+
+    parts = []
+    try:
+        async for text in ai_service.async_stream_ai_description(weather_data):
+            parts.append(text)
+            yield "delta", {"text": text}
+    except Exception as e:
+        yield _stream_fallback(weather_data, e)
+        return
+    yield _stream_done(key, weather_data, parts)
+
+def _plan_batch(weather_list):
+    # Template or cached descriptions per item, and the first item of each missing fingerprint
+    keys = [weather_fingerprint(weather_data) for weather_data in weather_list]
+    descriptions = [
+        _from_template(weather_data) or description_cache.get(key)
+        for key, weather_data in zip(keys, weather_list)
+    ]
+    missing = {}
+    for index, key in enumerate(keys):
+        if descriptions[index] is None:
+            missing.setdefault(key, index)
+    return keys, descriptions, missing
+
+def _fill_batch(weather_list, keys, descriptions, missing, generated):
+    by_key = dict(zip(missing, generated))
+    for key, description in by_key.items():
+        # Fallbacks aren't cached so the next request retries the AI
+        if description is not None:
+            description_cache.set(key, description)
+    metrics.incr("description.batch.locations", len(missing))
+    for index, key in enumerate(keys):
+        if descriptions[index] is None:
+            descriptions[index] = by_key[key]
+        if descriptions[index] is None:
+            metrics.incr("description.batch.fallback")
+            descriptions[index] = ai_service.generate_fallback_description(weather_list[index])
+    return descriptions
+
+def cached_descriptions(weather_list):
+    """
+    Get descriptions for many locations, generating the misses in batches.
+
+    Args:
+        weather_list: Weather data for each location
+
+    Returns:
+        list: Template, cached, AI-generated or fallback description per location, in order
+    """
+    keys, descriptions, missing = _plan_batch(weather_list)
+    generated = ai_service.request_ai_descriptions([weather_list[index] for index in missing.values()]) if missing else []
+    return _fill_batch(weather_list, keys, descriptions, missing, generated)
+
+async def async_cached_descriptions(weather_list):
+    """
+    Async counterpart of cached_descriptions for the ASGI serving mode.
+
+    Args:
+        weather_list: Weather data for each location
+
+    Returns:
+        list: Template, cached, AI-generated or fallback description per location, in order
+    """
+    keys, descriptions, missing = _plan_batch(weather_list)
+    generated = []
+    if missing:
+        generated = await ai_service.async_request_ai_descriptions([weather_list[index] for index in missing.values()])
+    return _fill_batch(weather_list, keys, descriptions, missing, generated)
@@ -0,0 +1,248 @@
+"""
+Template tier of the description engine.
+
+Most descriptions follow from a handful of inputs, so common weather regimes
+are described by rendering one of several pre-written phrasing variants
+instead of calling gpt-4o. A regime is the (temperature band, weather main,
+humidity band, wind band) of the current conditions. The table shipped
+as data/description_templates.json holds hand-written variants; the tier is
+only used with DESCRIPTION_ENGINE=tiered.
+
+Lookups try the exact regime first and then fall back to entries that leave
+the humidity and/or wind band open ("*"). Conditions outside every band, or
+without an entry, are unusual and left to the live AI.
+
+Run ``python -m services.description_templates`` to replace the table with
+variants written by gpt-4o (see author_templates).
+"""
+
+import os
+import json
+import zlib
+import logging
+import threading
+from services import json_codec
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+DESCRIPTION_TEMPLATES_PATH = os.environ.get(
+    "DESCRIPTION_TEMPLATES_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "description_templates.json")
+)
+
+ANY = "*"
+
+# Band name and exclusive upper bound; values past the last bound have no band
+TEMPERATURE_BANDS = (
+    ("freezing", 0), ("cold", 8), ("cool", 16), ("mild", 24), ("warm", 30), ("hot", 38)
+)
+TEMPERATURE_FLOOR = -15
+HUMIDITY_BANDS = (("dry", 40), ("normal", 75), ("humid", 101))
+WIND_BANDS = (("calm", 3), ("breezy", 8), ("windy", 14))
+
+# OpenWeatherMap main classes sharing templates
+MAIN_ALIASES = {
+    "Drizzle": "Rain",
+    "Fog": "Mist",
+    "Haze": "Mist"
+}
+
+# Placeholders templates may use
+PLACEHOLDERS = ("location", "country", "temp", "feels_like", "description", "humidity", "wind_speed")
+
+_table = None
+_table_lock = threading.Lock()
+
+def _band(value, bands, floor=None):
+    if value is None or (floor is not None and value < floor):
+        return None
+    for name, upper in bands:
+        if value < upper:
+            return name
+    return None
+
+def regime(weather_data):
+    """
+    Classify the current conditions.
+
+    Args:
+        weather_data: Weather data for a location
+
+    Returns:
+        tuple: (temperature band, weather main, humidity band, wind band),
+        or None if the conditions fall outside the bands
+    """
+    current = weather_data["current"]
+    main = current["weather"].get("main")
+    bands = (
+        _band(current.get("temp"), TEMPERATURE_BANDS, TEMPERATURE_FLOOR),
+        MAIN_ALIASES.get(main, main),
+        _band(current.get("humidity"), HUMIDITY_BANDS),
+        _band(current.get("wind_speed"), WIND_BANDS)
+    )
+    return None if None in bands else bands
+
+def regime_key(temperature, main, humidity=ANY, wind=ANY):
+    """
+    Build the table key of a regime.
+
+    Returns:
+        str: Key such as "mild|Clear|*|*"
+    """
+    return "|".join((temperature, main, humidity, wind))
+
+def _candidate_keys(bands):
+    temperature, main, humidity, wind = bands
+    return (
+        regime_key(temperature, main, humidity, wind),
+        regime_key(temperature, main, humidity, ANY),
+        regime_key(temperature, main, ANY, wind),
+        regime_key(temperature, main)
+    )
+
+def load_table(path=None):
+    """
+    Load the template table, once per process unless a path is given.
+
+    Args:
+        path: JSON file to load, defaults to DESCRIPTION_TEMPLATES_PATH
+
+    Returns:
+        dict: Phrasing variants by regime key, empty if the file is missing
+    """
+    global _table
+
+    if path is None and _table is not None:
+        return _table
+    try:
+        with open(path or DESCRIPTION_TEMPLATES_PATH, "rb") as f:
+            table = json_codec.loads(f.read())["templates"]
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Description templates unavailable: {str(e)}")
+        table = {}
+    if path is None:
+        with _table_lock:
+            _table = table
+    return table
+
+def _values(weather_data):
+    location = weather_data["location"]
+    current = weather_data["current"]
+    return {
+        "location": location.get("name"),
+        "country": location.get("country"),
+        "temp": round(current.get("temp")),
+        "feels_like": round(current.get("feels_like", current.get("temp"))),
+        "description": current["weather"].get("description"),
+        "humidity": current.get("humidity"),
+        "wind_speed": current.get("wind_speed")
+    }
+
+def render(weather_data, table=None):
+    """
+    Describe the conditions from the template table.
+
+    The variant is picked from the location name, so a city keeps the same
+    phrasing while its conditions stay in one regime.
+
+    Args:
+        weather_data: Weather data for a location
+        table: Template table, defaults to load_table()
+
+    Returns:
+        str: Rendered description, or None for unusual conditions
+    """
+    bands = regime(weather_data)
+    if bands is None:
+        return None
+    table = load_table() if table is None else table
+    for key in _candidate_keys(bands):
+        variants = table.get(key)
+        if variants:
+            break
+    else:
+        return None
+
+    try:
+        values = _values(weather_data)
+        variant = variants[zlib.crc32(str(values["location"]).encode()) % len(variants)]
+        return variant.format(**values)
+    except (KeyError, IndexError, TypeError, ValueError) as e:
+        logger.error(f"Error rendering description template: {str(e)}")
+        return None
+
+def author_templates(regimes, variants=3):
+    """
+    Have gpt-4o write phrasing variants for each regime, for the offline table.
+
+    Args:
+        regimes: Regime keys to write templates for
+        variants: Variants to write per regime
+
+    Returns:
+        dict: Phrasing variants by regime key; variants using unknown
+        placeholders are dropped
+    """
+    from services.ai_service import SYSTEM_PROMPT, openai
+
+    sample = {name: 0 for name in PLACEHOLDERS}
+    table = {}
+    for key in regimes:
+        temperature, main, humidity, wind = key.split("|")
+        prompt = f"""Write {variants} alternative weather descriptions for these conditions: temperature band "{temperature}", weather "{main}", humidity "{humidity}", wind "{wind}" ("*" means any).
+
+        Each description is 3-4 concise, friendly sentences covering the current conditions, how it feels outside, relevant advice and how the weather affects outdoor activities.
+        Refer to the actual values only through these placeholders: {", ".join("{" + name + "}" for name in PLACEHOLDERS)}.
+
+        Answer with a JSON object of the form {{"templates": ["...", "..."]}}.
+        """
+        response = openai.chat.completions.create(
+            model="gpt-4o",
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.9,
+            response_format={"type": "json_object"},
+        )
+        written = []
+        for template in json_codec.loads(response.choices[0].message.content).get("templates", []):
+            try:
+                template.format(**sample)
+            except (KeyError, IndexError, ValueError, AttributeError):
+                logger.warning(f"Dropping template for {key} with unknown placeholders")
+                continue
+            written.append(template)
+        table[key] = written
+        logger.info(f"Wrote {len(written)} templates for {key}")
+    return table
+
+def common_regimes():
+    """
+    List the regimes the shipped table covers.
+
+    Returns:
+        list: Regime keys with open humidity and wind bands, plus the humid
+        variants of warm and hot clear weather
+    """
+    mains = {
+        "Clear": [name for name, _ in TEMPERATURE_BANDS],
+        "Clouds": [name for name, _ in TEMPERATURE_BANDS],
+        "Rain": ["cold", "cool", "mild", "warm", "hot"],
+        "Snow": ["freezing", "cold"],
+        "Mist": ["freezing", "cold", "cool", "mild", "warm"]
+    }
+    keys = [regime_key(temperature, main) for main, temperatures in mains.items() for temperature in temperatures]
+    keys += [regime_key("warm", "Clear", "humid"), regime_key("hot", "Clear", "humid")]
+    return keys
+
+if __name__ == "__main__":
+    import sys
+
+    output = sys.argv[1] if len(sys.argv) > 1 else DESCRIPTION_TEMPLATES_PATH
+    table = author_templates(common_regimes())
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "templates": table}, f, ensure_ascii=False, indent=2)
+    logger.info(f"Wrote {sum(map(len, table.values()))} templates to {output}")
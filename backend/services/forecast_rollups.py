@@ -0,0 +1,126 @@
+"""
+Daily and hourly views of the 3-hourly forecast.
+
+Clients mostly show the next day slot by slot and a summary per day, not
+all 40 slots. Both views are computed with NumPy when a forecast revision is
+first fetched (see forecast_updates.revise) and cached with the raw series,
+so /api/forecast?view=daily|hourly costs no aggregation per request.
+
+Days are local to the forecast's location, using the UTC offset
+OpenWeatherMap reports for its city.
+"""
+
+import os
+from datetime import datetime, timezone
+import numpy as np
+
+# Slots in the hourly view, 8 three-hour slots cover the next 24 hours
+FORECAST_HOURLY_SLOTS = int(os.environ.get("FORECAST_HOURLY_SLOTS", 8))
+
+# Fields of each slot kept by the hourly view, besides the weather condition
+HOURLY_FIELDS = ("datetime", "temp", "feels_like", "humidity", "wind_speed", "precipitation_prob")
+
+# Aggregates are rounded so float noise doesn't leak into responses
+ROLLUP_DECIMALS = 2
+
+def _column(items, field):
+    return np.array([np.nan if item.get(field) is None else item[field] for item in items], dtype=np.float64)
+
+def _values(array):
+    return [None if np.isnan(value) else float(value) for value in np.round(array, ROLLUP_DECIMALS)]
+
+def _mean(values, starts):
+    # Mean per day of the readings that aren't missing, NaN for days without any
+    valid = ~np.isnan(values)
+    totals = np.add.reduceat(np.where(valid, values, 0.0), starts)
+    counts = np.add.reduceat(valid.astype(np.int64), starts)
+    return np.divide(totals, counts, out=np.full(len(starts), np.nan), where=counts > 0)
+
+def _dominant_slots(items, starts, counts):
+    # Index of a representative slot per day: the first slot of the day's
+    # most frequent condition, ties going to the condition seen first
+    size = len(items)
+    mains = [(item.get("weather") or {}).get("main") or "" for item in items]
+    kinds, codes = np.unique(mains, return_inverse=True)
+    day_index = np.repeat(np.arange(len(starts)), counts)
+
+    tally = np.zeros((len(starts), len(kinds)), dtype=np.int64)
+    np.add.at(tally, (day_index, codes), 1)
+    first = np.full((len(starts), len(kinds)), size, dtype=np.int64)
+    np.minimum.at(first, (day_index, codes), np.arange(size))
+
+    dominant = (tally * (size + 1) + (size - first)).argmax(axis=1)
+    return first[np.arange(len(starts)), dominant]
+
+def daily(forecast_data):
+    """
+    Summarize the forecast per local day.
+
+    Args:
+        forecast_data: Forecast as returned by get_weather_forecast, slots in time order
+
+    Returns:
+        list: Per day its "date", the "datetime" of its first slot, the
+        temperature range and mean, mean humidity, strongest wind, highest
+        precipitation probability, dominant "weather" and number of "slots"
+    """
+    items = forecast_data["forecast"]
+    if not items:
+        return []
+
+    offset = forecast_data["location"].get("timezone") or 0
+    times = np.array([item["datetime"] for item in items], dtype=np.int64)
+    days = (times + offset) // 86400
+    starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+    counts = np.diff(np.r_[starts, len(items)])
+
+    temp_min = _values(np.fmin.reduceat(_column(items, "temp_min"), starts))
+    temp_max = _values(np.fmax.reduceat(_column(items, "temp_max"), starts))
+    temp = _values(_mean(_column(items, "temp"), starts))
+    humidity = _values(_mean(_column(items, "humidity"), starts))
+    wind_speed_max = _values(np.fmax.reduceat(_column(items, "wind_speed"), starts))
+    precipitation_prob_max = _values(np.fmax.reduceat(_column(items, "precipitation_prob"), starts))
+    representative = _dominant_slots(items, starts, counts)
+
+    return [
+        {
+            "date": datetime.fromtimestamp(int(days[start]) * 86400, timezone.utc).date().isoformat(),
+            "datetime": int(times[start]),
+            "temp_min": temp_min[day],
+            "temp_max": temp_max[day],
+            "temp": temp[day],
+            "humidity": humidity[day],
+            "wind_speed_max": wind_speed_max[day],
+            "precipitation_prob_max": precipitation_prob_max[day],
+            "weather": dict(items[representative[day]].get("weather") or {}),
+            "slots": int(counts[day])
+        }
+        for day, start in enumerate(starts)
+    ]
+
+def hourly(forecast_data):
+    """
+    Get the next slots with the fields a timeline shows.
+
+    Args:
+        forecast_data: Forecast as returned by get_weather_forecast
+
+    Returns:
+        list: The first FORECAST_HOURLY_SLOTS slots
+    """
+    return [
+        {**{field: item.get(field) for field in HOURLY_FIELDS}, "weather": dict(item.get("weather") or {})}
+        for item in forecast_data["forecast"][:FORECAST_HOURLY_SLOTS]
+    ]
+
+def rollups(forecast_data):
+    """
+    Compute every view of a forecast.
+
+    Args:
+        forecast_data: Forecast as returned by get_weather_forecast
+
+    Returns:
+        dict: Slots of the "daily" and "hourly" views
+    """
+    return {"daily": daily(forecast_data), "hourly": hourly(forecast_data)}
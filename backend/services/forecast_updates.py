@@ -0,0 +1,247 @@
+"""
+Forecast revisions aligned with the provider's update cadence.
+
+OpenWeatherMap recomputes its 3-hourly forecast a few times a day, so most
+refetches return the forecast already cached. Every fetched forecast is
+diffed slot by slot against the cached one and carries:
+
+- "revision": a digest of its slots, unchanged as long as they are
+- "issued_at": when this revision was published upstream, estimated as the
+  start of the update period for the first fetch and as the first fetch that
+  saw it otherwise (the provider doesn't report it)
+- "changes": the revision it replaced and the slots updated or removed since
+
+Cached forecasts turn stale when the provider's next update is due rather
+than after a fixed TTL, and are polled every FORECAST_RECHECK_INTERVAL while
+that update is late. Encoded response bodies are keyed by revision, so a
+refetch that changed nothing isn't encoded again, and clients that pass the
+revision they have get only the changed slots (see delta).
+
+Each revision also carries its daily and hourly rollups (see
+forecast_rollups), computed once when it is first fetched; view picks the
+document a request asked for.
+"""
+
+import os
+import time
+import hashlib
+import logging
+from services import forecast_rollups, json_codec, metrics, response_encoding, weather_service
+from services.cache_backends import async_call
+from services.cache_keys import location_cache_key
+from services.data_cache import async_cached_entry, cached_entry, register_schedule
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Seconds between forecast updates upstream, counted from midnight UTC
+FORECAST_UPDATE_INTERVAL = int(os.environ.get("FORECAST_UPDATE_INTERVAL", 3 * 3600))
+# Seconds after each period start until the update is usually published
+FORECAST_UPDATE_DELAY = int(os.environ.get("FORECAST_UPDATE_DELAY", 0))
+# Seconds between refetches while an expected update hasn't shown up
+FORECAST_RECHECK_INTERVAL = int(os.environ.get("FORECAST_RECHECK_INTERVAL", 600))
+
+# Documents /api/forecast?view= can return
+RAW = "raw"
+VIEWS = (RAW, "daily", "hourly")
+
+def _period_start(timestamp):
+    return (timestamp - FORECAST_UPDATE_DELAY) // FORECAST_UPDATE_INTERVAL * FORECAST_UPDATE_INTERVAL + FORECAST_UPDATE_DELAY
+
+def next_update(forecast_data, fetched_at):
+    """
+    Get when a cached forecast should be refetched.
+
+    Args:
+        forecast_data: Revised forecast as returned by revise
+        fetched_at: Unix time the forecast was fetched
+
+    Returns:
+        float: Unix time of the provider's next update after the forecast was
+        issued, or of the next recheck if that update is already overdue
+    """
+    issued_at = forecast_data.get("issued_at") or fetched_at
+    expected = _period_start(issued_at) + FORECAST_UPDATE_INTERVAL
+    if expected <= fetched_at:
+        return fetched_at + FORECAST_RECHECK_INTERVAL
+    return expected
+
+register_schedule('forecast', next_update)
+
+def _slot_digests(forecast_items):
+    return {
+        item["datetime"]: hashlib.blake2b(json_codec.dumps_bytes(item), digest_size=8).hexdigest()
+        for item in forecast_items
+    }
+
+def _revision(digests):
+    return hashlib.blake2b("".join(digests.values()).encode(), digest_size=8).hexdigest()
+
+def revise(previous, forecast_data, fetched_at):
+    """
+    Diff a freshly fetched forecast against the cached one.
+
+    Args:
+        previous: Revised forecast cached before, or None
+        forecast_data: Forecast as returned by get_weather_forecast
+        fetched_at: Unix time the forecast was fetched
+
+    Returns:
+        dict: The previous forecast if no slot changed, else the new forecast
+        with its "revision", "issued_at", "changes" and "rollups"
+    """
+    digests = _slot_digests(forecast_data["forecast"])
+    revision = _revision(digests)
+    if previous is not None and previous.get("revision") == revision:
+        metrics.incr("forecast.revision.unchanged")
+        return previous
+
+    if previous is None or "revision" not in previous:
+        metrics.incr("forecast.revision.first")
+        return {
+            **forecast_data,
+            "revision": revision,
+            "issued_at": _period_start(int(fetched_at)),
+            "changes": None,
+            "rollups": forecast_rollups.rollups(forecast_data)
+        }
+
+    previous_digests = _slot_digests(previous["forecast"])
+    updated = [slot for slot, digest in digests.items() if previous_digests.get(slot) != digest]
+    removed = [slot for slot in previous_digests if slot not in digests]
+    # Slots only rolling off the front and onto the end isn't a new upstream run
+    reissued = any(slot in previous_digests for slot in updated)
+    metrics.incr("forecast.revision.changed")
+    return {
+        **forecast_data,
+        "revision": revision,
+        "issued_at": int(fetched_at) if reissued else previous["issued_at"],
+        "changes": {"since": previous["revision"], "updated": updated, "removed": removed},
+        "rollups": forecast_rollups.rollups(forecast_data)
+    }
+
+def view(forecast_data, name=RAW):
+    """
+    Get one view of a revised forecast.
+
+    Args:
+        forecast_data: Revised forecast as returned by revise
+        name: One of VIEWS
+
+    Returns:
+        dict: The forecast without its rollups for the raw view, else its
+        location, revision, issue time and the view's slots as "forecast"
+
+    Raises:
+        ValueError: If the view is unknown
+    """
+    if name == RAW:
+        return {key: value for key, value in forecast_data.items() if key != "rollups"}
+    if name not in VIEWS:
+        raise ValueError(f"Unknown forecast view: {name}")
+
+    # Entries cached before rollups were added are summarized on the fly
+    rollups = forecast_data.get("rollups") or forecast_rollups.rollups(forecast_data)
+    return {
+        "location": forecast_data["location"],
+        "revision": forecast_data.get("revision"),
+        "issued_at": forecast_data.get("issued_at"),
+        "view": name,
+        "forecast": rollups[name]
+    }
+
+def delta(forecast_data, since):
+    """
+    Get the slots a client holding an earlier revision is missing.
+
+    Args:
+        forecast_data: Revised forecast as returned by revise
+        since: Revision the client has
+
+    Returns:
+        dict: Location, revision and issue time with the "updated" slots and
+        the datetimes of "removed" ones, or None if the client's revision is
+        neither this one nor the one it replaced
+    """
+    changes = forecast_data.get("changes")
+    if since == forecast_data["revision"]:
+        updated, removed = [], []
+    elif changes is not None and since == changes["since"]:
+        wanted = set(changes["updated"])
+        updated = [item for item in forecast_data["forecast"] if item["datetime"] in wanted]
+        removed = changes["removed"]
+    else:
+        metrics.incr("forecast.delta.full")
+        return None
+
+    metrics.incr("forecast.delta.sent")
+    return {
+        "location": forecast_data["location"],
+        "revision": forecast_data["revision"],
+        "issued_at": forecast_data["issued_at"],
+        "since": since,
+        "updated": updated,
+        "removed": removed
+    }
+
+def document(forecast_data, name, shape):
+    """
+    Build the response document of a view for response_encoding.encoded_body.
+
+    Args:
+        forecast_data: Revised forecast as returned by revise
+        name: One of VIEWS
+        shape: "json" or "columnar"
+
+    Returns:
+        dict: The view, with its slots as columns for the columnar shape
+    """
+    document = view(forecast_data, name)
+    return response_encoding.columnar_forecast(document) if shape == 'columnar' else document
+
+def _previous(cache, key):
+    entry = cache.get(key)
+    return None if entry is None else entry["value"]
+
+async def _async_previous(cache, key):
+    entry = await async_call(cache, 'get', key)
+    return None if entry is None else entry["value"]
+
+def cached_forecast_entry(cache, location):
+    """
+    Get the cached forecast entry of a location, fetching and revising it as needed.
+
+    Args:
+        cache: Flask-Caching or cachelib cache instance
+        location: Quantized location from quantize_location
+
+    Returns:
+        dict: Data cache entry whose value is a revised forecast
+    """
+    key = location_cache_key('forecast', location)
+
+    def fetch():
+        forecast_data = weather_service.get_weather_forecast(location.lat, location.lon)
+        return revise(_previous(cache, key), forecast_data, time.time())
+
+    return cached_entry(cache, 'forecast', key, fetch)
+
+async def async_cached_forecast_entry(cache, location):
+    """
+    Async counterpart of cached_forecast_entry for the ASGI serving mode.
+
+    Args:
+        cache: Cache instance
+        location: Quantized location from quantize_location
+
+    Returns:
+        dict: Data cache entry whose value is a revised forecast
+    """
+    key = location_cache_key('forecast', location)
+
+    async def fetch():
+        forecast_data = await weather_service.async_get_weather_forecast(location.lat, location.lon)
+        return revise(await _async_previous(cache, key), forecast_data, time.time())
+
+    return await async_cached_entry(cache, 'forecast', key, fetch)
@@ -0,0 +1,256 @@
+"""
+Server-side heatmap interpolation.
+
+City observations are interpolated onto a regular grid covering the
+viewport with vectorized inverse-distance weighting and returned as a
+compact binary raster: raw little-endian Float32 values or an 8-bit PNG.
+This is much smaller than JSON [lat, lon, intensity] triples and lets the
+browser draw one image instead of rendering every point.
+
+Rows run from north to south and columns from west to east. Cells without
+any data are NaN in the Float32 raster and fully transparent in the PNG.
+
+Rendered rasters are cached per heatmap view version, viewport, size and
+format, so repeated requests for an unchanged viewport skip interpolation.
+"""
+
+import os
+import zlib
+import struct
+import math
+import numpy as np
+from services import city_snapshot, response_encoding
+
+# Raster configuration
+RASTER_DEFAULT_WIDTH = int(os.environ.get("RASTER_DEFAULT_WIDTH", 256))
+RASTER_MAX_SIZE = int(os.environ.get("RASTER_MAX_SIZE", 1024))
+# Sources beyond this many are averaged into grid bins before interpolating
+RASTER_MAX_SOURCES = int(os.environ.get("RASTER_MAX_SOURCES", 1024))
+IDW_POWER = float(os.environ.get("IDW_POWER", 2))
+
+RASTER_FORMATS = ('float32', 'png')
+RASTER_MIMETYPES = {'float32': 'application/octet-stream', 'png': 'image/png'}
+
+# Grid cells evaluated per block, bounding the distance matrix to block x sources
+_BLOCK_CELLS = 4096
+
+def _clamp_size(value):
+    return max(1, min(RASTER_MAX_SIZE, int(value)))
+
+def parse_size(width, height):
+    """
+    Parse the raster size query parameters.
+
+    Args:
+        width: Width parameter as sent, or None
+        height: Height parameter as sent, or None
+
+    Returns:
+        tuple: (width, height) as ints, None where a parameter is missing or empty
+
+    Raises:
+        ValueError: If a parameter isn't an integer
+    """
+    return int(width) if width else None, int(height) if height else None
+
+def raster_size(bounds, width=None, height=None):
+    """
+    Pick the raster dimensions for a viewport.
+
+    A missing height follows the viewport's aspect ratio (with longitudes
+    scaled by the cosine of the middle latitude).
+
+    Args:
+        bounds: Viewport bounds (north, south, east, west)
+        width: Requested width in cells
+        height: Requested height in cells
+
+    Returns:
+        tuple: (width, height), each between 1 and RASTER_MAX_SIZE
+    """
+    width = int(width) if width else RASTER_DEFAULT_WIDTH
+    if not height:
+        lat_span = max(bounds['north'] - bounds['south'], 1e-6)
+        lon_span = max(bounds['east'] - bounds['west'], 1e-6)
+        scale = math.cos(math.radians((bounds['north'] + bounds['south']) / 2))
+        height = round(width * lat_span / (lon_span * max(scale, 0.01)))
+    return _clamp_size(width), _clamp_size(height)
+
+def _reduce_sources(lat, lon, values, bounds, max_sources):
+    # Average sources into a coarse grid so the distance matrix stays bounded
+    if len(values) <= max_sources:
+        return lat, lon, values
+
+    side = max(1, int(math.sqrt(max_sources)))
+    rows = np.clip(((bounds['north'] - lat) / max(bounds['north'] - bounds['south'], 1e-6) * side).astype(int), 0, side - 1)
+    cols = np.clip(((lon - bounds['west']) / max(bounds['east'] - bounds['west'], 1e-6) * side).astype(int), 0, side - 1)
+    bins = rows * side + cols
+
+    counts = np.bincount(bins, minlength=side * side)
+    occupied = counts > 0
+
+    def mean(column):
+        return np.bincount(bins, weights=column, minlength=side * side)[occupied] / counts[occupied]
+
+    return mean(lat), mean(lon), mean(values)
+
+def interpolate(snapshot, data_type, bounds, width, height, power=None):
+    """
+    Interpolate one heatmap layer onto a regular grid.
+
+    Args:
+        snapshot: City snapshot covering (at least) the viewport
+        data_type: Type of weather data (temperature, precipitation, humidity, pressure)
+        bounds: Viewport bounds (north, south, east, west)
+        width: Number of columns
+        height: Number of rows
+        power: Inverse-distance weighting power, defaults to IDW_POWER
+
+    Returns:
+        numpy.ndarray: float32 array of shape (height, width) with intensities
+        between 0 and 1, all NaN when there is no data
+    """
+    power = IDW_POWER if power is None else power
+    values = city_snapshot.intensities(snapshot, data_type)
+    present = ~np.isnan(values)
+    lat, lon, values = _reduce_sources(
+        snapshot.lat[present], snapshot.lon[present], values[present], bounds, RASTER_MAX_SOURCES
+    )
+
+    grid = np.full(width * height, np.nan, dtype=np.float32)
+    if len(values) == 0:
+        return grid.reshape(height, width)
+
+    # Cell centres, with longitudes scaled so distances are roughly isotropic
+    scale = math.cos(math.radians((bounds['north'] + bounds['south']) / 2))
+    lat_step = (bounds['north'] - bounds['south']) / height
+    lon_step = (bounds['east'] - bounds['west']) / width
+    cell_lat = np.repeat(bounds['north'] - (np.arange(height) + 0.5) * lat_step, width)
+    cell_lon = np.tile(bounds['west'] + (np.arange(width) + 0.5) * lon_step, height)
+
+    source_x = (lon * scale).astype(np.float32)
+    source_y = lat.astype(np.float32)
+    source_values = values.astype(np.float32)
+
+    for start in range(0, len(grid), _BLOCK_CELLS):
+        stop = min(start + _BLOCK_CELLS, len(grid))
+        dx = (cell_lon[start:stop, None] * scale).astype(np.float32) - source_x
+        dy = cell_lat[start:stop, None].astype(np.float32) - source_y
+        # The epsilon makes cells on top of a source take its value
+        weights = (dx * dx + dy * dy + np.float32(1e-12)) ** np.float32(-power / 2)
+        grid[start:stop] = weights @ source_values / weights.sum(axis=1)
+
+    return np.clip(grid, 0, 1).reshape(height, width)
+
+def encode_float32(grid):
+    """
+    Encode a raster as raw little-endian Float32 values.
+
+    Args:
+        grid: Array of shape (height, width)
+
+    Returns:
+        bytes: Row-major raster data
+    """
+    return grid.astype('<f4').tobytes()
+
+def _png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+def encode_png(grid):
+    """
+    Encode a raster as an 8-bit grayscale PNG with alpha.
+
+    Intensities map to gray levels 0-255; cells without data are transparent.
+
+    Args:
+        grid: Array of shape (height, width) with values between 0 and 1
+
+    Returns:
+        bytes: PNG image
+    """
+    height, width = grid.shape
+    missing = np.isnan(grid)
+    gray = np.round(np.where(missing, 0, grid) * 255).astype(np.uint8)
+    alpha = np.where(missing, 0, 255).astype(np.uint8)
+
+    pixels = np.empty((height, width * 2 + 1), dtype=np.uint8)
+    pixels[:, 0] = 0  # No per-row filter
+    pixels[:, 1::2] = gray
+    pixels[:, 2::2] = alpha
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 4, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + _png_chunk(b"IHDR", header)
+        + _png_chunk(b"IDAT", zlib.compress(pixels.tobytes(), 6))
+        + _png_chunk(b"IEND", b"")
+    )
+
+def _raster_headers(bounds, width, height):
+    return {
+        'X-Raster-Width': str(width),
+        'X-Raster-Height': str(height),
+        'X-Raster-Bounds': f"{bounds['west']},{bounds['south']},{bounds['east']},{bounds['north']}"
+    }
+
+def _check_format(raster_format):
+    if raster_format not in RASTER_FORMATS:
+        raise ValueError(f"Unknown raster format '{raster_format}', expected one of {', '.join(RASTER_FORMATS)}")
+
+def render(snapshot, data_type, bounds, raster_format, width=None, height=None):
+    """
+    Interpolate and encode a heatmap raster.
+
+    Args:
+        snapshot: City snapshot covering the viewport
+        data_type: Type of weather data (temperature, precipitation, humidity, pressure)
+        bounds: Viewport bounds (north, south, east, west)
+        raster_format: "float32" or "png"
+        width: Requested width in cells
+        height: Requested height in cells
+
+    Returns:
+        tuple: (body, mimetype, headers) where the headers describe the grid
+
+    Raises:
+        ValueError: If the format is unknown
+    """
+    _check_format(raster_format)
+
+    width, height = raster_size(bounds, width, height)
+    grid = interpolate(snapshot, data_type, bounds, width, height)
+    body = encode_png(grid) if raster_format == 'png' else encode_float32(grid)
+    return body, RASTER_MIMETYPES[raster_format], _raster_headers(bounds, width, height)
+
+def cached_render(cache, view, data_type, bounds, raster_format, width=None, height=None, coding=None):
+    """
+    Get a heatmap raster, rendering it only when the view's data changed.
+
+    Args:
+        cache: Flask-Caching or cachelib cache instance
+        view: HeatmapView covering the viewport
+        data_type: Type of weather data (temperature, precipitation, humidity, pressure)
+        bounds: Viewport bounds (north, south, east, west)
+        raster_format: "float32" or "png"
+        width: Requested width in cells
+        height: Requested height in cells
+        coding: Content coding from response_encoding.negotiate, only used
+            for Float32 rasters since PNGs are compressed already
+
+    Returns:
+        tuple: (body, mimetype, headers) where the headers describe the grid
+
+    Raises:
+        ValueError: If the format is unknown
+    """
+    _check_format(raster_format)
+
+    width, height = raster_size(bounds, width, height)
+    headers = _raster_headers(bounds, width, height)
+    encoded = response_encoding.encoded_body(
+        cache, 'heatmap', f"raster:{data_type}:{headers['X-Raster-Bounds']}:{width}x{height}", view.version,
+        lambda shape: render(view.snapshot(), data_type, bounds, raster_format, width, height)[0],
+        raster_format, None if raster_format == 'png' else coding, RASTER_MIMETYPES[raster_format]
+    )
+    return encoded.body, encoded.mimetype, {**encoded.headers, **headers}
@@ -0,0 +1,484 @@
+"""
+Tile-based heatmap cache.
+
+The map is divided into fixed-degree tiles aligned to lat -90 / lon -180.
+Each tile's city snapshot is fetched and cached on its own, so a
+viewport request only assembles the tiles it covers and fetches the ones
+that aren't cached yet; panning or switching the heatmap layer reuses
+everything already fetched.
+
+Tiles come in levels whose size doubles from HEATMAP_TILE_DEGREES; the
+smallest level covering the viewport with at most HEATMAP_MAX_TILES tiles is
+used, so zoomed-out views don't fan out to hundreds of upstream calls.
+
+A request fetches at most HEATMAP_MAX_TILE_FETCHES missing tiles, and no
+more than the interactive tier of the upstream quota has left. When more
+tiles are missing, the viewport is fetched with a single bounding-box call
+instead and the missing tiles are warmed in the background at the
+governor's PREFETCH priority, so they are the first calls to be dropped when
+the quota runs low. A view that still lacks tiles is partial: it is served
+with an X-Heatmap-Missing-Tiles header and never stored as a response.
+
+A HeatmapView carries a version derived from when each of its tiles was
+fetched, so responses encoded for a viewport can be cached and reused until
+one of its tiles is refreshed.
+"""
+
+import os
+import math
+import hashlib
+import asyncio
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from cachelib import NullCache
+from services import city_snapshot, metrics, weather_service
+from services.data_cache import async_cached_entry, cached_entry
+from services.rate_limit import PREFETCH, QuotaExhaustedError, priority, upstream_governor
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Tile configuration
+HEATMAP_TILE_DEGREES = float(os.environ.get("HEATMAP_TILE_DEGREES", 5))
+HEATMAP_MAX_TILES = int(os.environ.get("HEATMAP_MAX_TILES", 64))
+# Missing tiles a request waits for; beyond that the viewport is fetched as one box
+HEATMAP_MAX_TILE_FETCHES = int(os.environ.get("HEATMAP_MAX_TILE_FETCHES", 8))
+# Threads fetching missing tiles for one viewport
+HEATMAP_MAX_WORKERS = int(os.environ.get("HEATMAP_MAX_WORKERS", 8))
+# Fetch the tiles a request left out in the background, at PREFETCH priority
+HEATMAP_WARM_TILES = os.environ.get("HEATMAP_WARM_TILES", "true").lower() == "true"
+# Threads warming tiles in the background
+HEATMAP_WARM_WORKERS = int(os.environ.get("HEATMAP_WARM_WORKERS", 2))
+
+Tile = namedtuple("Tile", ["size", "row", "col"])
+
+_executor = ThreadPoolExecutor(max_workers=HEATMAP_MAX_WORKERS, thread_name_prefix="heatmap-tiles")
+_warm_executor = ThreadPoolExecutor(max_workers=HEATMAP_WARM_WORKERS, thread_name_prefix="heatmap-warm")
+# Keeps background warming tasks alive until they finish
+_background_tasks = set()
+
+def tile_levels(base=None):
+    """
+    Get the tile sizes available, smallest first.
+
+    Sizes double from the base size as long as they still divide the globe
+    evenly, so tiles wrap cleanly across the antimeridian.
+
+    Args:
+        base: Smallest tile size in degrees, defaults to HEATMAP_TILE_DEGREES
+
+    Returns:
+        list: Tile sizes in degrees
+    """
+    size = HEATMAP_TILE_DEGREES if base is None else base
+    levels = [size]
+    while size * 2 <= 90 and (360 / (size * 2)).is_integer():
+        size *= 2
+        levels.append(size)
+    return levels
+
+def _span(low, high, size, offset):
+    first = math.floor((low + offset) / size)
+    # A bound sitting exactly on a tile edge doesn't pull in the next tile
+    last = max(first, math.ceil((high + offset) / size) - 1)
+    return range(first, last + 1)
+
+def _clip_bounds(bounds):
+    south = max(-90.0, min(90.0, float(bounds['south'])))
+    north = max(south, min(90.0, float(bounds['north'])))
+    west = float(bounds['west'])
+    # Leaflet reports longitudes past +/-180 when the map is panned around the
+    # globe; anything wider than one globe shows the same tiles again
+    east = min(float(bounds['east']), west + 360)
+    return south, north, west, max(west, east)
+
+def tiles_for_bounds(bounds):
+    """
+    Get the tiles covering a viewport.
+
+    Column indexes are not wrapped, so tiles left of -180 or right of 180 keep
+    their position relative to the viewport (see tile_bounds for the wrapped
+    tile that holds their data).
+
+    Args:
+        bounds: Viewport bounds (north, south, east, west)
+
+    Returns:
+        list: Tiles covering the viewport, all of the same size
+    """
+    south, north, west, east = _clip_bounds(bounds)
+
+    for size in tile_levels():
+        rows = _span(south, north, size, 90)
+        cols = _span(west, east, size, 180)
+        if len(rows) * len(cols) <= HEATMAP_MAX_TILES:
+            break
+
+    max_row = math.ceil(180 / size) - 1
+    return [
+        Tile(size, row, col)
+        for row in rows if 0 <= row <= max_row
+        for col in cols
+    ]
+
+def _wrapped(tile):
+    columns = round(360 / tile.size)
+    return Tile(tile.size, tile.row, tile.col % columns)
+
+def tile_bounds(tile):
+    """
+    Get the bounds of a tile, wrapped into -180..180.
+
+    Args:
+        tile: Tile from tiles_for_bounds
+
+    Returns:
+        dict: Tile bounds (north, south, east, west)
+    """
+    tile = _wrapped(tile)
+    south = tile.row * tile.size - 90
+    west = tile.col * tile.size - 180
+    return {
+        'north': min(90, south + tile.size),
+        'south': south,
+        'east': west + tile.size,
+        'west': west
+    }
+
+def tile_cache_key(tile):
+    """
+    Build the cache key of a tile's city snapshot.
+
+    Args:
+        tile: Tile from tiles_for_bounds
+
+    Returns:
+        str: Cache key such as "heatmap:5:25:10"
+    """
+    tile = _wrapped(tile)
+    return f"heatmap:{tile.size:g}:{tile.row}:{tile.col}"
+
+def viewport_cache_key(data_type, bounds):
+    """
+    Build the cache key of one heatmap layer of a viewport.
+
+    Args:
+        data_type: Type of weather data (temperature, precipitation, humidity, etc.)
+        bounds: Viewport bounds (north, south, east, west)
+
+    Returns:
+        str: Cache key such as "heatmap-view:temperature:60:20:-60:-130"
+    """
+    return (
+        f"heatmap-view:{data_type}:{bounds['north']:g}:{bounds['south']:g}"
+        f":{bounds['east']:g}:{bounds['west']:g}"
+    )
+
+def _lon_offset(tile):
+    # Moves the cities of a wrapped tile to the world copy the viewport shows
+    return (tile.col - _wrapped(tile).col) * tile.size
+
+def _viewport_box(bounds):
+    # The viewport as one box call, or None if it crosses the antimeridian
+    south, north, west, east = _clip_bounds(bounds)
+    if west < -180 or east > 180:
+        return None
+    return {'north': north, 'south': south, 'east': east, 'west': west}
+
+def _box_cache_key(box):
+    return f"heatmap-box:{box['north']:g}:{box['south']:g}:{box['east']:g}:{box['west']:g}"
+
+def _fetch_budget():
+    # Missing tiles a request may fetch: the cap, or what the interactive tier has left
+    status = upstream_governor.status()
+    if status['paused_seconds'] > 0:
+        return 0
+    remaining = [window['remaining'] for window in (status['minute'], status['day']) if window is not None]
+    return min([HEATMAP_MAX_TILE_FETCHES] + remaining)
+
+def _plan(cache, tiles, bounds):
+    # Returns the missing tiles the request won't fetch, and the box to fetch instead, if any
+    missing = [tile for tile in tiles if cache.get(tile_cache_key(tile)) is None]
+    budget = _fetch_budget()
+    if len(missing) <= budget:
+        return [], None
+    box = _viewport_box(bounds) if budget > 0 else None
+    if box is not None:
+        return missing, box
+    return missing[budget:], None
+
+def _parts(tiles):
+    return [(tile_cache_key(tile), _lon_offset(tile)) for tile in tiles]
+
+def _fetch_tile(cache, tile):
+    return cached_entry(
+        cache, 'heatmap', tile_cache_key(tile),
+        lambda: weather_service.get_city_snapshot(tile_bounds(tile))
+    )
+
+async def _async_fetch_tile(cache, tile):
+    return await async_cached_entry(
+        cache, 'heatmap', tile_cache_key(tile),
+        lambda: weather_service.async_get_city_snapshot(tile_bounds(tile))
+    )
+
+def _fetch_box(cache, box):
+    return cached_entry(cache, 'heatmap', _box_cache_key(box), lambda: weather_service.get_city_snapshot(box))
+
+async def _async_fetch_box(cache, box):
+    return await async_cached_entry(
+        cache, 'heatmap', _box_cache_key(box), lambda: weather_service.async_get_city_snapshot(box)
+    )
+
+def _warm_tile(cache, tile):
+    try:
+        with priority(PREFETCH):
+            _fetch_tile(cache, tile)
+        metrics.incr("heatmap.tile_warmed")
+    except Exception as e:
+        logger.debug(f"Skipped warming heatmap tile {tile_cache_key(tile)}: {str(e)}")
+        metrics.incr("heatmap.warm_skipped")
+
+async def _async_warm_tile(cache, tile):
+    try:
+        with priority(PREFETCH):
+            await _async_fetch_tile(cache, tile)
+        metrics.incr("heatmap.tile_warmed")
+    except Exception as e:
+        logger.debug(f"Skipped warming heatmap tile {tile_cache_key(tile)}: {str(e)}")
+        metrics.incr("heatmap.warm_skipped")
+
+def _warm(cache, tiles):
+    if not HEATMAP_WARM_TILES:
+        return
+    for tile in tiles:
+        _warm_executor.submit(_warm_tile, cache, tile)
+
+def _async_warm(cache, tiles):
+    if not HEATMAP_WARM_TILES:
+        return
+    for tile in tiles:
+        task = asyncio.ensure_future(_async_warm_tile(cache, tile))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+class HeatmapView:
+    """The cached tiles covering a viewport."""
+
+    def __init__(self, parts, results, skipped=0):
+        """
+        Args:
+            parts: (cache key, longitude offset) of each tile, or of the viewport box
+            results: Cache entry or exception per part
+            skipped: Tiles of the viewport that weren't fetched at all
+
+        Raises:
+            Exception: If none of the parts could be fetched
+        """
+        self._entries = []
+        failures = []
+        for (key, offset), result in zip(parts, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error fetching heatmap tile {key}: {str(result)}")
+                metrics.incr("heatmap.tile_failed")
+                failures.append(result)
+            else:
+                self._entries.append((key, offset, result))
+
+        if not self._entries:
+            if failures:
+                raise failures[0]
+            raise QuotaExhaustedError("Upstream quota exhausted for heatmap tiles")
+        self.missing = len(failures) + skipped
+        if self.missing:
+            metrics.incr("heatmap.partial")
+        metrics.incr("heatmap.tiles", len(parts))
+
+    @property
+    def complete(self):
+        """True unless some of the viewport's tiles are missing."""
+        return self.missing == 0
+
+    @property
+    def headers(self):
+        """Response headers marking a partial view, so it isn't stored as if complete."""
+        if self.complete:
+            return {}
+        return {'X-Heatmap-Missing-Tiles': str(self.missing), 'Cache-Control': 'no-store'}
+
+    @property
+    def version(self):
+        """Opaque string that changes whenever one of the tiles is refetched."""
+        digest = hashlib.blake2b(digest_size=8)
+        for key, _, entry in self._entries:
+            digest.update(f"{key}@{entry['fetched_at']!r};".encode())
+        return digest.hexdigest()
+
+    def snapshot(self):
+        """
+        Join the tiles' cities.
+
+        Returns:
+            CitySnapshot: Cities of every tile that could be fetched
+        """
+        return city_snapshot.concat(
+            [entry['value'] for _, _, entry in self._entries],
+            [offset for _, offset, _ in self._entries]
+        )
+
+def response_cache(cache, view):
+    """
+    Get the cache to store a view's encoded responses in.
+
+    Args:
+        cache: Flask-Caching or cachelib cache instance
+        view: HeatmapView the response is built from
+
+    Returns:
+        The cache, or a cache that stores nothing if the view is partial
+    """
+    return cache if view.complete else NullCache()
+
+def get_heatmap_view(cache, bounds=None):
+    """
+    Get the cached tiles of a viewport.
+
+    Missing tiles are fetched concurrently, or the viewport as one box when
+    too many are missing. Tiles that fail are left out as long as at least
+    one tile could be fetched, and the view is marked partial.
+
+    Args:
+        cache: Flask-Caching or cachelib cache instance
+        bounds: Viewport bounds (north, south, east, west)
+
+    Returns:
+        HeatmapView: Tiles covering the viewport
+
+    Raises:
+        Exception: If none of the viewport's tiles could be fetched
+    """
+    bounds = bounds or weather_service.DEFAULT_HEATMAP_BOUNDS
+    tiles = tiles_for_bounds(bounds)
+    skipped, box = _plan(cache, tiles, bounds)
+    _warm(cache, skipped)
+    if box is not None:
+        metrics.incr("heatmap.box_fallback")
+        try:
+            return HeatmapView([(_box_cache_key(box), 0)], [_fetch_box(cache, box)])
+        except Exception as e:
+            if len(skipped) == len(tiles):
+                raise
+            logger.warning(f"Error fetching heatmap box, using cached tiles: {str(e)}")
+
+    tiles = [tile for tile in tiles if tile not in skipped]
+    futures = [_executor.submit(_fetch_tile, cache, tile) for tile in tiles]
+
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            results.append(e)
+    return HeatmapView(_parts(tiles), results, len(skipped))
+
+def get_heatmap_snapshot(cache, bounds=None):
+    """
+    Get the cities of a viewport, assembled from cached tiles.
+
+    Args:
+        cache: Flask-Caching or cachelib cache instance
+        bounds: Viewport bounds (north, south, east, west)
+
+    Returns:
+        CitySnapshot: Cities of every tile covering the viewport
+
+    Raises:
+        Exception: If none of the viewport's tiles could be fetched
+    """
+    return get_heatmap_view(cache, bounds).snapshot()
+
+def get_heatmap(cache, data_type='temperature', bounds=None):
+    """
+    Get heatmap points for a viewport, assembled from cached tiles.
+
+    Args:
+        cache: Flask-Caching or cachelib cache instance
+        data_type: Type of weather data (temperature, precipitation, humidity, etc.)
+        bounds: Viewport bounds (north, south, east, west)
+
+    Returns:
+        list: [lat, lon, intensity] points for the heatmap
+
+    Raises:
+        Exception: If none of the viewport's tiles could be fetched
+    """
+    return city_snapshot.heatmap_points(get_heatmap_snapshot(cache, bounds), data_type)
+
+async def async_get_heatmap_view(cache, bounds=None):
+    """
+    Async counterpart of get_heatmap_view for the ASGI serving mode.
+
+    Args:
+        cache: cachelib cache instance
+        bounds: Viewport bounds (north, south, east, west)
+
+    Returns:
+        HeatmapView: Tiles covering the viewport
+
+    Raises:
+        Exception: If none of the viewport's tiles could be fetched
+    """
+    bounds = bounds or weather_service.DEFAULT_HEATMAP_BOUNDS
+    tiles = tiles_for_bounds(bounds)
+    # One cache lookup per tile plus the quota status, off the event loop
+    skipped, box = await asyncio.to_thread(_plan, cache, tiles, bounds)
+    _async_warm(cache, skipped)
+    if box is not None:
+        metrics.incr("heatmap.box_fallback")
+        try:
+            return HeatmapView([(_box_cache_key(box), 0)], [await _async_fetch_box(cache, box)])
+        except Exception as e:
+            if len(skipped) == len(tiles):
+                raise
+            logger.warning(f"Error fetching heatmap box, using cached tiles: {str(e)}")
+
+    tiles = [tile for tile in tiles if tile not in skipped]
+    results = await asyncio.gather(
+        *[_async_fetch_tile(cache, tile) for tile in tiles], return_exceptions=True
+    )
+    return HeatmapView(_parts(tiles), results, len(skipped))
+
+async def async_get_heatmap_snapshot(cache, bounds=None):
+    """
+    Async counterpart of get_heatmap_snapshot for the ASGI serving mode.
+
+    Args:
+        cache: cachelib cache instance
+        bounds: Viewport bounds (north, south, east, west)
+
+    Returns:
+        CitySnapshot: Cities of every tile covering the viewport
+
+    Raises:
+        Exception: If none of the viewport's tiles could be fetched
+    """
+    return (await async_get_heatmap_view(cache, bounds)).snapshot()
+
+async def async_get_heatmap(cache, data_type='temperature', bounds=None):
+    """
+    Async counterpart of get_heatmap for the ASGI serving mode.
+
+    Args:
+        cache: cachelib cache instance
+        data_type: Type of weather data (temperature, precipitation, humidity, etc.)
+        bounds: Viewport bounds (north, south, east, west)
+
+    Returns:
+        list: [lat, lon, intensity] points for the heatmap
+
+    Raises:
+        Exception: If none of the viewport's tiles could be fetched
+    """
+    return city_snapshot.heatmap_points(await async_get_heatmap_snapshot(cache, bounds), data_type)
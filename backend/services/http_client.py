@@ -0,0 +1,316 @@
+"""
+Shared upstream HTTP client.
+
+All outbound calls to OpenWeatherMap go through a pooled, keep-alive
+requests session so cache misses reuse warm connections instead of paying a
+fresh DNS lookup and TLS handshake on every call. The ASGI serving mode uses
+an equivalent pool of httpx.AsyncClient instances.
+
+Every attempt, retries included, first takes its share of the upstream
+quota from the governor in services.rate_limit, and a 429 pauses further
+calls for the Retry-After time.
+Calls also go through the OpenWeatherMap circuit breaker: connection errors,
+5xx responses and calls slower than the latency SLO count as failures, and
+while the breaker is open calls fail at once with CircuitOpenError.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from services.circuit_breaker import openweather_breaker
+from services.rate_limit import QuotaExhaustedError, upstream_governor
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Connection pool configuration
+POOL_CONNECTIONS = int(os.environ.get("UPSTREAM_POOL_CONNECTIONS", 4))
+POOL_MAXSIZE = int(os.environ.get("UPSTREAM_POOL_MAXSIZE", 10))
+# The async client multiplexes many in-flight requests, so it needs a larger pool
+ASYNC_POOL_MAXSIZE = int(os.environ.get("UPSTREAM_ASYNC_POOL_MAXSIZE", 100))
+# httpcore's pool bookkeeping is linear in the number of open connections per
+# client, so the async pool is split across several small clients
+ASYNC_SHARD_SIZE = int(os.environ.get("UPSTREAM_ASYNC_SHARD_SIZE", 10))
+
+# Timeouts in seconds, so one slow upstream call can't tie up a worker
+CONNECT_TIMEOUT = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", 3.05))
+READ_TIMEOUT = float(os.environ.get("UPSTREAM_READ_TIMEOUT", 10))
+
+# Retry configuration for rate limiting (429) and transient server errors
+MAX_RETRIES = int(os.environ.get("UPSTREAM_MAX_RETRIES", 3))
+BACKOFF_FACTOR = float(os.environ.get("UPSTREAM_BACKOFF_FACTOR", 0.5))
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+_async_clients = []
+_async_in_flight = []
+_async_client_loop = None
+# Strong references to tasks closing the clients of a previous event loop
+_closing_tasks = set()
+
+def create_session(pool_connections=None, pool_maxsize=None, max_retries=None, backoff_factor=None):
+    """
+    Create a requests session with a keep-alive connection pool.
+
+    The adapter only retries failed connections, which never reached
+    upstream. Error responses are retried by get, so that every attempt
+    takes its own share of the quota.
+
+    Args:
+        pool_connections: Number of distinct hosts to keep pools for
+        pool_maxsize: Maximum number of connections kept per host
+        max_retries: Maximum number of retries on connection errors
+        backoff_factor: Exponential backoff factor between retries
+
+    Returns:
+        requests.Session: Configured session
+    """
+    max_retries = MAX_RETRIES if max_retries is None else max_retries
+    retry = Retry(
+        total=max_retries,
+        connect=max_retries,
+        read=0,
+        status=0,
+        backoff_factor=BACKOFF_FACTOR if backoff_factor is None else backoff_factor,
+        status_forcelist=(),
+        allowed_methods=frozenset(["GET"]),
+        # Hand error responses back so callers can raise_for_status()
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(
+        pool_connections=POOL_CONNECTIONS if pool_connections is None else pool_connections,
+        pool_maxsize=POOL_MAXSIZE if pool_maxsize is None else pool_maxsize,
+        max_retries=retry
+    )
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def get_session():
+    """
+    Get the session for the current worker process.
+
+    The session is created lazily and re-created after a fork, so gunicorn
+    workers never share sockets inherited from the master process.
+
+    Returns:
+        requests.Session: Pooled session for this process
+    """
+    global _session, _session_pid
+
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                _session = create_session()
+                _session_pid = pid
+                logger.info(f"Created upstream HTTP session for worker {pid}")
+    return _session
+
+def close_session():
+    """Close the current worker's session and release its pooled connections."""
+    global _session, _session_pid
+
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _session_pid = None
+
+def get(url, params=None, timeout=None, **kwargs):
+    """
+    Perform a GET request through the pooled session.
+
+    Responses with a 429 or 5xx status are retried with exponential backoff,
+    or after their Retry-After time capped at the read timeout. Each attempt
+    takes its own share of the quota.
+
+    Args:
+        url: URL to fetch
+        params: Query string parameters
+        timeout: Optional (connect, read) timeout tuple overriding the defaults
+
+    Returns:
+        requests.Response: The upstream response
+
+    Raises:
+        CircuitOpenError: If the upstream's circuit breaker is open
+        QuotaExhaustedError: If the call doesn't fit in the remaining quota
+    """
+    if timeout is None:
+        timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+    openweather_breaker.before_call()
+    session = get_session()
+    try:
+        for attempt in range(MAX_RETRIES + 1):
+            # Retries are upstream calls too
+            upstream_governor.acquire()
+            # Only time the call itself, not quota waits or backoff
+            started = time.monotonic()
+            response = session.get(url, params=params, timeout=timeout, **kwargs)
+            if response.status_code not in RETRY_STATUS_CODES or attempt == MAX_RETRIES:
+                _record_outcome(response, started)
+                _pause_if_rate_limited(response)
+                return response
+            time.sleep(_retry_delay(response, attempt))
+    except requests.exceptions.RequestException:
+        openweather_breaker.record_failure()
+        raise
+    except QuotaExhaustedError:
+        # The probe a half-open breaker admitted was never sent
+        openweather_breaker.release_probe()
+        raise
+
+def _create_async_client(max_connections):
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections
+        ),
+        timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+        # Transport-level retries only cover connection failures
+        transport=httpx.AsyncHTTPTransport(retries=MAX_RETRIES)
+    )
+
+def _async_shards():
+    global _async_clients, _async_in_flight, _async_client_loop
+
+    loop = asyncio.get_running_loop()
+    if not _async_clients or _async_client_loop is not loop:
+        if _async_clients:
+            _retire_async_clients(_async_clients, _async_client_loop)
+        shard_size = max(1, min(ASYNC_SHARD_SIZE, ASYNC_POOL_MAXSIZE))
+        shards = -(-ASYNC_POOL_MAXSIZE // shard_size)
+        _async_clients = [_create_async_client(shard_size) for _ in range(shards)]
+        _async_in_flight = [0] * shards
+        _async_client_loop = loop
+    return _async_clients
+
+async def _close_clients(clients):
+    for client in clients:
+        try:
+            await client.aclose()
+        except RuntimeError as e:
+            # The connections' loop is closed; closing the client still drops its pool
+            logger.debug(f"Dropped async client of a closed event loop: {str(e)}")
+
+def _retire_async_clients(clients, loop):
+    # Connections can only be shut down on the loop they were opened on
+    if loop.is_running():
+        asyncio.run_coroutine_threadsafe(_close_clients(clients), loop)
+        return
+    task = asyncio.ensure_future(_close_clients(clients))
+    _closing_tasks.add(task)
+    task.add_done_callback(_closing_tasks.discard)
+
+def _least_busy_shard():
+    clients = _async_shards()
+    return min(range(len(clients)), key=_async_in_flight.__getitem__)
+
+def get_async_client():
+    """
+    Get the least busy pooled async client for the running event loop.
+
+    Requests are spread over ASYNC_POOL_MAXSIZE / ASYNC_SHARD_SIZE clients,
+    preferring the first idle one so light traffic stays on warm connections.
+
+    Returns:
+        httpx.AsyncClient: Pooled client with the configured timeouts
+    """
+    return _async_clients[_least_busy_shard()]
+
+async def close_async_client():
+    """Close the async clients and release their pooled connections."""
+    global _async_clients, _async_in_flight, _async_client_loop
+
+    clients = _async_clients
+    _async_clients = []
+    _async_in_flight = []
+    _async_client_loop = None
+    await _close_clients(clients)
+
+def _retry_after(response):
+    retry_after = response.headers.get("Retry-After")
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    return None
+
+def _pause_if_rate_limited(response):
+    if response.status_code == 429:
+        logger.warning("Upstream rate limit hit, pausing upstream calls")
+        upstream_governor.pause(_retry_after(response))
+
+def _record_outcome(response, started):
+    # Client errors and 429s mean upstream is up, only 5xx count against it
+    if response.status_code >= 500:
+        openweather_breaker.record_failure()
+    else:
+        openweather_breaker.record_success(time.monotonic() - started)
+
+def _retry_delay(response, attempt):
+    retry_after = _retry_after(response)
+    if retry_after is not None:
+        return min(retry_after, READ_TIMEOUT)
+    return BACKOFF_FACTOR * (2 ** attempt)
+
+async def async_get(url, params=None, timeout=None):
+    """
+    Perform a GET request through the pooled async client.
+
+    Responses with a 429 or 5xx status are retried like in get.
+
+    Args:
+        url: URL to fetch
+        params: Query string parameters
+        timeout: Optional (connect, read) timeout tuple overriding the defaults
+
+    Returns:
+        httpx.Response: The upstream response
+
+    Raises:
+        CircuitOpenError: If the upstream's circuit breaker is open
+        QuotaExhaustedError: If a call doesn't fit in the remaining quota
+    """
+    openweather_breaker.before_call()
+    index = _least_busy_shard()
+    client = _async_clients[index]
+    if timeout is not None:
+        timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+    else:
+        timeout = client.timeout
+
+    in_flight = _async_in_flight
+    in_flight[index] += 1
+    try:
+        for attempt in range(MAX_RETRIES + 1):
+            # Retries are upstream calls too
+            await upstream_governor.async_acquire()
+            # Only time the call itself, not quota waits or backoff
+            started = time.monotonic()
+            response = await client.get(url, params=params, timeout=timeout)
+            if response.status_code not in RETRY_STATUS_CODES or attempt == MAX_RETRIES:
+                _record_outcome(response, started)
+                _pause_if_rate_limited(response)
+                return response
+            await asyncio.sleep(_retry_delay(response, attempt))
+    except httpx.HTTPError:
+        openweather_breaker.record_failure()
+        raise
+    except QuotaExhaustedError:
+        # The probe a half-open breaker admitted was never sent
+        openweather_breaker.release_probe()
+        raise
+    finally:
+        in_flight[index] -= 1
@@ -0,0 +1,77 @@
+"""
+Pluggable JSON encoding and decoding.
+
+API responses, upstream payloads and pre-encoded bodies all go through this
+module. It uses orjson when it is installed and falls back to the standard
+library otherwise; JSON_LIBRARY=json forces the fallback.
+
+Both backends produce compact JSON. orjson also serializes NumPy arrays and
+scalars, and writes NaN as null instead of the non-standard NaN literal.
+"""
+
+import os
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# "auto" uses orjson when available, "json" always uses the standard library
+JSON_LIBRARY = os.environ.get("JSON_LIBRARY", "auto")
+
+_ORJSON_OPTIONS = (orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+def backend():
+    """
+    Get the JSON library in use.
+
+    Returns:
+        str: "orjson" or "json"
+    """
+    return "orjson" if orjson is not None and JSON_LIBRARY != "json" else "json"
+
+def dumps_bytes(obj, default=None):
+    """
+    Serialize an object to compact UTF-8 encoded JSON.
+
+    Args:
+        obj: Object to serialize
+        default: Optional callable turning unsupported objects into supported ones
+
+    Returns:
+        bytes: JSON document
+    """
+    if backend() == "orjson":
+        return orjson.dumps(obj, default=default, option=_ORJSON_OPTIONS)
+    return json.dumps(obj, default=default, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+def dumps(obj, default=None):
+    """
+    Serialize an object to a compact JSON string.
+
+    Args:
+        obj: Object to serialize
+        default: Optional callable turning unsupported objects into supported ones
+
+    Returns:
+        str: JSON document
+    """
+    return dumps_bytes(obj, default).decode("utf-8")
+
+def loads(data):
+    """
+    Parse a JSON document.
+
+    Args:
+        data: JSON as bytes or str
+
+    Returns:
+        The decoded object
+
+    Raises:
+        ValueError: If the document is not valid JSON
+    """
+    if backend() == "orjson":
+        return orjson.loads(data)
+    return json.loads(data)
@@ -0,0 +1,76 @@
+"""
+In-process counters for cache and upstream observability.
+
+Counters are plain integers keyed by dotted names (for example
+``cache.weather.hit``) and are exposed through the ``/api/metrics`` endpoint.
+"""
+
+import threading
+from collections import defaultdict
+
+_counters = defaultdict(int)
+_lock = threading.Lock()
+
+def incr(name, amount=1):
+    """
+    Increment a counter.
+
+    Args:
+        name: Dotted counter name
+        amount: Amount to add
+    """
+    with _lock:
+        _counters[name] += amount
+
+def get(name):
+    """
+    Get the current value of a counter.
+
+    Args:
+        name: Dotted counter name
+
+    Returns:
+        int: Counter value, 0 if it was never incremented
+    """
+    with _lock:
+        return _counters.get(name, 0)
+
+def snapshot():
+    """
+    Get a copy of all counters.
+
+    Returns:
+        dict: Counter names mapped to their values
+    """
+    with _lock:
+        return dict(_counters)
+
+def hit_rates():
+    """
+    Derive hit rates for every cache namespace from its hit/miss counters.
+
+    Returns:
+        dict: Namespace mapped to its hit rate between 0 and 1
+    """
+    counters = snapshot()
+    namespaces = {
+        name[len("cache."):-len(".hit")]
+        for name in counters
+        if name.startswith("cache.") and name.endswith(".hit")
+    } | {
+        name[len("cache."):-len(".miss")]
+        for name in counters
+        if name.startswith("cache.") and name.endswith(".miss")
+    }
+
+    rates = {}
+    for namespace in sorted(namespaces):
+        hits = counters.get(f"cache.{namespace}.hit", 0)
+        misses = counters.get(f"cache.{namespace}.miss", 0)
+        rates[namespace] = round(hits / (hits + misses), 4) if hits + misses else 0.0
+    return rates
+
+def reset():
+    """Reset all counters."""
+    with _lock:
+        _counters.clear()
@@ -0,0 +1,205 @@
+"""
+In-memory spatial index over recently fetched weather observations.
+
+Every observation fetched from OpenWeatherMap (single locations and the
+cities of heatmap tiles) is bucketed into a fixed-degree grid. When the
+nearest-observation mode is enabled, a lookup within NEAREST_OBSERVATION_KM
+of an observation younger than NEAREST_OBSERVATION_MAX_AGE is answered from
+the index instead of going upstream, which lets dense urban traffic share
+observations across neighbouring requests.
+"""
+
+import os
+import math
+import time
+import logging
+import threading
+from services import metrics
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Nearest-observation mode, disabled with a radius of 0
+NEAREST_OBSERVATION_KM = float(os.environ.get("NEAREST_OBSERVATION_KM", 0))
+NEAREST_OBSERVATION_MAX_AGE = int(os.environ.get("NEAREST_OBSERVATION_MAX_AGE", 600))
+OBSERVATION_INDEX_MAX_SIZE = int(os.environ.get("OBSERVATION_INDEX_MAX_SIZE", 50000))
+# Share of the maximum size kept after pruning, so a full index isn't pruned on every record
+OBSERVATION_INDEX_LOW_WATER = 0.9
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.32
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """
+    Get the great-circle distance between two points.
+
+    Args:
+        lat1: Latitude of the first point
+        lon1: Longitude of the first point
+        lat2: Latitude of the second point
+        lon2: Longitude of the second point
+
+    Returns:
+        float: Distance in kilometers
+    """
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+class ObservationIndex:
+    """Thread-safe grid index of observations with a maximum age."""
+
+    def __init__(self, cell_km=None, max_age=None, max_size=None):
+        """
+        Args:
+            cell_km: Grid cell height in kilometers, defaults to the lookup radius
+            max_age: Seconds an observation stays usable
+            max_size: Maximum number of observations kept
+        """
+        cell_km = cell_km or NEAREST_OBSERVATION_KM or 5
+        self.cell_degrees = cell_km / KM_PER_DEGREE
+        self.max_age = NEAREST_OBSERVATION_MAX_AGE if max_age is None else max_age
+        self.max_size = OBSERVATION_INDEX_MAX_SIZE if max_size is None else max_size
+        self._cells = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _cell(self, lat, lon):
+        return (math.floor(lat / self.cell_degrees), math.floor(lon / self.cell_degrees))
+
+    def record(self, lat, lon, data, observed_at=None):
+        """
+        Add an observation, replacing any older one at the same coordinates.
+
+        Args:
+            lat: Latitude of the observation
+            lon: Longitude of the observation
+            data: Weather data to answer nearby lookups with
+            observed_at: Unix time of the observation, defaults to now
+        """
+        if lat is None or lon is None:
+            return
+        observed_at = time.time() if observed_at is None else observed_at
+        station = (round(lat, 4), round(lon, 4))
+
+        with self._lock:
+            cell = self._cells.setdefault(self._cell(lat, lon), {})
+            if station not in cell:
+                self._size += 1
+            elif cell[station][2] > observed_at:
+                return
+            cell[station] = (lat, lon, observed_at, data)
+            if self._size > self.max_size:
+                self._prune()
+
+    def _prune(self):
+        # Drop expired observations, then the oldest ones down to the low-water mark
+        cutoff = time.time() - self.max_age
+        entries = []
+        for key, cell in self._cells.items():
+            for station, entry in cell.items():
+                if entry[2] >= cutoff:
+                    entries.append((entry[2], key, station))
+        entries.sort(reverse=True)
+        keep = entries[:int(self.max_size * OBSERVATION_INDEX_LOW_WATER)]
+
+        cells = {}
+        for _, key, station in keep:
+            cells.setdefault(key, {})[station] = self._cells[key][station]
+        metrics.incr("observation_index.evicted", self._size - len(keep))
+        self._cells = cells
+        self._size = len(keep)
+
+    def nearest(self, lat, lon, radius_km, max_age=None):
+        """
+        Find the closest fresh observation within a radius.
+
+        Args:
+            lat: Latitude to search around
+            lon: Longitude to search around
+            radius_km: Maximum distance in kilometers
+            max_age: Maximum observation age in seconds, defaults to the index's
+
+        Returns:
+            tuple: (data, distance_km, age_seconds), or None if nothing qualifies
+        """
+        now = time.time()
+        cutoff = now - (self.max_age if max_age is None else max_age)
+        lat_span = radius_km / KM_PER_DEGREE
+        lon_span = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+        row_low, col_low = self._cell(lat - lat_span, lon - lon_span)
+        row_high, col_high = self._cell(lat + lat_span, lon + lon_span)
+
+        best = None
+        with self._lock:
+            for row in range(row_low, row_high + 1):
+                for col in range(col_low, col_high + 1):
+                    for entry_lat, entry_lon, observed_at, data in self._cells.get((row, col), {}).values():
+                        if observed_at < cutoff:
+                            continue
+                        distance = haversine_km(lat, lon, entry_lat, entry_lon)
+                        if distance <= radius_km and (best is None or distance < best[1]):
+                            best = (data, distance, now - observed_at)
+        return best
+
+    def clear(self):
+        """Remove all observations."""
+        with self._lock:
+            self._cells = {}
+            self._size = 0
+
+    def __len__(self):
+        with self._lock:
+            return self._size
+
+observation_index = ObservationIndex()
+
+def enabled():
+    """
+    Check whether the nearest-observation mode is on.
+
+    Returns:
+        bool: True if lookups may be answered from the index
+    """
+    return NEAREST_OBSERVATION_KM > 0
+
+def record_weather(weather_data):
+    """
+    Index a parsed weather observation if the nearest-observation mode is on.
+
+    Args:
+        weather_data: Weather data as returned by get_weather_data
+    """
+    if enabled():
+        location = weather_data["location"]
+        # Aged by when upstream observed it, not when we fetched it
+        observed_at = weather_data.get("current", {}).get("datetime")
+        observation_index.record(location.get("lat"), location.get("lon"), weather_data, observed_at)
+
+def nearest_weather(lat, lon):
+    """
+    Answer a weather lookup from a nearby fresh observation.
+
+    Args:
+        lat: Latitude of the location
+        lon: Longitude of the location
+
+    Returns:
+        dict: Weather data of the nearest observation with a "nearest" entry
+        giving its distance and age, or None if the mode is off or nothing
+        qualifies
+    """
+    if not enabled():
+        return None
+
+    found = observation_index.nearest(lat, lon, NEAREST_OBSERVATION_KM, NEAREST_OBSERVATION_MAX_AGE)
+    if found is None:
+        metrics.incr("observation_index.miss")
+        return None
+
+    data, distance, age = found
+    metrics.incr("observation_index.hit")
+    return {**data, "nearest": {"distance_km": round(distance, 2), "age_seconds": int(age)}}
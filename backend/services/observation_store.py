@@ -0,0 +1,673 @@
+"""
+Persistent, append-only store of fetched observations and forecasts.
+
+When OBSERVATION_STORE_URL or DATABASE_URL is set, every current-weather
+observation fetched from OpenWeatherMap (single locations and the cities of
+heatmap tiles) and every forecast is written to that SQL database, e.g. a
+SQLite file locally or Postgres in production. The store is off otherwise.
+Repeat lookups younger than OBSERVATION_STORE_MAX_AGE are answered from the
+store instead of upstream, which survives restarts and, with a database
+every worker and container connects to, is shared between them. The
+observations build up a history that /api/history serves.
+
+Writes are buffered and bulk-inserted by a background thread. Rows are keyed
+by the geo-cell of cache_keys.quantize_location and the observation time, so
+repeated fetches of one observation are stored once.
+
+Observations older than OBSERVATION_COMPACT_AFTER are compacted into one
+block per cell: each column becomes a list (timestamps delta-encoded), packed
+with msgpack and compressed with zlib, which takes a fraction of the space
+of the row table.
+"""
+
+import os
+import time
+import zlib
+import atexit
+import asyncio
+import logging
+import threading
+import msgpack
+from sqlalchemy import (
+    Column, Float, Index, Integer, LargeBinary, MetaData, String, Table, create_engine, delete, event, insert,
+    select
+)
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.pool import StaticPool
+from services import json_codec, metrics
+from services.cache_keys import quantize_location
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Database URL, the store is disabled unless one is set
+OBSERVATION_STORE_URL = os.environ.get("OBSERVATION_STORE_URL", os.environ.get("DATABASE_URL", ""))
+# Seconds a stored observation or forecast answers repeat lookups, 0 only records
+OBSERVATION_STORE_MAX_AGE = int(os.environ.get("OBSERVATION_STORE_MAX_AGE", 300))
+# Buffered rows are bulk-inserted this often, or as soon as this many are waiting
+OBSERVATION_FLUSH_INTERVAL = float(os.environ.get("OBSERVATION_FLUSH_INTERVAL", 2))
+OBSERVATION_FLUSH_SIZE = int(os.environ.get("OBSERVATION_FLUSH_SIZE", 500))
+# Observations older than this many seconds are compacted into column blocks, 0 disables
+OBSERVATION_COMPACT_AFTER = int(os.environ.get("OBSERVATION_COMPACT_AFTER", 6 * 3600))
+OBSERVATION_COMPACT_INTERVAL = int(os.environ.get("OBSERVATION_COMPACT_INTERVAL", 3600))
+# Longest history a query may ask for
+OBSERVATION_HISTORY_MAX_HOURS = int(os.environ.get("OBSERVATION_HISTORY_MAX_HOURS", 7 * 24))
+
+# Observation columns and where they live in the parsed weather data
+NUMERIC_FIELDS = (
+    "temp", "feels_like", "temp_min", "temp_max", "humidity", "pressure",
+    "wind_speed", "wind_direction", "clouds", "visibility"
+)
+CONDITION_FIELDS = ("main", "description", "icon")
+
+metadata = MetaData()
+
+observations = Table(
+    "observations", metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("cell", String(32), nullable=False),
+    Column("observed_at", Integer, nullable=False),
+    Column("fetched_at", Float, nullable=False),
+    Column("lat", Float),
+    Column("lon", Float),
+    Column("name", String(128)),
+    Column("country", String(8)),
+    *[Column(field, Float) for field in NUMERIC_FIELDS],
+    *[Column(field, String(128)) for field in CONDITION_FIELDS],
+    Index("ix_observations_cell_time", "cell", "observed_at", unique=True)
+)
+
+observation_blocks = Table(
+    "observation_blocks", metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("cell", String(32), nullable=False),
+    Column("start", Integer, nullable=False),
+    Column("end", Integer, nullable=False),
+    Column("count", Integer, nullable=False),
+    Column("data", LargeBinary, nullable=False),
+    Index("ix_observation_blocks_cell_end", "cell", "end")
+)
+
+forecasts = Table(
+    "forecasts", metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("cell", String(32), nullable=False),
+    Column("fetched_at", Float, nullable=False),
+    Column("payload", LargeBinary, nullable=False),
+    Index("ix_forecasts_cell_time", "cell", "fetched_at")
+)
+
+# Columns stored per observation, in block order
+_BLOCK_COLUMNS = ("observed_at", "fetched_at", "lat", "lon", "name", "country") + NUMERIC_FIELDS + CONDITION_FIELDS
+
+def _cell(lat, lon):
+    return quantize_location(lat, lon).cell
+
+def _observation_row(weather_data, cell, fetched_at):
+    location = weather_data["location"]
+    current = weather_data["current"]
+    row = {
+        "cell": cell,
+        "observed_at": int(current.get("datetime") or fetched_at),
+        "fetched_at": fetched_at,
+        "lat": location.get("lat"),
+        "lon": location.get("lon"),
+        "name": location.get("name"),
+        "country": location.get("country")
+    }
+    for field in NUMERIC_FIELDS:
+        row[field] = current.get(field)
+    for field in CONDITION_FIELDS:
+        row[field] = current.get("weather", {}).get(field)
+    return row
+
+def _weather_from_row(row):
+    # Inverse of _observation_row, in the shape returned by get_weather_data
+    current = {field: row[field] for field in NUMERIC_FIELDS}
+    current["weather"] = {field: row[field] for field in CONDITION_FIELDS}
+    current["datetime"] = row["observed_at"]
+    return {
+        "location": {"name": row["name"], "country": row["country"], "lat": row["lat"], "lon": row["lon"]},
+        "current": current
+    }
+
+def _history_item(row):
+    item = {"datetime": row["observed_at"]}
+    for field in NUMERIC_FIELDS:
+        item[field] = row[field]
+    item["weather"] = {field: row[field] for field in CONDITION_FIELDS}
+    return item
+
+def encode_block(rows):
+    """
+    Pack observations of one cell into a compressed column block.
+
+    Args:
+        rows: Observation rows sorted by observed_at
+
+    Returns:
+        bytes: zlib-compressed msgpack of one list per column
+    """
+    columns = {name: [row[name] for row in rows] for name in _BLOCK_COLUMNS}
+    times = columns["observed_at"]
+    columns["observed_at"] = [times[0]] + [b - a for a, b in zip(times, times[1:])]
+    return zlib.compress(msgpack.packb(columns, use_bin_type=True))
+
+def decode_block(data):
+    """
+    Unpack a column block into observation rows.
+
+    Args:
+        data: Output of encode_block
+
+    Returns:
+        list: Observation rows sorted by observed_at
+    """
+    columns = msgpack.unpackb(zlib.decompress(data), raw=False)
+    times = []
+    for delta in columns["observed_at"]:
+        times.append(delta if not times else times[-1] + delta)
+    columns["observed_at"] = times
+    return [dict(zip(_BLOCK_COLUMNS, values)) for values in zip(*(columns[name] for name in _BLOCK_COLUMNS))]
+
+def _normalize_url(url):
+    # Hosting platforms still hand out postgres:// URLs, which SQLAlchemy dropped
+    if url.startswith("postgres://"):
+        return "postgresql://" + url[len("postgres://"):]
+    return url
+
+def _create_engine(url):
+    url = _normalize_url(url)
+    if not url.startswith("sqlite"):
+        return create_engine(url, pool_pre_ping=True)
+
+    kwargs = {"connect_args": {"check_same_thread": False}}
+    if url in ("sqlite://", "sqlite:///:memory:"):
+        # One shared connection, or every thread would see its own empty database
+        kwargs["poolclass"] = StaticPool
+    engine = create_engine(url, **kwargs)
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(connection, record):
+        # WAL lets workers read while another one writes
+        cursor = connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+    return engine
+
+def _insert_ignoring_duplicates(engine, table):
+    if engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif engine.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return insert(table)
+    return dialect_insert(table).on_conflict_do_nothing()
+
+class ObservationStore:
+    """Buffered writer and reader of the observation tables."""
+
+    def __init__(self, url=None, flush_interval=None, flush_size=None):
+        """
+        Args:
+            url: SQLAlchemy database URL, defaults to OBSERVATION_STORE_URL
+            flush_interval: Seconds between bulk inserts
+            flush_size: Buffered rows that trigger a bulk insert early
+        """
+        self.url = OBSERVATION_STORE_URL if url is None else url
+        self.flush_interval = OBSERVATION_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.flush_size = OBSERVATION_FLUSH_SIZE if flush_size is None else flush_size
+        self._engine = None
+        self._pid = None
+        self._writer_pid = None
+        self._pending_observations = []
+        self._pending_forecasts = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._last_compacted = time.monotonic()
+
+    @property
+    def enabled(self):
+        return bool(self.url)
+
+    def engine(self):
+        """
+        Get the engine for the current worker process, creating the tables once.
+
+        Like the upstream HTTP session, the engine and writer thread are
+        created lazily and again after a fork, so workers never share
+        connections inherited from the master process.
+
+        Returns:
+            sqlalchemy.Engine: Engine bound to the store's database
+        """
+        pid = os.getpid()
+        if self._engine is None or self._pid != pid:
+            with self._lock:
+                if self._engine is None or self._pid != pid:
+                    engine = _create_engine(self.url)
+                    metadata.create_all(engine)
+                    self._engine = engine
+                    self._pid = pid
+        return self._engine
+
+    def _ensure_writer(self):
+        pid = os.getpid()
+        if self._writer_pid != pid:
+            with self._lock:
+                if self._writer_pid != pid:
+                    self._writer_pid = pid
+                    self._pending_observations = []
+                    self._pending_forecasts = []
+                    threading.Thread(target=self._run, name="observation-store", daemon=True).start()
+
+    def _run(self):
+        pid = os.getpid()
+        while self._writer_pid == pid:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+                if OBSERVATION_COMPACT_AFTER > 0 and time.monotonic() - self._last_compacted >= OBSERVATION_COMPACT_INTERVAL:
+                    self._last_compacted = time.monotonic()
+                    self.compact()
+            except SQLAlchemyError as e:
+                logger.error(f"Error writing to the observation store: {str(e)}")
+                metrics.incr("observation_store.write_failed")
+
+    def _buffer(self, observation_rows=(), forecast_rows=()):
+        # Writes never touch the database on the request path
+        self._ensure_writer()
+        with self._lock:
+            self._pending_observations.extend(observation_rows)
+            self._pending_forecasts.extend(forecast_rows)
+            full = len(self._pending_observations) + len(self._pending_forecasts) >= self.flush_size
+        if full:
+            self._wake.set()
+
+    def record_weather(self, weather_data, lat=None, lon=None):
+        """
+        Buffer a parsed observation for the next bulk insert.
+
+        Args:
+            weather_data: Weather data as returned by get_weather_data
+            lat: Latitude the observation was requested for, defaults to its own
+            lon: Longitude the observation was requested for, defaults to its own
+        """
+        self.record_weather_batch([weather_data], lat, lon)
+
+    def record_weather_batch(self, weather_list, lat=None, lon=None):
+        """
+        Buffer many parsed observations, e.g. the cities of a heatmap tile.
+
+        Args:
+            weather_list: Weather data of each observation
+            lat: Latitude all observations were requested for, defaults to their own
+            lon: Longitude all observations were requested for, defaults to their own
+        """
+        if not self.enabled:
+            return
+        fetched_at = time.time()
+        rows = []
+        for weather_data in weather_list:
+            location = weather_data["location"]
+            try:
+                cell = _cell(location["lat"] if lat is None else lat, location["lon"] if lon is None else lon)
+            except (TypeError, ValueError):
+                continue
+            rows.append(_observation_row(weather_data, cell, fetched_at))
+        if rows:
+            self._buffer(observation_rows=rows)
+
+    def record_forecast(self, lat, lon, forecast_data):
+        """
+        Buffer a parsed forecast for the next bulk insert.
+
+        Args:
+            lat: Latitude the forecast was requested for
+            lon: Longitude the forecast was requested for
+            forecast_data: Forecast data as returned by get_weather_forecast
+        """
+        if not self.enabled:
+            return
+        row = {
+            "cell": _cell(lat, lon),
+            "fetched_at": time.time(),
+            "payload": zlib.compress(json_codec.dumps_bytes(forecast_data))
+        }
+        self._buffer(forecast_rows=[row])
+
+    def flush(self):
+        """
+        Bulk-insert the buffered rows.
+
+        Returns:
+            int: Number of rows written
+        """
+        if not self.enabled:
+            return 0
+        engine = self.engine()
+        with self._lock:
+            pending_observations, self._pending_observations = self._pending_observations, []
+            pending_forecasts, self._pending_forecasts = self._pending_forecasts, []
+        if not pending_observations and not pending_forecasts:
+            return 0
+
+        with engine.begin() as connection:
+            if pending_observations:
+                connection.execute(_insert_ignoring_duplicates(engine, observations), pending_observations)
+            if pending_forecasts:
+                connection.execute(insert(forecasts), pending_forecasts)
+        written = len(pending_observations) + len(pending_forecasts)
+        metrics.incr("observation_store.written", written)
+        return written
+
+    def recent_weather(self, lat, lon, max_age=None):
+        """
+        Get the latest stored observation for a location if it is recent.
+
+        Args:
+            lat: Latitude of the location
+            lon: Longitude of the location
+            max_age: Seconds since the observation was fetched, defaults to
+                OBSERVATION_STORE_MAX_AGE
+
+        Returns:
+            dict: Weather data, or None if nothing recent is stored
+        """
+        max_age = OBSERVATION_STORE_MAX_AGE if max_age is None else max_age
+        if not self.enabled or max_age <= 0:
+            return None
+        query = (
+            select(observations)
+            .where(observations.c.cell == _cell(lat, lon))
+            .order_by(observations.c.observed_at.desc())
+            .limit(1)
+        )
+        with self.engine().connect() as connection:
+            row = connection.execute(query).mappings().first()
+        if row is None or row["fetched_at"] < time.time() - max_age:
+            metrics.incr("observation_store.miss")
+            return None
+        metrics.incr("observation_store.hit")
+        return _weather_from_row(row)
+
+    def recent_forecast(self, lat, lon, max_age=None):
+        """
+        Get the latest stored forecast for a location if it is recent.
+
+        Args:
+            lat: Latitude of the location
+            lon: Longitude of the location
+            max_age: Seconds since the forecast was fetched, defaults to
+                OBSERVATION_STORE_MAX_AGE
+
+        Returns:
+            dict: Forecast data, or None if nothing recent is stored
+        """
+        max_age = OBSERVATION_STORE_MAX_AGE if max_age is None else max_age
+        if not self.enabled or max_age <= 0:
+            return None
+        query = (
+            select(forecasts.c.payload)
+            .where(forecasts.c.cell == _cell(lat, lon), forecasts.c.fetched_at >= time.time() - max_age)
+            .order_by(forecasts.c.fetched_at.desc())
+            .limit(1)
+        )
+        with self.engine().connect() as connection:
+            payload = connection.execute(query).scalar()
+        if payload is None:
+            metrics.incr("observation_store.forecast_miss")
+            return None
+        metrics.incr("observation_store.forecast_hit")
+        return json_codec.loads(zlib.decompress(payload))
+
+    def history(self, lat, lon, hours):
+        """
+        Get the observations of the last hours at a location.
+
+        Args:
+            lat: Latitude of the location
+            lon: Longitude of the location
+            hours: How far back to go, capped at OBSERVATION_HISTORY_MAX_HOURS
+
+        Returns:
+            list: Observations sorted by time, oldest first
+
+        Raises:
+            ValueError: If hours isn't a positive number
+        """
+        if not hours > 0:
+            raise ValueError("hours must be positive")
+        if not self.enabled:
+            return []
+        cell = _cell(lat, lon)
+        since = int(time.time() - min(hours, OBSERVATION_HISTORY_MAX_HOURS) * 3600)
+        row_query = (
+            select(observations)
+            .where(observations.c.cell == cell, observations.c.observed_at >= since)
+            .order_by(observations.c.observed_at)
+        )
+        block_query = (
+            select(observation_blocks.c.data)
+            .where(observation_blocks.c.cell == cell, observation_blocks.c.end >= since)
+            .order_by(observation_blocks.c.start)
+        )
+        with self.engine().connect() as connection:
+            rows = [dict(row) for row in connection.execute(row_query).mappings()]
+            blocks = connection.execute(block_query).scalars().all()
+
+        # One sample per observation time, even if blocks overlap or a row was
+        # re-inserted after it had been compacted
+        samples = {}
+        for data in blocks:
+            for row in decode_block(data):
+                if row["observed_at"] >= since:
+                    samples[row["observed_at"]] = row
+        samples.update((row["observed_at"], row) for row in rows)
+        metrics.incr("observation_store.history")
+        return [_history_item(samples[observed_at]) for observed_at in sorted(samples)]
+
+    def compact(self, older_than=None):
+        """
+        Move old observations into one compressed column block per cell.
+
+        Args:
+            older_than: Age in seconds past which observations are compacted,
+                defaults to OBSERVATION_COMPACT_AFTER
+
+        Returns:
+            int: Number of observations compacted
+        """
+        if not self.enabled:
+            return 0
+        older_than = OBSERVATION_COMPACT_AFTER if older_than is None else older_than
+        cutoff = int(time.time() - older_than)
+        engine = self.engine()
+        with engine.begin() as connection:
+            claimed = self._claim_old_rows(engine, connection, cutoff)
+            cells = {}
+            for row in sorted(claimed, key=lambda row: (row["cell"], row["observed_at"])):
+                cells.setdefault(row["cell"], []).append(row)
+            if not cells:
+                return 0
+            connection.execute(insert(observation_blocks), [
+                {
+                    "cell": cell,
+                    "start": rows[0]["observed_at"],
+                    "end": rows[-1]["observed_at"],
+                    "count": len(rows),
+                    "data": encode_block(rows)
+                }
+                for cell, rows in cells.items()
+            ])
+        metrics.incr("observation_store.compacted", len(claimed))
+        return len(claimed)
+
+    def _claim_old_rows(self, engine, connection, cutoff):
+        # Every worker compacts, so rows are claimed by deleting them: a row
+        # locked or already deleted by another worker's DELETE is never
+        # returned twice, and the blocks are written in the same transaction
+        old = observations.c.observed_at < cutoff
+        if engine.dialect.delete_returning:
+            result = connection.execute(delete(observations).where(old).returning(*observations.c))
+            return [dict(row) for row in result.mappings()]
+
+        rows = [dict(row) for row in connection.execute(select(observations).where(old).with_for_update()).mappings()]
+        ids = [row["id"] for row in rows]
+        for start in range(0, len(ids), 500):
+            connection.execute(delete(observations).where(observations.c.id.in_(ids[start:start + 500])))
+        return rows
+
+    def clear(self):
+        """Drop buffered rows and delete everything stored."""
+        if not self.enabled:
+            return
+        engine = self.engine()
+        with self._lock:
+            self._pending_observations = []
+            self._pending_forecasts = []
+        with engine.begin() as connection:
+            for table in (observations, observation_blocks, forecasts):
+                connection.execute(delete(table))
+
+store = ObservationStore()
+
+@atexit.register
+def _flush_on_exit():
+    if store.enabled and store._engine is not None:
+        try:
+            store.flush()
+        except SQLAlchemyError as e:
+            logger.error(f"Error flushing the observation store: {str(e)}")
+
+def enabled():
+    """
+    Check whether fetched data is persisted.
+
+    Returns:
+        bool: True if a database URL is configured
+    """
+    return store.enabled
+
+def record_weather(weather_data, lat=None, lon=None):
+    """
+    Persist a parsed observation if the store is enabled.
+
+    Args:
+        weather_data: Weather data as returned by get_weather_data
+        lat: Latitude the observation was requested for, defaults to its own
+        lon: Longitude the observation was requested for, defaults to its own
+    """
+    if enabled():
+        store.record_weather(weather_data, lat, lon)
+
+def record_weather_batch(weather_list):
+    """
+    Persist the parsed observations of a heatmap tile if the store is enabled.
+
+    Args:
+        weather_list: Weather data of each city
+    """
+    if enabled():
+        store.record_weather_batch(weather_list)
+
+def record_forecast(lat, lon, forecast_data):
+    """
+    Persist a parsed forecast if the store is enabled.
+
+    Args:
+        lat: Latitude the forecast was requested for
+        lon: Longitude the forecast was requested for
+        forecast_data: Forecast data as returned by get_weather_forecast
+    """
+    if enabled():
+        store.record_forecast(lat, lon, forecast_data)
+
+def recent_weather(lat, lon):
+    """
+    Answer a weather lookup from a recently stored observation.
+
+    Args:
+        lat: Latitude of the location
+        lon: Longitude of the location
+
+    Returns:
+        dict: Weather data, or None if the store is off, unreachable or has
+        nothing recent
+    """
+    if not enabled():
+        return None
+    try:
+        return store.recent_weather(lat, lon)
+    except SQLAlchemyError as e:
+        logger.error(f"Error reading the observation store: {str(e)}")
+        return None
+
+def recent_forecast(lat, lon):
+    """
+    Answer a forecast lookup from a recently stored forecast.
+
+    Args:
+        lat: Latitude of the location
+        lon: Longitude of the location
+
+    Returns:
+        dict: Forecast data, or None if the store is off, unreachable or has
+        nothing recent
+    """
+    if not enabled():
+        return None
+    try:
+        return store.recent_forecast(lat, lon)
+    except SQLAlchemyError as e:
+        logger.error(f"Error reading the observation store: {str(e)}")
+        return None
+
+def history(lat, lon, hours):
+    """
+    Get the stored observations of the last hours at a location.
+
+    Args:
+        lat: Latitude of the location
+        lon: Longitude of the location
+        hours: How far back to go
+
+    Returns:
+        list: Observations sorted by time, oldest first
+    """
+    return store.history(lat, lon, hours)
+
+async def async_recent_weather(lat, lon):
+    """
+    Async counterpart of recent_weather, run off the event loop.
+
+    Returns:
+        dict: Weather data, or None if nothing recent is stored
+    """
+    if not enabled():
+        return None
+    return await asyncio.to_thread(recent_weather, lat, lon)
+
+async def async_recent_forecast(lat, lon):
+    """
+    Async counterpart of recent_forecast, run off the event loop.
+
+    Returns:
+        dict: Forecast data, or None if nothing recent is stored
+    """
+    if not enabled():
+        return None
+    return await asyncio.to_thread(recent_forecast, lat, lon)
+
+async def async_history(lat, lon, hours):
+    """
+    Async counterpart of history, run off the event loop.
+
+    Returns:
+        list: Observations sorted by time, oldest first
+    """
+    return await asyncio.to_thread(history, lat, lon, hours)
@@ -0,0 +1,409 @@
+"""
+Token bucket rate limiting for outbound upstream calls.
+
+Besides the plain RateLimiter, this module holds the governor every
+OpenWeatherMap call goes through. It enforces the per-minute and per-day
+quotas and schedules calls by priority: interactive requests may use the
+whole budget and wait briefly for a token, background refreshes and heatmap
+prefetches only run while a reserve is left and never wait. When the budget
+runs low, stale cache entries keep being served instead of being refreshed.
+
+The quota is for the whole deployment. With a shared cache tier configured
+(CACHE_BACKEND=filesystem or redis) all workers count their calls in it, in
+fixed one-minute and one-day windows. Otherwise every worker keeps its own
+bucket with an even share of the quota, so WEB_CONCURRENCY must be set to
+the number of worker processes.
+"""
+
+import os
+import math
+import time
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from services import metrics
+from services.cache_backends import CACHE_BACKEND, create_cache
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Upstream quota for all workers together, 0 disables a limit
+UPSTREAM_CALLS_PER_MINUTE = float(os.environ.get("UPSTREAM_CALLS_PER_MINUTE", 60))
+UPSTREAM_CALLS_PER_DAY = int(os.environ.get("UPSTREAM_CALLS_PER_DAY", 0))
+# Share of each budget that background refreshes and heatmap prefetches leave untouched
+QUOTA_REFRESH_RESERVE = float(os.environ.get("QUOTA_REFRESH_RESERVE", 0.2))
+QUOTA_PREFETCH_RESERVE = float(os.environ.get("QUOTA_PREFETCH_RESERVE", 0.4))
+# Seconds an interactive call may wait for a token before giving up
+QUOTA_MAX_WAIT = float(os.environ.get("QUOTA_MAX_WAIT", 2))
+# Pause after a 429 without a Retry-After header
+QUOTA_DEFAULT_PAUSE = float(os.environ.get("QUOTA_DEFAULT_PAUSE", 60))
+# Worker processes splitting the quota when there is no shared cache tier to count in
+WEB_CONCURRENCY = max(1, int(os.environ.get("WEB_CONCURRENCY", 1)))
+
+# Shared counter keys, suffixed with the window they count
+_MINUTE_KEY = "quota:minute:"
+_DAY_KEY = "quota:day:"
+_PAUSE_KEY = "quota:paused_until"
+
+# Call priorities, highest first
+INTERACTIVE = "interactive"
+REFRESH = "refresh"
+PREFETCH = "prefetch"
+
+_current_priority = ContextVar("upstream_priority", default=INTERACTIVE)
+
+class RateLimiter:
+    """Thread-safe token bucket that spaces calls to a steady rate."""
+
+    def __init__(self, rate, burst=None):
+        """
+        Args:
+            rate: Sustained number of calls allowed per second
+            burst: Number of calls that may go through back to back
+        """
+        self.rate = float(rate)
+        self.burst = float(max(1, burst if burst is not None else rate))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self):
+        """
+        Take a token, borrowing against future refills if the bucket is empty.
+
+        Returns:
+            float: Seconds the caller must wait before making its call
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def try_acquire(self, keep=0.0, take=True):
+        """
+        Take a token without borrowing, leaving at least `keep` tokens behind.
+
+        Args:
+            keep: Number of tokens that must remain in the bucket
+            take: Only check whether a token could be taken if False
+
+        Returns:
+            float: 0 if a token was (or could be) taken, else seconds until one can
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens - 1 >= keep:
+                if take:
+                    self._tokens -= 1
+                return 0.0
+            return (keep + 1 - self._tokens) / self.rate
+
+    def available(self):
+        """
+        Get the number of tokens in the bucket.
+
+        Returns:
+            float: Tokens available right now
+        """
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+    def acquire(self):
+        """Block until a call is allowed."""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def async_acquire(self):
+        """Wait on the event loop until a call is allowed."""
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+class QuotaExhaustedError(Exception):
+    """Raised when an upstream call doesn't fit in the remaining quota."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+@contextmanager
+def priority(level):
+    """
+    Run upstream calls made in this context at the given priority.
+
+    Args:
+        level: INTERACTIVE, REFRESH or PREFETCH
+    """
+    token = _current_priority.set(level)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+def current_priority():
+    """
+    Get the priority of upstream calls made in the current context.
+
+    Returns:
+        str: INTERACTIVE unless set otherwise with priority()
+    """
+    return _current_priority.get()
+
+def _utc_day():
+    return int(time.time() // 86400)
+
+class QuotaGovernor:
+    """Per-minute token bucket and per-day counter shared by all upstream calls."""
+
+    def __init__(self, per_minute=None, per_day=None, reserves=None, max_wait=None, shared=None, workers=None):
+        """
+        Args:
+            per_minute: Calls allowed per minute, 0 for no limit
+            per_day: Calls allowed per UTC day, 0 for no limit
+            reserves: Share of each budget kept back from each priority
+            max_wait: Seconds interactive calls may wait for a token
+            shared: Cache all workers count their calls in, None to count per process
+            workers: Processes splitting the budgets when nothing is shared,
+                defaults to WEB_CONCURRENCY
+        """
+        self.per_minute = UPSTREAM_CALLS_PER_MINUTE if per_minute is None else per_minute
+        self.per_day = UPSTREAM_CALLS_PER_DAY if per_day is None else per_day
+        self.reserves = reserves or {
+            INTERACTIVE: 0.0,
+            REFRESH: QUOTA_REFRESH_RESERVE,
+            PREFETCH: QUOTA_PREFETCH_RESERVE
+        }
+        self.max_wait = QUOTA_MAX_WAIT if max_wait is None else max_wait
+        self.shared = shared
+        self.workers = WEB_CONCURRENCY if workers is None else max(1, workers)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Refill this process's budgets and lift any pause."""
+        # The per-process budgets are also the fallback while the shared cache is unreachable
+        per_minute = self._share(self.per_minute)
+        with self._lock:
+            self._minute = RateLimiter(per_minute / 60, burst=per_minute) if per_minute > 0 else None
+            self._day = _utc_day()
+            self._day_used = 0
+            self._paused_until = 0.0
+
+    def _share(self, limit):
+        return limit / self.workers if self.workers > 1 else limit
+
+    def _day_remaining(self):
+        today = _utc_day()
+        if today != self._day:
+            self._day = today
+            self._day_used = 0
+        return self._share(self.per_day) - self._day_used
+
+    def _try(self, level, take=True):
+        # 0 when the call may go ahead, else seconds until it might, None if not today
+        reserve = self.reserves.get(level, 0.0)
+        if self.shared is not None:
+            try:
+                return self._try_shared(reserve, take)
+            except Exception as e:
+                logger.warning(f"Shared quota unavailable, counting per process: {str(e)}")
+                metrics.incr("quota.shared.error")
+        with self._lock:
+            paused = self._paused_until - time.monotonic()
+            if paused > 0:
+                return paused
+            if self.per_day > 0 and self._day_remaining() - 1 < reserve * self._share(self.per_day):
+                return None
+            if self._minute is not None:
+                wait = self._minute.try_acquire(reserve * self._minute.burst, take)
+                if wait > 0:
+                    return wait
+            if take:
+                self._day_used += 1
+            return 0.0
+
+    def _try_shared(self, reserve, take):
+        now = time.time()
+        paused = max(self._paused_until - time.monotonic(), (self.shared.get(_PAUSE_KEY) or 0) - now)
+        if paused > 0:
+            return paused
+
+        # Count the call in each window, handing it back if a window is full
+        windows = []
+        if self.per_day > 0:
+            windows.append((f"{_DAY_KEY}{_utc_day()}", self.per_day, 2 * 86400, None))
+        if self.per_minute > 0:
+            window_end = (now // 60 + 1) * 60
+            windows.append((f"{_MINUTE_KEY}{int(now // 60)}", self.per_minute, 120, window_end - now))
+        counted = []
+        for key, limit, timeout, wait in windows:
+            if take:
+                self.shared.add(key, 0, timeout=timeout)
+                used = self.shared.inc(key)
+                counted.append(key)
+            else:
+                used = (self.shared.get(key) or 0) + 1
+            if used > limit - reserve * limit:
+                for key in counted:
+                    self.shared.dec(key)
+                return wait
+        return 0.0
+
+    def _admit(self, level, wait, deadline):
+        # Returns how long to sleep before trying again, raising if that's too long
+        if wait == 0:
+            metrics.incr(f"quota.{level}.granted")
+            return 0.0
+        if wait is None or time.monotonic() + wait > deadline:
+            metrics.incr(f"quota.{level}.denied")
+            raise QuotaExhaustedError(f"Upstream quota exhausted for {level} calls", retry_after=wait)
+        return wait
+
+    def _deadline(self, level):
+        return time.monotonic() + (self.max_wait if level == INTERACTIVE else 0)
+
+    def acquire(self, level=None):
+        """
+        Take one call from the quota, waiting briefly if the call is interactive.
+
+        Args:
+            level: Priority of the call, defaults to current_priority()
+
+        Raises:
+            QuotaExhaustedError: If the call doesn't fit in the budget left for its priority
+        """
+        level = level or current_priority()
+        deadline = self._deadline(level)
+        while True:
+            delay = self._admit(level, self._try(level), deadline)
+            if not delay:
+                return
+            time.sleep(delay)
+
+    async def async_acquire(self, level=None):
+        """
+        Async counterpart of acquire for the ASGI serving mode.
+
+        Args:
+            level: Priority of the call, defaults to current_priority()
+
+        Raises:
+            QuotaExhaustedError: If the call doesn't fit in the budget left for its priority
+        """
+        level = level or current_priority()
+        deadline = self._deadline(level)
+        while True:
+            delay = self._admit(level, await self._async_try(level), deadline)
+            if not delay:
+                return
+            await asyncio.sleep(delay)
+
+    async def _async_try(self, level, take=True):
+        # Shared counters live in a file or Redis cache, so they're read off the event loop
+        if self.shared is None:
+            return self._try(level, take)
+        return await asyncio.to_thread(self._try, level, take)
+
+    def available(self, level=None):
+        """
+        Check whether a call of the given priority would go ahead right now.
+
+        Args:
+            level: Priority of the call, defaults to current_priority()
+
+        Returns:
+            bool: True if the call fits in the budget left for its priority
+        """
+        return self._try(level or current_priority(), take=False) == 0
+
+    async def async_available(self, level=None):
+        """
+        Async counterpart of available for the ASGI serving mode.
+
+        Args:
+            level: Priority of the call, defaults to current_priority()
+
+        Returns:
+            bool: True if the call fits in the budget left for its priority
+        """
+        return await self._async_try(level or current_priority(), take=False) == 0
+
+    def pause(self, seconds=None):
+        """
+        Hold back all calls, e.g. after upstream answered 429.
+
+        Args:
+            seconds: How long to pause, defaults to QUOTA_DEFAULT_PAUSE
+        """
+        seconds = QUOTA_DEFAULT_PAUSE if seconds is None else seconds
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        if self.shared is not None:
+            try:
+                self.shared.set(_PAUSE_KEY, time.time() + seconds, timeout=max(1, math.ceil(seconds)))
+            except Exception as e:
+                logger.warning(f"Could not share quota pause: {str(e)}")
+        metrics.incr("quota.paused")
+
+    def _shared_status(self):
+        now = time.time()
+        minute_used = self.shared.get(f"{_MINUTE_KEY}{int(now // 60)}") or 0
+        day_used = self.shared.get(f"{_DAY_KEY}{_utc_day()}") or 0
+        paused = max(self._paused_until - time.monotonic(), (self.shared.get(_PAUSE_KEY) or 0) - now)
+        return self.per_minute - minute_used, self.per_day - day_used, paused
+
+    def status(self):
+        """
+        Get the remaining quota.
+
+        Returns:
+            dict: Limit and remaining calls per minute and per day (None when
+            unlimited) and the seconds left of any pause, for all workers when
+            the quota is shared and for this process otherwise
+        """
+        shared = None
+        if self.shared is not None:
+            try:
+                shared = self._shared_status()
+            except Exception as e:
+                logger.warning(f"Shared quota unavailable: {str(e)}")
+        if shared is not None:
+            minute_limit, day_limit = self.per_minute, self.per_day
+            minute_remaining, day_remaining, paused = shared
+        else:
+            minute_limit, day_limit = self._share(self.per_minute), self._share(self.per_day)
+            with self._lock:
+                day_remaining = self._day_remaining()
+                paused = self._paused_until - time.monotonic()
+            minute_remaining = self._minute.available() if self._minute is not None else None
+        return {
+            "minute": None if self.per_minute <= 0 else {
+                "limit": minute_limit,
+                "remaining": max(0, int(minute_remaining))
+            },
+            "day": None if self.per_day <= 0 else {
+                "limit": day_limit,
+                "remaining": max(0, int(day_remaining))
+            },
+            "paused_seconds": round(max(0.0, paused), 1)
+        }
+
+def _shared_cache():
+    # Count calls where all workers see them when the cache tier is shared
+    if CACHE_BACKEND == "simple":
+        return None
+    return create_cache()
+
+upstream_governor = QuotaGovernor(shared=_shared_cache())
@@ -0,0 +1,191 @@
+"""
+Compact, pre-compressed response bodies.
+
+The forecast and heatmap endpoints negotiate a response format and a
+content coding:
+
+- Formats: "json" (the usual document), "columnar" (JSON where lists of
+  records become one list per field) and "msgpack" (the usual document as
+  MessagePack), chosen with ``?format=`` or the Accept header.
+- Codings: "br", "gzip" or none, chosen from Accept-Encoding.
+
+Encoded bodies are cached per format and coding, tagged with the version of
+the data they were built from. A request for unchanged data is answered with
+the stored bytes without serializing or compressing anything.
+"""
+
+import os
+import gzip
+import logging
+from collections import namedtuple
+import brotli
+import msgpack
+from services import json_codec, metrics
+from services.data_cache import ttl_for
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Compression configuration; bodies are compressed once per data version
+RESPONSE_COMPRESS_MIN_BYTES = int(os.environ.get("RESPONSE_COMPRESS_MIN_BYTES", 1024))
+RESPONSE_GZIP_LEVEL = int(os.environ.get("RESPONSE_GZIP_LEVEL", 6))
+RESPONSE_BROTLI_QUALITY = int(os.environ.get("RESPONSE_BROTLI_QUALITY", 6))
+
+FORMATS = {
+    'json': 'application/json',
+    'columnar': 'application/vnd.weatherwizard.columnar+json',
+    'msgpack': 'application/msgpack'
+}
+
+# Accept media types that select a compact format
+_ACCEPT_FORMATS = {
+    'application/vnd.weatherwizard.columnar+json': 'columnar',
+    'application/msgpack': 'msgpack',
+    'application/x-msgpack': 'msgpack'
+}
+
+EncodedBody = namedtuple("EncodedBody", ["body", "mimetype", "headers"])
+
+class UnsupportedFormatError(ValueError):
+    """Raised when a request asks for a format the endpoint can't produce."""
+
+def _accepted(header):
+    # Lower-cased tokens of an Accept or Accept-Encoding header, except q=0 ones
+    tokens = []
+    for part in (header or "").split(","):
+        token, _, params = part.partition(";")
+        token = token.strip().lower()
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if token and quality > 0:
+            tokens.append(token)
+    return tokens
+
+def negotiate(requested_format=None, accept=None, accept_encoding=None):
+    """
+    Pick the response format and content coding for a request.
+
+    Args:
+        requested_format: Value of the format query parameter, if any
+        accept: Accept header
+        accept_encoding: Accept-Encoding header
+
+    Returns:
+        tuple: (format, coding) where coding is "br", "gzip" or None
+
+    Raises:
+        UnsupportedFormatError: If the requested format is unknown
+    """
+    if requested_format:
+        if requested_format not in FORMATS:
+            raise UnsupportedFormatError(f"Unsupported format: {requested_format}")
+        response_format = requested_format
+    else:
+        accepted_types = _accepted(accept)
+        response_format = next(
+            (_ACCEPT_FORMATS[media_type] for media_type in accepted_types if media_type in _ACCEPT_FORMATS),
+            'json'
+        )
+
+    codings = _accepted(accept_encoding)
+    if 'br' in codings:
+        coding = 'br'
+    elif 'gzip' in codings or '*' in codings:
+        coding = 'gzip'
+    else:
+        coding = None
+    return response_format, coding
+
+def columns(records):
+    """
+    Turn a list of records into one list per field.
+
+    Nested records become nested columns.
+
+    Args:
+        records: Dicts sharing the fields of the first one
+
+    Returns:
+        dict: Field names mapped to lists of values
+    """
+    if not records:
+        return {}
+    result = {}
+    for field, value in records[0].items():
+        values = [record.get(field) for record in records]
+        result[field] = columns([value or {} for value in values]) if isinstance(value, dict) else values
+    return result
+
+def columnar_forecast(forecast_data):
+    """
+    Get the columnar document of a forecast.
+
+    Args:
+        forecast_data: Forecast as returned by get_weather_forecast
+
+    Returns:
+        dict: The forecast with its entries as columns
+    """
+    return {**forecast_data, "forecast": columns(forecast_data["forecast"])}
+
+def _serialize(document, response_format):
+    if response_format == 'msgpack':
+        return msgpack.packb(document, use_bin_type=True)
+    return json_codec.dumps_bytes(document)
+
+def _compress(body, coding):
+    if coding == 'br':
+        return brotli.compress(body, quality=RESPONSE_BROTLI_QUALITY)
+    if coding == 'gzip':
+        return gzip.compress(body, RESPONSE_GZIP_LEVEL, mtime=0)
+    return body
+
+def encoded_body(cache, namespace, key, version, build, response_format='json', coding=None, mimetype=None):
+    """
+    Get a response body in the negotiated format and coding.
+
+    The body is stored in the cache next to the data it was built from and
+    reused as long as the data's version doesn't change.
+
+    Args:
+        cache: Flask-Caching or cachelib cache instance
+        namespace: Endpoint namespace, selects the TTL and hit/miss counters
+        key: Cache key of the data
+        version: String that changes whenever the data does
+        build: Callable taking "json" or "columnar" and returning that document,
+            or bytes that are sent as they are
+        response_format: Format from negotiate, or the name of a binary format
+        coding: Content coding from negotiate
+        mimetype: Media type of a binary format, defaults to the format's
+
+    Returns:
+        EncodedBody: (body, mimetype, headers) ready to send
+    """
+    cache_key = f"encoded:{key}:{response_format}:{coding or 'identity'}"
+    stamp = version.encode("utf-8") + b"\n"
+
+    stored = cache.get(cache_key)
+    if stored is not None and stored.startswith(stamp):
+        metrics.incr(f"encoded.{namespace}.hit")
+        _, used, body = stored.split(b"\n", 2)
+        used = used.decode("ascii") or None
+    else:
+        metrics.incr(f"encoded.{namespace}.miss")
+        document = build('columnar' if response_format == 'columnar' else 'json')
+        body = document if isinstance(document, bytes) else _serialize(document, response_format)
+        # Small bodies aren't worth the decompression on the client
+        used = coding if len(body) >= RESPONSE_COMPRESS_MIN_BYTES else None
+        body = _compress(body, used)
+        cache.set(cache_key, stamp + (used or "").encode("ascii") + b"\n" + body, timeout=ttl_for(namespace).hard)
+
+    headers = {'Vary': 'Accept, Accept-Encoding'}
+    if used:
+        headers['Content-Encoding'] = used
+    return EncodedBody(body, mimetype or FORMATS[response_format], headers)
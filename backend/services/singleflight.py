@@ -0,0 +1,72 @@
+"""
+Single-flight request coalescing.
+
+When many threads miss the cache for the same key at once, only the first
+one (the leader) runs the upstream fetch; the others wait for it and share
+its result or its exception.
+"""
+
+import threading
+from services import metrics
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Deduplicates concurrent calls that share a key within one process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """
+        Run fn once for all concurrent callers using the same key.
+
+        Args:
+            key: Deduplication key (e.g. a normalized location cache key)
+            fn: Zero-argument callable to run
+
+        Returns:
+            The result of fn, shared by every concurrent caller
+
+        Raises:
+            Exception: Whatever fn raised, re-raised in every waiting caller
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            metrics.incr("singleflight.shared")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self):
+        """
+        Get the number of keys currently being fetched.
+
+        Returns:
+            int: Number of in-flight keys
+        """
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,27 @@
+"""
+Server-Sent Events framing.
+
+Events are named and carry a single line of JSON, so clients can dispatch
+on the event name and parse the data without any further framing.
+"""
+
+from services import json_codec
+
+# Response headers for event streams; proxies such as nginx must not buffer them
+STREAM_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no'
+}
+
+def event(name, data):
+    """
+    Encode one event.
+
+    Args:
+        name: Event name
+        data: JSON-serializable payload
+
+    Returns:
+        bytes: The event, terminated by a blank line
+    """
+    return f"event: {name}\ndata: {json_codec.dumps(data)}\n\n".encode()
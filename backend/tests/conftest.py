@@ -1,7 +1,12 @@
 import os
 import pytest
 import json
-from app import app as flask_app
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from app import app as flask_app, cache
+from services import circuit_breaker, metrics
+from services.description_cache import description_cache
+from services.observation_index import observation_index
 
 @pytest.fixture(scope="session", autouse=True)
 def setup_test_environment():
@@ -21,6 +26,11 @@ def app():
     """Create and configure the Flask app for testing."""
     # Disable caching for tests
     flask_app.config['CACHE_TYPE'] = 'null'
+    cache.clear()
+    description_cache.clear()
+    observation_index.clear()
+    metrics.reset()
+    circuit_breaker.reset()
     return flask_app
 
 @pytest.fixture
@@ -107,4 +117,64 @@ def sample_forecast_data():
                 'precipitation_prob': 0.2
             }
         ]
-    }
\ No newline at end of file
+    }
+
+class StubUpstreamServer(ThreadingHTTPServer):
+    """Local HTTP/1.1 server standing in for the upstream weather API."""
+
+    daemon_threads = True
+
+    def __init__(self, address):
+        super().__init__(address, StubUpstreamHandler)
+        self.connection_count = 0
+        self.request_count = 0
+        # Queue of status codes to answer with before falling back to 200
+        self.status_codes = []
+        self.payload = {"ok": True}
+        self.delay = 0
+        self.lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        # Clients that time out on purpose drop the connection mid-response
+        pass
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+class StubUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connection_count += 1
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.request_count += 1
+            status = self.server.status_codes.pop(0) if self.server.status_codes else 200
+        if self.server.delay:
+            threading.Event().wait(self.server.delay)
+        body = json.dumps(self.server.payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def stub_upstream():
+    """A local stub upstream server running in a background thread."""
+    circuit_breaker.reset()
+    server = StubUpstreamServer(("127.0.0.1", 0))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
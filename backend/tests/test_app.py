@@ -1,7 +1,9 @@
 import os
 import json
 import pytest
-from app import app as flask_app
+from app import app as flask_app, cache
+from services import metrics
+from services.description_cache import description_cache
 
 @pytest.fixture
 def app():
@@ -12,6 +14,9 @@ def app():
     
     # Disable caching for tests
     flask_app.config['CACHE_TYPE'] = 'null'
+    cache.clear()
+    description_cache.clear()
+    metrics.reset()
     
     # Return app for testing
     return flask_app
@@ -36,6 +41,22 @@ def test_weather_endpoint_missing_params(client):
     assert 'error' in data
     assert 'Latitude and longitude are required' in data['error']
 
+def test_bad_coordinates_and_upstream_errors(client, monkeypatch):
+    """Bad coordinates are a 400, an undecodable upstream response is a 500."""
+    def mock_get_weather_data(lat, lon):
+        raise ValueError("Expecting value: line 1 column 1 (char 0)")
+
+    monkeypatch.setattr("services.weather_service.get_weather_data", mock_get_weather_data)
+    monkeypatch.setattr("services.weather_service.get_weather_forecast", mock_get_weather_data)
+
+    response = client.get('/api/weather?lat=north&lon=-74.006')
+    assert response.status_code == 400
+    assert 'Invalid coordinates' in json.loads(response.data)['error']
+    for path in ('/api/weather', '/api/forecast', '/api/weather_description', '/api/dashboard'):
+        response = client.get(f'{path}?lat=40.7128&lon=-74.006')
+        assert response.status_code == 500, path
+        assert 'Invalid coordinates' not in response.get_data(as_text=True)
+
 def test_weather_endpoint_with_params(client, monkeypatch):
     """Test weather endpoint with mock data."""
     # This requires mocking the weather service calls
@@ -0,0 +1,119 @@
+import asyncio
+import pytest
+from starlette.testclient import TestClient
+from services import city_snapshot, http_client, metrics
+from services.data_cache import async_cached_fetch
+from services.description_cache import description_cache
+import asgi
+
+@pytest.fixture
+def asgi_client():
+    """A test client for the ASGI app with an empty cache."""
+    asgi.cache.clear()
+    description_cache.clear()
+    metrics.reset()
+    with TestClient(asgi.app) as client:
+        yield client
+
+def test_health_check(asgi_client):
+    """The health endpoint is served in async mode too."""
+    response = asgi_client.get('/api/health')
+    assert response.status_code == 200
+    assert response.json() == {"status": "ok"}
+
+def test_weather_missing_params(asgi_client):
+    """Missing coordinates are rejected like in the Flask app."""
+    response = asgi_client.get('/api/weather')
+    assert response.status_code == 400
+    assert 'Latitude and longitude are required' in response.json()['error']
+
+def test_bad_coordinates_and_upstream_errors(asgi_client, monkeypatch):
+    """Bad coordinates are a 400, an undecodable upstream response is a 500."""
+    async def mock_get_weather_data(lat, lon):
+        raise ValueError("Expecting value: line 1 column 1 (char 0)")
+
+    monkeypatch.setattr("services.weather_service.async_get_weather_data", mock_get_weather_data)
+
+    assert asgi_client.get('/api/weather?lat=north&lon=-74.006').status_code == 400
+    assert asgi_client.get('/api/heatmap?north=up').status_code == 400
+    response = asgi_client.get('/api/weather?lat=40.7128&lon=-74.006')
+    assert response.status_code == 500
+    assert 'Invalid coordinates' not in response.json()['error']
+
+def test_weather_and_description(asgi_client, monkeypatch, sample_weather_data):
+    """Weather is fetched once and reused to generate the description."""
+    calls = []
+
+    async def mock_get_weather_data(lat, lon):
+        calls.append((lat, lon))
+        return sample_weather_data
+
+    async def mock_request_ai_description(weather_data):
+        return "Clear and mild in New York."
+
+    monkeypatch.setattr("services.weather_service.async_get_weather_data", mock_get_weather_data)
+    monkeypatch.setattr("services.ai_service.async_request_ai_description", mock_request_ai_description)
+
+    assert asgi_client.get('/api/weather?lat=40.7128&lon=-74.006').json() == sample_weather_data
+    response = asgi_client.get('/api/weather_description?lat=40.7128&lon=-74.006')
+
+    assert response.json() == {"description": "Clear and mild in New York."}
+    assert calls == [(40.71, -74.01)]
+
+def test_concurrent_async_misses_fetch_once():
+    """Concurrent async misses for one key share a single upstream call."""
+    calls = []
+
+    async def slow_fetch():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return {'temp': 20}
+
+    async def run():
+        asgi.cache.clear()
+        return await asyncio.gather(*[
+            async_cached_fetch(asgi.cache, 'weather', 'weather:1.0,2.0', slow_fetch)
+            for _ in range(20)
+        ])
+
+    results = asyncio.run(run())
+
+    assert len(calls) == 1
+    assert results == [{'temp': 20}] * 20
+
+def test_async_client_reuses_connection_and_retries(stub_upstream, monkeypatch):
+    """The async client keeps one connection alive and retries 5xx responses."""
+    monkeypatch.setattr(http_client, 'BACKOFF_FACTOR', 0)
+    stub_upstream.status_codes = [503]
+
+    async def run():
+        try:
+            return [
+                (await http_client.async_get(f"{stub_upstream.url}/weather")).status_code
+                for _ in range(10)
+            ]
+        finally:
+            await http_client.close_async_client()
+
+    assert asyncio.run(run()) == [200] * 10
+    assert stub_upstream.request_count == 11
+    assert stub_upstream.connection_count == 1
+
+def test_heatmap_raster(asgi_client, monkeypatch):
+    """Rasters are rendered off the event loop and served from the cache when unchanged."""
+    async def mock_get_city_snapshot(bounds):
+        return city_snapshot.from_box_response({'list': [
+            {'coord': {'lat': 40, 'lon': -75}, 'main': {'temp': 20}}
+        ]})
+
+    monkeypatch.setattr("services.weather_service.async_get_city_snapshot", mock_get_city_snapshot)
+    url = '/api/heatmap?north=44&south=36&east=-71&west=-79&format=png&width=32'
+
+    first = asgi_client.get(url)
+    second = asgi_client.get(url)
+
+    assert first.status_code == 200
+    assert first.headers['content-type'] == 'image/png'
+    assert second.content == first.content
+    assert metrics.get('encoded.heatmap.hit') == 1
+    assert asgi_client.get(f'{url}&height=big').status_code == 400
@@ -0,0 +1,121 @@
+import json
+import time
+import threading
+from starlette.testclient import TestClient
+from services import batch, metrics
+from services.rate_limit import RateLimiter
+import asgi
+
+def weather_for(lat, lon):
+    return {'location': {'lat': lat, 'lon': lon}, 'current': {'temp': 20}}
+
+def test_batch_results_in_order_with_dedup(client, monkeypatch):
+    """Duplicate and cached locations don't trigger extra upstream calls."""
+    calls = []
+
+    def mock_get_weather_data(lat, lon):
+        calls.append((lat, lon))
+        return weather_for(lat, lon)
+
+    monkeypatch.setattr("services.weather_service.get_weather_data", mock_get_weather_data)
+    client.get('/api/weather?lat=10&lon=20')
+
+    response = client.post('/api/weather/batch', json={'locations': [
+        {'lat': 1, 'lon': 2},
+        [10, 20],
+        {'lat': 1.001, 'lon': 2.001},
+        {'lat': 3, 'lon': 4}
+    ]})
+
+    assert response.status_code == 200
+    results = json.loads(response.data)['results']
+    assert [(r['lat'], r['lon']) for r in results] == [(1.0, 2.0), (10.0, 20.0), (1.0, 2.0), (3.0, 4.0)]
+    assert results[1]['data'] == weather_for(10.0, 20.0)
+    assert sorted(calls) == [(1.0, 2.0), (3.0, 4.0), (10.0, 20.0)]
+    assert metrics.get('batch.unique') == 3
+    assert metrics.get('batch.fetched') == 2
+
+def test_batch_per_item_errors(client, monkeypatch):
+    """Invalid coordinates and failed fetches are reported per item."""
+    def mock_get_weather_data(lat, lon):
+        if lat == 3.0:
+            raise Exception("Failed to fetch weather data: 502")
+        return weather_for(lat, lon)
+
+    monkeypatch.setattr("services.weather_service.get_weather_data", mock_get_weather_data)
+
+    response = client.post('/api/weather/batch', json=[[1, 2], {'lat': 'abc', 'lon': 2}, [3, 4], 'nope'])
+
+    results = json.loads(response.data)['results']
+    assert response.status_code == 200
+    assert results[0]['data'] == weather_for(1.0, 2.0)
+    assert results[1]['error'].startswith('Invalid coordinates')
+    assert results[2] == {'lat': 3.0, 'lon': 4.0, 'error': "Failed to fetch weather data: 502"}
+    assert results[3]['error'].startswith('Invalid coordinates')
+
+def test_batch_rejects_bad_body(client, monkeypatch):
+    """Bodies without a location list, or with too many locations, are rejected."""
+    monkeypatch.setattr(batch, 'BATCH_MAX_LOCATIONS', 2)
+
+    assert client.post('/api/weather/batch', data='not json').status_code == 400
+    assert client.post('/api/weather/batch', json={'points': []}).status_code == 400
+    response = client.post('/api/weather/batch', json=[[1, 2], [3, 4], [5, 6]])
+    assert response.status_code == 400
+    assert 'At most 2 locations' in json.loads(response.data)['error']
+
+def test_batch_misses_fetched_concurrently_within_pool(client, monkeypatch):
+    """Misses run in parallel, but never more than the worker pool allows."""
+    lock = threading.Lock()
+    active = [0]
+    peak = [0]
+
+    def mock_get_weather_data(lat, lon):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.05)
+        with lock:
+            active[0] -= 1
+        return weather_for(lat, lon)
+
+    monkeypatch.setattr("services.weather_service.get_weather_data", mock_get_weather_data)
+
+    response = client.post('/api/weather/batch', json=[[i, i] for i in range(20)])
+
+    assert len(json.loads(response.data)['results']) == 20
+    assert 1 < peak[0] <= batch.BATCH_MAX_WORKERS
+
+def test_batch_streams_ndjson(client, monkeypatch):
+    """With stream=true each result is sent as its own line tagged with its index."""
+    monkeypatch.setattr("services.weather_service.get_weather_data", weather_for)
+
+    response = client.post('/api/weather/batch?stream=true', json=[[1, 2], [3, 4], 'nope'])
+
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert sorted(line['index'] for line in lines) == [0, 1, 2]
+    assert next(line for line in lines if line['index'] == 1)['data'] == weather_for(3.0, 4.0)
+
+def test_async_batch(monkeypatch):
+    """The ASGI mode serves batches and streams them too."""
+    async def mock_get_weather_data(lat, lon):
+        return weather_for(lat, lon)
+
+    monkeypatch.setattr("services.weather_service.async_get_weather_data", mock_get_weather_data)
+    asgi.cache.clear()
+
+    with TestClient(asgi.app) as client:
+        results = client.post('/api/weather/batch', json=[[1, 2], [1, 2], [3, 4]]).json()['results']
+        streamed = client.post('/api/weather/batch?stream=true', json=[[5, 6]]).text.splitlines()
+
+    assert [r['data'] for r in results] == [weather_for(1.0, 2.0), weather_for(1.0, 2.0), weather_for(3.0, 4.0)]
+    assert json.loads(streamed[0]) == {'index': 0, 'lat': 5.0, 'lon': 6.0, 'data': weather_for(5.0, 6.0)}
+
+def test_rate_limiter_spaces_calls():
+    """Once the burst is spent, calls are spaced at the configured rate."""
+    limiter = RateLimiter(rate=100, burst=2)
+
+    assert limiter.reserve() == 0
+    assert limiter.reserve() == 0
+    assert 0.005 < limiter.reserve() <= 0.01
+    assert 0.015 < limiter.reserve() <= 0.02
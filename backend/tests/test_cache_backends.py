@@ -0,0 +1,130 @@
+import os
+import time
+import struct
+import asyncio
+import threading
+import pytest
+import fakeredis
+from flask import Flask
+from cachelib import SimpleCache
+from flask_caching import Cache
+from services.cache_backends import CompactSerializer, SharedFileCache, CompactRedisCache, async_call, cache_config
+
+@pytest.fixture
+def large_value(sample_forecast_data):
+    """A forecast-sized value that is worth compressing."""
+    return dict(sample_forecast_data, forecast=sample_forecast_data['forecast'] * 20)
+
+def test_serializer_round_trip(sample_weather_data, large_value):
+    """Small values are pickled, large ones compressed, ints kept plain."""
+    serializer = CompactSerializer()
+
+    small = serializer.dumps(sample_weather_data)
+    assert small.startswith(b"p")
+    assert serializer.loads(small) == sample_weather_data
+
+    large = serializer.dumps(large_value)
+    assert large.startswith(b"z")
+    assert serializer.loads(large) == large_value
+
+    assert serializer.dumps(42) == b"42"
+    assert serializer.loads(b"42") == 42
+
+    assert serializer.dumps(b"\x1f\x8b body" * 100) == b"b" + b"\x1f\x8b body" * 100
+    assert serializer.loads(serializer.dumps(b"")) == b""
+
+def test_file_cache_shared_between_workers(tmp_path, sample_weather_data):
+    """Two cache instances on the same directory see each other's entries."""
+    worker_one = SharedFileCache(str(tmp_path))
+    worker_two = SharedFileCache(str(tmp_path))
+
+    worker_one.set('weather:40.71,-74.01', sample_weather_data, timeout=60)
+
+    assert worker_two.get('weather:40.71,-74.01') == sample_weather_data
+
+def test_async_calls_on_shared_tiers_leave_the_event_loop(tmp_path):
+    """File and Redis caches are called from a worker thread, in-process caches directly."""
+    threads = []
+
+    class RecordingFileCache(SharedFileCache):
+        def get(self, key):
+            threads.append(threading.get_ident())
+            return super().get(key)
+
+    file_cache = RecordingFileCache(str(tmp_path))
+    memory_cache = SimpleCache()
+
+    async def calls():
+        await async_call(file_cache, 'set', 'key', 1, timeout=60)
+        await async_call(memory_cache, 'set', 'key', 2)
+        return threading.get_ident(), await async_call(file_cache, 'get', 'key'), await async_call(memory_cache, 'get', 'key')
+
+    loop_thread, from_file, from_memory = asyncio.run(calls())
+
+    assert (from_file, from_memory) == (1, 2)
+    assert threads and loop_thread not in threads
+
+def test_file_cache_bounded_by_size(tmp_path, large_value):
+    """Oldest entries are evicted once the byte budget is exceeded."""
+    entry_size = len(CompactSerializer().dumps(large_value)) + 4
+    cache = SharedFileCache(str(tmp_path), threshold=0, max_bytes=entry_size * 3)
+
+    for i in range(6):
+        cache.set(f'forecast:{i}', large_value, timeout=60)
+        # Give each entry a distinct write time
+        os.utime(cache._get_filename(f'forecast:{i}'), (i, i))
+
+    assert cache.total_bytes() <= entry_size * 3
+    assert cache.get('forecast:0') is None
+    assert cache.get('forecast:5') == large_value
+
+def test_file_cache_scans_only_near_budget(tmp_path, monkeypatch):
+    """Writes well under the byte budget don't list the cache directory."""
+    cache = SharedFileCache(str(tmp_path), threshold=0, max_bytes=1024 * 1024)
+    scans = []
+    entries = cache._entries
+    monkeypatch.setattr(cache, '_entries', lambda: scans.append(1) or entries())
+
+    for i in range(50):
+        cache.set(f'weather:{i}', {'temp': i}, timeout=60)
+
+    assert len(scans) == 1
+
+def test_file_cache_counters_keep_expiry(tmp_path):
+    """Counters shared between workers keep the expiry they were created with."""
+    worker_one = SharedFileCache(str(tmp_path), default_timeout=5)
+    worker_two = SharedFileCache(str(tmp_path), default_timeout=5)
+    worker_one.add('quota:day:1', 0, timeout=86400)
+
+    assert worker_one.inc('quota:day:1') == 1
+    assert worker_two.inc('quota:day:1') == 2
+    assert worker_two.dec('quota:day:1') == 1
+    with open(worker_one._get_filename('quota:day:1'), 'rb') as f:
+        assert struct.unpack('I', f.read(4))[0] > time.time() + 3600
+
+def test_redis_cache_shared_between_workers(sample_weather_data):
+    """Two workers talking to the same Redis-compatible server share entries."""
+    server = fakeredis.FakeServer()
+    worker_one = CompactRedisCache(host=fakeredis.FakeStrictRedis(server=server), key_prefix='test:')
+    worker_two = CompactRedisCache(host=fakeredis.FakeStrictRedis(server=server), key_prefix='test:')
+
+    worker_one.set('weather:40.71,-74.01', sample_weather_data, timeout=60)
+
+    assert worker_two.get('weather:40.71,-74.01') == sample_weather_data
+    assert worker_two.add('weather:40.71,-74.01', {}, timeout=60) is False
+
+def test_cache_config_selects_backend(tmp_path, monkeypatch, sample_weather_data):
+    """The configured backend is wired into Flask-Caching."""
+    monkeypatch.setenv('CACHE_DIR', str(tmp_path))
+    app = Flask(__name__)
+    cache = Cache(app, config=cache_config('filesystem'))
+
+    with app.app_context():
+        cache.set('weather:1.0,2.0', sample_weather_data)
+        assert isinstance(cache.cache, SharedFileCache)
+        assert cache.get('weather:1.0,2.0') == sample_weather_data
+
+    assert cache_config('redis')['CACHE_TYPE'] == 'services.cache_backends.CompactRedisCache'
+    assert cache_config('simple')['CACHE_TYPE'] == 'SimpleCache'
+    with pytest.raises(ValueError):
+        cache_config('memcached')
@@ -0,0 +1,74 @@
+import json
+import pytest
+from services import cache_keys, metrics
+from services.cache_keys import quantize_location, location_cache_key, geohash_encode, geohash_bounds
+
+def test_equivalent_formatting_shares_key():
+    """Differently formatted coordinates for the same point map to one key."""
+    first = quantize_location('40.7128', '-74.006')
+    second = quantize_location('40.71280', '-74.0060')
+    assert location_cache_key('weather', first) == location_cache_key('weather', second)
+
+def test_nearby_points_share_cell():
+    """Points a few meters apart snap to the same grid cell."""
+    first = quantize_location(40.7128, -74.0060)
+    second = quantize_location(40.7131, -74.0057)
+    assert first.cell == second.cell
+    assert (first.lat, first.lon) == (40.71, -74.01)
+
+def test_distant_points_do_not_share_cell():
+    """Points in different grid cells keep separate keys."""
+    assert quantize_location(40.7128, -74.0060).cell != quantize_location(40.73, -74.0060).cell
+
+def test_negative_zero_is_normalized():
+    """Coordinates snapping to zero don't produce a '-0.0' key."""
+    assert quantize_location('-0.001', '0.001').cell == '0.0,0.0'
+
+def test_invalid_coordinates():
+    """Non-numeric or out-of-range coordinates are rejected."""
+    with pytest.raises(ValueError):
+        quantize_location('abc', '10')
+    with pytest.raises(ValueError):
+        quantize_location('95', '10')
+
+def test_geohash_round_trip():
+    """A geohash cell contains the point it was encoded from."""
+    geohash = geohash_encode(40.7128, -74.0060, 7)
+    assert geohash == 'dr5regw'
+    bounds = geohash_bounds(geohash)
+    assert bounds['south'] <= 40.7128 <= bounds['north']
+    assert bounds['west'] <= -74.0060 <= bounds['east']
+
+def test_geohash_keys(monkeypatch):
+    """With a geohash precision configured, keys use the geohash cell."""
+    monkeypatch.setattr(cache_keys, 'CACHE_GEOHASH_PRECISION', 6)
+    location = quantize_location(40.7128, -74.0060)
+    assert location.cell == 'dr5reg'
+    assert quantize_location(40.7130, -74.0058).cell == location.cell
+
+def test_nearby_requests_share_upstream_call(client, monkeypatch, sample_weather_data):
+    """Nearby requests are served from one upstream call and counted as a hit."""
+    calls = []
+
+    def mock_get_weather_data(lat, lon):
+        calls.append((lat, lon))
+        return sample_weather_data
+
+    monkeypatch.setattr("services.weather_service.get_weather_data", mock_get_weather_data)
+
+    assert client.get('/api/weather?lat=40.7128&lon=-74.006').status_code == 200
+    assert client.get('/api/weather?lon=-74.0060&lat=40.71280').status_code == 200
+
+    assert calls == [(40.71, -74.01)]
+    assert metrics.get('cache.weather.hit') == 1
+    assert metrics.get('cache.weather.miss') == 1
+
+    response = client.get('/api/metrics')
+    data = json.loads(response.data)
+    assert data['cache_hit_rates']['weather'] == 0.5
+
+def test_invalid_coordinates_return_400(client):
+    """Invalid coordinates are rejected before any upstream call."""
+    response = client.get('/api/forecast?lat=north&lon=-74')
+    assert response.status_code == 400
+    assert 'error' in json.loads(response.data)
@@ -0,0 +1,220 @@
+import time
+import json
+import asyncio
+import pytest
+from unittest.mock import MagicMock, patch
+from cachelib import SimpleCache
+from services import ai_service, circuit_breaker, data_cache, http_client, metrics
+from services.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+from services.rate_limit import QuotaExhaustedError, QuotaGovernor
+
+@pytest.fixture(autouse=True)
+def reset_breakers():
+    metrics.reset()
+    circuit_breaker.reset()
+    yield
+    circuit_breaker.reset()
+
+def trip(breaker):
+    """Record failures until the breaker opens."""
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+
+def test_opens_after_consecutive_failures():
+    """Failures open the breaker, successes in between reset the count."""
+    breaker = CircuitBreaker('test', failure_threshold=3, reset_timeout=60)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success(0.1)
+    breaker.record_failure()
+    assert breaker.status()['state'] == CLOSED
+
+    trip(breaker)
+
+    assert breaker.status()['state'] == OPEN
+    with pytest.raises(CircuitOpenError) as error:
+        breaker.before_call()
+    assert 0 < error.value.retry_after <= 60
+    assert not breaker.available()
+    assert metrics.get('circuit.test.opened') == 1
+    assert metrics.get('circuit.test.rejected') == 1
+
+def test_half_open_probe():
+    """After the reset timeout one probe goes through; its outcome decides the state."""
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0.05)
+    trip(breaker)
+    time.sleep(0.06)
+
+    assert breaker.status()['state'] == HALF_OPEN
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_failure()
+    assert breaker.status()['state'] == OPEN
+
+    time.sleep(0.06)
+    breaker.before_call()
+    breaker.record_success(0.01)
+    assert breaker.status()['state'] == CLOSED
+    assert metrics.get('circuit.test.closed') == 1
+
+def test_slow_calls_count_as_failures():
+    """Calls over the latency SLO open the breaker like errors do."""
+    breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=60, latency_slo=1)
+    breaker.record_success(0.5)
+    breaker.record_success(1.5)
+    breaker.record_success(2.5)
+
+    assert breaker.status()['state'] == OPEN
+    assert metrics.get('circuit.test.slow') == 2
+
+def test_disabled_breaker_never_opens():
+    breaker = CircuitBreaker('test', failure_threshold=0)
+    for _ in range(10):
+        breaker.record_failure()
+    breaker.before_call()
+    assert breaker.available()
+
+@patch('services.ai_service.openai')
+def test_open_openai_circuit_falls_back_immediately(mock_openai, sample_weather_data):
+    """While OpenAI's breaker is open the fallback is returned without calling it."""
+    trip(circuit_breaker.openai_breaker)
+
+    description = ai_service.generate_weather_description(sample_weather_data)
+
+    assert description == ai_service.generate_fallback_description(sample_weather_data)
+    mock_openai.chat.completions.create.assert_not_called()
+
+@patch('services.ai_service.openai')
+def test_openai_failures_open_circuit(mock_openai, sample_weather_data):
+    mock_openai.chat.completions.create.side_effect = Exception("API Error")
+
+    for _ in range(circuit_breaker.openai_breaker.failure_threshold + 2):
+        ai_service.generate_weather_description(sample_weather_data)
+
+    assert mock_openai.chat.completions.create.call_count == circuit_breaker.openai_breaker.failure_threshold
+    assert circuit_breaker.openai_breaker.status()['state'] == OPEN
+
+def test_upstream_errors_open_circuit(stub_upstream, monkeypatch):
+    """5xx responses open the OpenWeatherMap breaker and later calls never reach upstream."""
+    breaker = CircuitBreaker('openweather', failure_threshold=2, reset_timeout=60)
+    monkeypatch.setattr(http_client, "openweather_breaker", breaker)
+    monkeypatch.setattr(http_client, "MAX_RETRIES", 0)
+    stub_upstream.status_codes = [503, 503]
+
+    async def fetch():
+        try:
+            return [(await http_client.async_get(f"{stub_upstream.url}/weather")).status_code for _ in range(2)]
+        finally:
+            await http_client.close_async_client()
+
+    assert asyncio.run(fetch()) == [503, 503]
+    with pytest.raises(CircuitOpenError):
+        http_client.get(f"{stub_upstream.url}/weather")
+    assert stub_upstream.request_count == 2
+
+def test_probe_released_when_quota_exhausted(stub_upstream, monkeypatch):
+    """A probe that can't get quota doesn't keep the breaker from probing again."""
+    breaker = CircuitBreaker('openweather', failure_threshold=1, reset_timeout=0.05)
+    governor = QuotaGovernor(per_minute=0, per_day=1, max_wait=0, workers=1)
+    governor.acquire()
+    monkeypatch.setattr(http_client, "openweather_breaker", breaker)
+    monkeypatch.setattr(http_client, "upstream_governor", governor)
+    trip(breaker)
+    time.sleep(0.06)
+
+    with pytest.raises(QuotaExhaustedError):
+        http_client.get(f"{stub_upstream.url}/weather")
+
+    assert breaker.status()['state'] == HALF_OPEN
+    assert breaker.available()
+    assert stub_upstream.request_count == 0
+
+class FakeAsyncStream:
+    """Async OpenAI stream yielding the given chunks."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+
+def test_probe_released_when_stream_is_closed_early(monkeypatch, sample_weather_data):
+    """A client leaving mid-stream doesn't keep the half-open breaker from probing again."""
+    chunks = [MagicMock(choices=[MagicMock(delta=MagicMock(content=text))]) for text in ["Clear ", "and mild."]]
+    mock_openai = MagicMock()
+    mock_openai.chat.completions.create.return_value.__enter__.return_value.__iter__.return_value = iter(chunks)
+
+    async def create(**kwargs):
+        return FakeAsyncStream(chunks)
+
+    mock_async_openai = MagicMock()
+    mock_async_openai.chat.completions.create = create
+    monkeypatch.setattr(ai_service, "openai", mock_openai)
+    monkeypatch.setattr(ai_service, "async_openai", mock_async_openai)
+
+    def half_open_breaker():
+        breaker = CircuitBreaker('openai', failure_threshold=1, reset_timeout=0.05)
+        monkeypatch.setattr(ai_service, "openai_breaker", breaker)
+        trip(breaker)
+        time.sleep(0.06)
+        return breaker
+
+    breaker = half_open_breaker()
+    stream = ai_service.stream_ai_description(sample_weather_data)
+    assert next(stream) == "Clear "
+    assert not breaker.available()
+    stream.close()
+    assert breaker.status()['state'] == HALF_OPEN
+    assert breaker.available()
+
+    async def read_first_chunk():
+        stream = ai_service.async_stream_ai_description(sample_weather_data)
+        text = await stream.__anext__()
+        await stream.aclose()
+        return text
+
+    breaker = half_open_breaker()
+    assert asyncio.run(read_first_chunk()) == "Clear "
+    assert breaker.available()
+
+def test_quota_waits_are_not_latency(stub_upstream, monkeypatch):
+    """Only the upstream call counts against the latency SLO, not the wait for quota."""
+    breaker = CircuitBreaker('openweather', failure_threshold=1, reset_timeout=60, latency_slo=0.1)
+    monkeypatch.setattr(http_client, "openweather_breaker", breaker)
+    monkeypatch.setattr(http_client.upstream_governor, "acquire", lambda level=None: time.sleep(0.2))
+
+    assert http_client.get(f"{stub_upstream.url}/weather").status_code == 200
+    assert breaker.status()['state'] == CLOSED
+
+def test_stale_entries_served_while_circuit_open(monkeypatch):
+    """Stale entries aren't refreshed while upstream's breaker is open."""
+    breaker = CircuitBreaker('openweather', failure_threshold=1, reset_timeout=60)
+    trip(breaker)
+    monkeypatch.setattr(data_cache, "openweather_breaker", breaker)
+    cache = SimpleCache()
+    cache_key = 'weather:1.0,2.0'
+    cache.set(cache_key, {'value': {'temp': 1}, 'fetched_at': time.time() - 600})
+
+    assert data_cache.cached_fetch(cache, 'weather', cache_key, lambda: {'temp': 2}) == {'temp': 1}
+    assert metrics.get('refresh.weather.deferred') == 1
+
+def test_status_endpoint(client):
+    """/api/status reports each breaker and turns degraded while one is open."""
+    status = json.loads(client.get('/api/status').data)
+    assert status['status'] == 'ok'
+    assert set(status['circuits']) == {'openai', 'openweather'}
+
+    trip(circuit_breaker.openai_breaker)
+    status = json.loads(client.get('/api/status').data)
+
+    assert status['status'] == 'degraded'
+    assert status['circuits']['openai']['state'] == OPEN
+    assert 'upstream_quota' in status
@@ -0,0 +1,52 @@
+import pytest
+from services import city_snapshot
+from services.cache_backends import CompactSerializer
+
+BOX_RESPONSE = {'list': [
+    {'coord': {'lat': 40.7, 'lon': -74.0}, 'main': {'temp': 10, 'humidity': 80, 'pressure': 1013},
+     'clouds': {'all': 90}, 'weather': [{'id': 501}]},
+    {'coord': {'lat': 34.0, 'lon': -118.2}, 'main': {'temp': 50, 'humidity': 20, 'pressure': 900},
+     'clouds': {'all': 10}, 'weather': [{'id': 800}]},
+    {'coord': {'lat': 41.9, 'lon': -87.6}, 'main': {'humidity': 55}, 'weather': []},
+    {'coord': {'lat': None, 'lon': -80.0}, 'main': {'temp': 20}}
+]}
+
+def test_snapshot_is_columnar():
+    """Cities without coordinates are dropped and missing readings become NaN."""
+    snapshot = city_snapshot.from_box_response(BOX_RESPONSE)
+
+    assert snapshot.lat.tolist() == [40.7, 34.0, 41.9]
+    assert snapshot.weather_id.tolist() == [501, 800, 800]
+    assert snapshot.clouds.tolist() == [90, 10, 0]
+    assert snapshot.temp[2] != snapshot.temp[2]
+
+@pytest.mark.parametrize("data_type, expected", [
+    ('temperature', [[40.7, -74.0, 0.5], [34.0, -118.2, 1.0]]),
+    ('precipitation', [[40.7, -74.0, 0.9], [34.0, -118.2, 0.01], [41.9, -87.6, 0.0]]),
+    ('humidity', [[40.7, -74.0, 0.8], [34.0, -118.2, 0.2], [41.9, -87.6, 0.55]]),
+    ('pressure', [[40.7, -74.0, 0.42], [34.0, -118.2, 0.0]]),
+    ('wind', [])
+])
+def test_heatmap_layers(data_type, expected):
+    """Every layer is derived from the same snapshot with clamped intensities."""
+    points = city_snapshot.heatmap_points(city_snapshot.from_box_response(BOX_RESPONSE), data_type)
+
+    assert points == [[lat, lon, pytest.approx(intensity)] for lat, lon, intensity in expected]
+
+def test_concat_shifts_longitudes():
+    """Joined snapshots keep every city, with per-snapshot longitude offsets."""
+    snapshot = city_snapshot.from_box_response(BOX_RESPONSE)
+
+    joined = city_snapshot.concat([snapshot, snapshot], [0, 360])
+
+    assert joined.lon.tolist() == [-74.0, -118.2, -87.6, 286.0, 241.8, 272.4]
+    assert len(city_snapshot.concat([]).lat) == 0
+
+def test_snapshot_survives_cache_serialization():
+    """Snapshots round-trip through the shared cache tier's serializer."""
+    serializer = CompactSerializer()
+    snapshot = city_snapshot.from_box_response(BOX_RESPONSE)
+
+    restored = serializer.loads(serializer.dumps(snapshot))
+
+    assert city_snapshot.heatmap_points(restored, 'humidity') == city_snapshot.heatmap_points(snapshot, 'humidity')
@@ -0,0 +1,73 @@
+import pytest
+from starlette.testclient import TestClient
+from services import conditional
+import asgi
+
+def test_cache_control_follows_ttls():
+    """max-age is what's left of the soft TTL, stale-while-revalidate the rest of the hard TTL."""
+    assert conditional.cache_control('weather', 1000, now=1000) == "public, max-age=300, stale-while-revalidate=600"
+    assert conditional.cache_control('weather', 1000, now=1100) == "public, max-age=200, stale-while-revalidate=600"
+    assert conditional.cache_control('weather', 1000, now=2000).startswith("public, max-age=0,")
+
+@pytest.mark.parametrize("request_headers, expected", [
+    ({}, False),
+    ({'If-None-Match': '"abc"'}, True),
+    ({'If-None-Match': '"old", W/"abc"'}, True),
+    ({'If-None-Match': '*'}, True),
+    ({'If-None-Match': '"old"', 'If-Modified-Since': 'Thu, 01 Jan 2099 00:00:00 GMT'}, False),
+    ({'If-Modified-Since': 'Tue, 10 Aug 2021 00:00:00 GMT'}, True),
+    ({'If-Modified-Since': 'Mon, 09 Aug 2021 00:00:00 GMT'}, False),
+    ({'If-Modified-Since': 'yesterday'}, False)
+])
+def test_is_not_modified(request_headers, expected):
+    """If-None-Match takes precedence over If-Modified-Since."""
+    headers = {'ETag': '"abc"', 'Last-Modified': 'Tue, 10 Aug 2021 00:00:00 GMT'}
+    assert conditional.is_not_modified(request_headers, headers) is expected
+
+def test_weather_revalidation(client, monkeypatch, sample_weather_data):
+    """Weather carries validators from the observation and answers matches with 304."""
+    monkeypatch.setattr("services.weather_service.get_weather_data", lambda lat, lon: sample_weather_data)
+    url = '/api/weather?lat=40.7128&lon=-74.006'
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers['Last-Modified'] == 'Tue, 10 Aug 2021 00:00:00 GMT'
+    assert response.headers['Cache-Control'].startswith('public, max-age=')
+    etag = response.headers['ETag']
+
+    revalidated = client.get(url, headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.data == b""
+    assert revalidated.headers['ETag'] == etag
+
+    assert client.get(url, headers={'If-None-Match': '"stale"'}).status_code == 200
+
+def test_forecast_etag_per_representation(client, monkeypatch, sample_forecast_data):
+    """Each format and coding of the forecast has its own strong ETag."""
+    monkeypatch.setattr("services.weather_service.get_weather_forecast", lambda lat, lon: sample_forecast_data)
+    url = '/api/forecast?lat=40.7128&lon=-74.006'
+
+    plain = client.get(url).headers['ETag']
+    packed = client.get(f'{url}&format=msgpack').headers['ETag']
+
+    assert plain != packed
+    response = client.get(f'{url}&format=msgpack', headers={'If-None-Match': packed})
+    assert response.status_code == 304
+    assert 'Accept' in response.headers['Vary']
+    assert client.get(url, headers={'If-None-Match': packed}).status_code == 200
+
+def test_asgi_weather_revalidation(monkeypatch, sample_weather_data):
+    """The ASGI app answers conditional requests the same way."""
+    async def mock_get_weather_data(lat, lon):
+        return sample_weather_data
+
+    monkeypatch.setattr("services.weather_service.async_get_weather_data", mock_get_weather_data)
+    asgi.cache.clear()
+
+    with TestClient(asgi.app) as client:
+        etag = client.get('/api/weather?lat=40.7128&lon=-74.006').headers['etag']
+        response = client.get('/api/weather?lat=40.7128&lon=-74.006', headers={'If-None-Match': etag})
+
+    assert response.status_code == 304
+    assert response.content == b""
+    assert 'content-length' not in response.headers
@@ -0,0 +1,109 @@
+import json
+import threading
+from starlette.testclient import TestClient
+from services import metrics
+from services.description_cache import description_cache
+import asgi
+
+def test_dashboard_missing_params(client):
+    """Missing coordinates are rejected."""
+    response = client.get('/api/dashboard')
+    assert response.status_code == 400
+    assert 'Latitude and longitude are required' in json.loads(response.data)['error']
+
+def test_dashboard_fetches_concurrently_and_reuses_weather(client, monkeypatch, sample_weather_data, sample_forecast_data):
+    """Weather and forecast are fetched in parallel and the weather is fetched only once."""
+    calls = []
+    # Each fetch waits for the other, so a sequential fan-out would time out
+    barrier = threading.Barrier(2, timeout=2)
+
+    def mock_get_weather_data(lat, lon):
+        calls.append('weather')
+        barrier.wait()
+        return sample_weather_data
+
+    def mock_get_weather_forecast(lat, lon):
+        calls.append('forecast')
+        barrier.wait()
+        return sample_forecast_data
+
+    monkeypatch.setattr("services.weather_service.get_weather_data", mock_get_weather_data)
+    monkeypatch.setattr("services.weather_service.get_weather_forecast", mock_get_weather_forecast)
+    monkeypatch.setattr("services.ai_service.request_ai_description", lambda weather_data: "Clear and mild.")
+
+    response = client.get('/api/dashboard?lat=40.7128&lon=-74.006')
+
+    assert response.status_code == 200
+    payload = json.loads(response.data)
+    assert payload["forecast"].items() >= sample_forecast_data.items()
+    assert {**payload, "forecast": sample_forecast_data} == {
+        "weather": sample_weather_data,
+        "forecast": sample_forecast_data,
+        "description": "Clear and mild."
+    }
+    assert sorted(calls) == ['forecast', 'weather']
+
+    # The individual endpoints are served from the entries the dashboard cached
+    assert json.loads(client.get('/api/weather?lat=40.7128&lon=-74.006').data) == sample_weather_data
+    assert sorted(calls) == ['forecast', 'weather']
+
+def test_dashboard_reports_partial_failure(client, monkeypatch, sample_weather_data):
+    """A failed forecast doesn't hide the current weather and description."""
+    def failing_forecast(lat, lon):
+        raise Exception("Failed to fetch forecast data: 503")
+
+    monkeypatch.setattr("services.weather_service.get_weather_data", lambda lat, lon: sample_weather_data)
+    monkeypatch.setattr("services.weather_service.get_weather_forecast", failing_forecast)
+    monkeypatch.setattr("services.ai_service.request_ai_description", lambda weather_data: "Clear and mild.")
+
+    response = client.get('/api/dashboard?lat=40.7128&lon=-74.006')
+    data = json.loads(response.data)
+
+    assert response.status_code == 200
+    assert data['weather'] == sample_weather_data
+    assert data['description'] == "Clear and mild."
+    assert data['forecast'] is None
+    assert data['errors'] == {'forecast': "Failed to fetch forecast data: 503"}
+    assert metrics.get('dashboard.forecast.failed') == 1
+
+def test_dashboard_fails_when_nothing_fetched(client, monkeypatch):
+    """The request fails when neither weather nor forecast is available."""
+    def failing(lat, lon):
+        raise Exception("upstream down")
+
+    monkeypatch.setattr("services.weather_service.get_weather_data", failing)
+    monkeypatch.setattr("services.weather_service.get_weather_forecast", failing)
+
+    response = client.get('/api/dashboard?lat=40.7128&lon=-74.006')
+
+    assert response.status_code == 500
+    assert 'upstream down' in json.loads(response.data)['error']
+
+def test_async_dashboard(monkeypatch, sample_weather_data, sample_forecast_data):
+    """The ASGI mode serves the same payload from one request."""
+    async def mock_get_weather_data(lat, lon):
+        return sample_weather_data
+
+    async def mock_get_weather_forecast(lat, lon):
+        return sample_forecast_data
+
+    async def mock_request_ai_description(weather_data):
+        return "Clear and mild."
+
+    monkeypatch.setattr("services.weather_service.async_get_weather_data", mock_get_weather_data)
+    monkeypatch.setattr("services.weather_service.async_get_weather_forecast", mock_get_weather_forecast)
+    monkeypatch.setattr("services.ai_service.async_request_ai_description", mock_request_ai_description)
+    asgi.cache.clear()
+    description_cache.clear()
+
+    with TestClient(asgi.app) as client:
+        response = client.get('/api/dashboard?lat=40.7128&lon=-74.006')
+
+    assert response.status_code == 200
+    payload = response.json()
+    assert payload["forecast"].items() >= sample_forecast_data.items()
+    assert {**payload, "forecast": sample_forecast_data} == {
+        "weather": sample_weather_data,
+        "forecast": sample_forecast_data,
+        "description": "Clear and mild."
+    }
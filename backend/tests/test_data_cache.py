@@ -0,0 +1,89 @@
+import time
+import pytest
+from flask import Flask
+from flask_caching import Cache
+from services import data_cache, metrics
+from services.data_cache import cached_fetch, schedule_refresh, CacheTTL
+
+@pytest.fixture
+def cache():
+    """A standalone in-process cache."""
+    app = Flask(__name__)
+    cache = Cache(app, config={'CACHE_TYPE': 'SimpleCache'})
+    metrics.reset()
+    with app.app_context():
+        yield cache
+
+def wait_for(counter, expected=1, timeout=2):
+    """Wait until a metrics counter reaches the expected value."""
+    deadline = time.monotonic() + timeout
+    while metrics.get(counter) < expected and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return metrics.get(counter)
+
+def store(cache, key, value, age):
+    """Store an entry that was fetched `age` seconds ago."""
+    cache.set(key, {'value': value, 'fetched_at': time.time() - age}, timeout=900)
+
+def test_miss_fetches_and_caches(cache):
+    """A miss fetches in the foreground and stores the value."""
+    assert cached_fetch(cache, 'weather', 'weather:1.0,2.0', lambda: {'temp': 1}) == {'temp': 1}
+    assert cached_fetch(cache, 'weather', 'weather:1.0,2.0', lambda: {'temp': 2}) == {'temp': 1}
+    assert metrics.get('cache.weather.miss') == 1
+    assert metrics.get('cache.weather.hit') == 1
+
+def test_stale_entry_served_while_revalidating(cache):
+    """Past the soft TTL the old value is returned and refreshed in the background."""
+    store(cache, 'weather:1.0,2.0', {'temp': 1}, age=400)
+
+    value = cached_fetch(cache, 'weather', 'weather:1.0,2.0', lambda: {'temp': 2})
+
+    assert value == {'temp': 1}
+    assert metrics.get('cache.weather.stale') == 1
+    assert wait_for('refresh.weather.completed') == 1
+    assert cache.get('weather:1.0,2.0')['value'] == {'temp': 2}
+
+def test_hot_entry_refreshed_ahead(cache, monkeypatch):
+    """Frequently read entries are refreshed before they go stale."""
+    monkeypatch.setattr(data_cache, 'REFRESH_HOT_THRESHOLD', 3)
+    store(cache, 'forecast:1.0,2.0', {'temp': 1}, age=270)
+
+    for _ in range(3):
+        assert cached_fetch(cache, 'forecast', 'forecast:1.0,2.0', lambda: {'temp': 2}) == {'temp': 1}
+
+    assert metrics.get('cache.forecast.refresh_ahead') == 1
+    assert wait_for('refresh.forecast.completed') == 1
+    assert cache.get('forecast:1.0,2.0')['value'] == {'temp': 2}
+
+def test_fresh_cold_entry_not_refreshed(cache):
+    """Fresh entries that are rarely read are left alone."""
+    store(cache, 'weather:1.0,2.0', {'temp': 1}, age=10)
+
+    cached_fetch(cache, 'weather', 'weather:1.0,2.0', lambda: {'temp': 2})
+
+    assert metrics.get('refresh.weather.scheduled') == 0
+
+def test_refresh_concurrency_is_capped(cache, monkeypatch):
+    """No more than REFRESH_MAX_CONCURRENCY refreshes run at once."""
+    monkeypatch.setattr(data_cache, 'REFRESH_MAX_CONCURRENCY', 1)
+    monkeypatch.setattr(data_cache, '_refreshing', {'weather:busy'})
+
+    assert schedule_refresh(cache, 'weather', 'weather:1.0,2.0', lambda: {'temp': 2}) is False
+    assert metrics.get('refresh.weather.skipped') == 1
+
+def test_failed_refresh_keeps_stale_value(cache):
+    """A failing background refresh leaves the stale entry in place."""
+    store(cache, 'weather:1.0,2.0', {'temp': 1}, age=400)
+
+    def failing_fetch():
+        raise Exception("upstream down")
+
+    assert cached_fetch(cache, 'weather', 'weather:1.0,2.0', failing_fetch) == {'temp': 1}
+    assert wait_for('refresh.weather.failed') == 1
+    assert cache.get('weather:1.0,2.0')['value'] == {'temp': 1}
+
+def test_ttls_configurable_per_namespace(monkeypatch):
+    """Each namespace has its own soft and hard TTL."""
+    monkeypatch.setitem(data_cache.CACHE_TTLS, 'weather', CacheTTL(60, 600))
+    assert data_cache.ttl_for('weather') == CacheTTL(60, 600)
+    assert data_cache.ttl_for('unknown') == data_cache.DEFAULT_TTL
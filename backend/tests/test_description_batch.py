@@ -0,0 +1,110 @@
+import copy
+import json
+import pytest
+from unittest.mock import MagicMock, patch
+from starlette.testclient import TestClient
+from services import ai_service, circuit_breaker
+from services.description_cache import cached_descriptions, description_cache, weather_fingerprint
+import asgi
+
+@pytest.fixture(autouse=True)
+def reset_state():
+    description_cache.clear()
+    circuit_breaker.reset()
+    yield
+    description_cache.clear()
+
+def city(sample_weather_data, name, temp=20):
+    weather_data = copy.deepcopy(sample_weather_data)
+    weather_data['location']['name'] = name
+    weather_data['current']['temp'] = temp
+    return weather_data
+
+def completion(items):
+    response = MagicMock()
+    response.choices = [MagicMock()]
+    response.choices[0].message.content = json.dumps({"descriptions": items})
+    return response
+
+@patch('services.ai_service.openai')
+def test_locations_are_packed_into_few_calls(mock_openai, monkeypatch, sample_weather_data):
+    """Locations are sent AI_BATCH_SIZE per call and matched back by id."""
+    monkeypatch.setattr(ai_service, "AI_BATCH_SIZE", 2)
+    mock_openai.chat.completions.create.side_effect = [
+        completion([{"id": 1, "description": "Boston."}, {"id": 0, "description": "New York."}]),
+        completion([{"id": 5, "description": "Out of range."}])
+    ]
+    cities = [city(sample_weather_data, name) for name in ("New York", "Boston", "Chicago")]
+
+    assert ai_service.request_ai_descriptions(cities) == ["New York.", "Boston.", None]
+
+    calls = mock_openai.chat.completions.create.call_args_list
+    assert len(calls) == 2
+    prompt = calls[0].kwargs['messages'][1]['content']
+    assert "0. New York, US" in prompt and "1. Boston, US" in prompt
+    assert calls[0].kwargs['response_format'] == {"type": "json_object"}
+    assert calls[0].kwargs['max_tokens'] == 2 * ai_service.AI_BATCH_TOKENS_PER_LOCATION
+
+@patch('services.ai_service.openai')
+def test_failed_call_falls_back_per_location(mock_openai, monkeypatch, sample_weather_data):
+    """Only the locations of a failed call get the fallback description."""
+    monkeypatch.setattr(ai_service, "AI_BATCH_SIZE", 1)
+    mock_openai.chat.completions.create.side_effect = [
+        completion([{"id": 0, "description": "New York."}]),
+        Exception("API Error")
+    ]
+    cities = [city(sample_weather_data, name) for name in ("New York", "Boston")]
+
+    descriptions = ai_service.generate_weather_descriptions(cities)
+
+    assert descriptions == ["New York.", ai_service.generate_fallback_description(cities[1])]
+
+@patch('services.ai_service.request_ai_descriptions')
+def test_cached_descriptions_only_generate_misses(mock_request, sample_weather_data):
+    """Cached and duplicate conditions aren't sent to OpenAI, fallbacks aren't cached."""
+    new_york, boston, chicago = (city(sample_weather_data, name) for name in ("New York", "Boston", "Chicago"))
+    description_cache.set(weather_fingerprint(new_york), "Cached New York.")
+    mock_request.return_value = ["Boston.", None]
+
+    descriptions = cached_descriptions([new_york, boston, chicago, copy.deepcopy(boston)])
+
+    assert descriptions == [
+        "Cached New York.", "Boston.", ai_service.generate_fallback_description(chicago), "Boston."
+    ]
+    assert mock_request.call_args.args[0] == [boston, chicago]
+    assert description_cache.get(weather_fingerprint(boston)) == "Boston."
+    assert description_cache.get(weather_fingerprint(chicago)) is None
+
+def test_batch_endpoint(client, monkeypatch, sample_weather_data):
+    monkeypatch.setattr("services.weather_service.get_weather_data", lambda lat, lon: city(sample_weather_data, f"{lat},{lon}"))
+    request_ai_descriptions = MagicMock(side_effect=lambda weather_list: [
+        f"Clear in {weather_data['location']['name']}." for weather_data in weather_list
+    ])
+    monkeypatch.setattr("services.ai_service.request_ai_descriptions", request_ai_descriptions)
+
+    response = client.post('/api/weather_description/batch', json={
+        "locations": [{"lat": 40.71, "lon": -74.01}, [42.36, -71.06], {"lat": "north"}]
+    })
+
+    results = json.loads(response.data)['results']
+    assert results[0] == {"lat": 40.71, "lon": -74.01, "description": "Clear in 40.71,-74.01."}
+    assert results[1]['description'] == "Clear in 42.36,-71.06."
+    assert 'error' in results[2]
+    request_ai_descriptions.assert_called_once()
+    assert client.post('/api/weather_description/batch', json={"locations": "all"}).status_code == 400
+
+def test_asgi_batch_endpoint(monkeypatch, sample_weather_data):
+    async def mock_get_weather_data(lat, lon):
+        return sample_weather_data
+
+    async def mock_request(weather_list):
+        return ["Clear and mild."] * len(weather_list)
+
+    monkeypatch.setattr("services.weather_service.async_get_weather_data", mock_get_weather_data)
+    monkeypatch.setattr("services.ai_service.async_request_ai_descriptions", mock_request)
+    asgi.cache.clear()
+
+    with TestClient(asgi.app) as client:
+        response = client.post('/api/weather_description/batch', json=[[40.71, -74.01], [40.71, -74.01]])
+
+    assert [result['description'] for result in response.json()['results']] == ["Clear and mild."] * 2
@@ -0,0 +1,144 @@
+import copy
+import json
+import time
+import asyncio
+import pytest
+from unittest.mock import patch
+from services import ai_service, metrics
+from services.description_cache import (
+    DescriptionCache, weather_fingerprint, async_cached_description, cached_description, description_cache
+)
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    description_cache.clear()
+    metrics.reset()
+    yield
+    description_cache.clear()
+
+def test_fingerprint_buckets_conditions(sample_weather_data):
+    """Small changes in temperature, humidity and wind share a fingerprint."""
+    similar = copy.deepcopy(sample_weather_data)
+    similar['current']['temp'] = 20.3
+    similar['current']['humidity'] = 61
+    similar['current']['wind_speed'] = 4.5
+
+    assert weather_fingerprint(similar) == weather_fingerprint(sample_weather_data)
+
+def test_fingerprint_separates_conditions(sample_weather_data):
+    """Different conditions get different fingerprints."""
+    rainy = copy.deepcopy(sample_weather_data)
+    rainy['current']['weather']['main'] = 'Rain'
+    warmer = copy.deepcopy(sample_weather_data)
+    warmer['current']['temp'] = 22
+
+    assert weather_fingerprint(rainy) != weather_fingerprint(sample_weather_data)
+    assert weather_fingerprint(warmer) != weather_fingerprint(sample_weather_data)
+
+def test_lru_eviction_and_ttl():
+    """The least recently used entry is evicted and expired entries are dropped."""
+    cache = DescriptionCache(max_size=2, ttl=60)
+    cache.set('a', 'A')
+    cache.set('b', 'B')
+    assert cache.get('a') == 'A'
+    cache.set('c', 'C')
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 'A'
+    assert metrics.get('cache.description.evicted') == 1
+
+    expired = DescriptionCache(max_size=2, ttl=0)
+    expired.set('a', 'A')
+    time.sleep(0.01)
+    assert expired.get('a') is None
+
+@patch('services.ai_service.request_ai_description')
+def test_identical_conditions_reuse_description(mock_request, sample_weather_data):
+    """Only the first request for a set of conditions calls OpenAI."""
+    mock_request.return_value = "Clear and mild in New York."
+
+    assert cached_description(sample_weather_data) == "Clear and mild in New York."
+    assert cached_description(copy.deepcopy(sample_weather_data)) == "Clear and mild in New York."
+
+    mock_request.assert_called_once()
+    assert metrics.get('cache.description.hit') == 1
+    assert metrics.get('cache.description.miss') == 1
+
+@patch('services.ai_service.request_ai_description')
+def test_fallback_is_not_cached(mock_request, sample_weather_data):
+    """When OpenAI fails the fallback is returned but not cached."""
+    mock_request.side_effect = Exception("API Error")
+
+    description = cached_description(sample_weather_data)
+
+    assert "New York" in description
+    assert len(description_cache) == 0
+
+@patch('services.ai_service.request_ai_description')
+def test_description_endpoint_uses_cache(mock_request, client, monkeypatch, sample_weather_data):
+    """The endpoint serves repeated page views from the description cache."""
+    mock_request.return_value = "Clear and mild in New York."
+    monkeypatch.setattr("services.weather_service.get_weather_data", lambda lat, lon: sample_weather_data)
+
+    for _ in range(3):
+        response = client.get('/api/weather_description?lat=40.7128&lon=-74.006')
+        assert json.loads(response.data) == {"description": "Clear and mild in New York."}
+
+    mock_request.assert_called_once()
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+@patch('services.ai_service.request_ai_description')
+def test_deadline_returns_fallback_and_fills_cache(mock_request, sample_weather_data):
+    """A slow OpenAI call answers with the fallback and caches its result for the next request."""
+    def slow_request(weather_data):
+        time.sleep(0.2)
+        return "Clear and mild in New York."
+    mock_request.side_effect = slow_request
+
+    started = time.monotonic()
+    description = cached_description(sample_weather_data, deadline=0.05)
+
+    assert time.monotonic() - started < 0.15
+    assert description == ai_service.generate_fallback_description(sample_weather_data)
+    assert metrics.get('description.deadline.exceeded') == 1
+    wait_for(lambda: metrics.get('description.background.filled') == 1)
+    assert cached_description(sample_weather_data, deadline=0.05) == "Clear and mild in New York."
+    mock_request.assert_called_once()
+
+@patch('services.ai_service.request_ai_description')
+def test_late_failures_are_counted(mock_request, sample_weather_data):
+    def failing_request(weather_data):
+        time.sleep(0.1)
+        raise Exception("API Error")
+    mock_request.side_effect = failing_request
+
+    assert "New York" in cached_description(sample_weather_data, deadline=0.01)
+    wait_for(lambda: metrics.get('description.background.failed') == 1)
+    assert len(description_cache) == 0
+
+@patch('services.ai_service.async_request_ai_description')
+def test_async_deadline(mock_request, sample_weather_data):
+    """The async path shares one call between waiters and lets it finish after the deadline."""
+    async def slow_request(weather_data):
+        await asyncio.sleep(0.2)
+        return "Clear and mild in New York."
+    mock_request.side_effect = slow_request
+
+    async def run():
+        first = await asyncio.gather(*[
+            async_cached_description(sample_weather_data, deadline=0.05) for _ in range(3)
+        ])
+        await asyncio.sleep(0.3)
+        return first, await async_cached_description(sample_weather_data, deadline=0.05)
+
+    first, second = asyncio.run(run())
+
+    assert first == [ai_service.generate_fallback_description(sample_weather_data)] * 3
+    assert second == "Clear and mild in New York."
+    assert metrics.get('description.background.filled') == 1
+    mock_request.assert_called_once()
@@ -0,0 +1,107 @@
+import json
+import pytest
+from unittest.mock import MagicMock, patch
+from starlette.testclient import TestClient
+from services import ai_service, circuit_breaker, metrics
+from services.description_cache import description_cache, weather_fingerprint
+import asgi
+
+URL = '/api/weather_description/stream?lat=40.7128&lon=-74.006'
+
+def parse_events(body):
+    """Split an event stream into (event, data) pairs."""
+    events = []
+    for block in body.decode().strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines['event'], json.loads(lines['data'])))
+    return events
+
+@pytest.fixture
+def weather(monkeypatch, sample_weather_data):
+    monkeypatch.setattr("services.weather_service.get_weather_data", lambda lat, lon: sample_weather_data)
+    return sample_weather_data
+
+def test_streams_tokens_then_caches(client, weather, monkeypatch):
+    """Tokens are forwarded as delta events and the full text is cached."""
+    monkeypatch.setattr("services.ai_service.stream_ai_description", lambda weather_data: iter(["Clear ", "and mild."]))
+
+    response = client.get(URL)
+
+    assert response.mimetype == 'text/event-stream'
+    assert response.headers['Cache-Control'] == 'no-cache'
+    assert parse_events(response.data) == [
+        ('delta', {'text': 'Clear '}),
+        ('delta', {'text': 'and mild.'}),
+        ('done', {'description': 'Clear and mild.', 'source': 'ai'})
+    ]
+    assert description_cache.get(weather_fingerprint(weather)) == 'Clear and mild.'
+
+def test_cached_description_is_one_event(client, weather):
+    description_cache.set(weather_fingerprint(weather), 'Clear and mild.')
+
+    events = parse_events(client.get(URL).data)
+
+    assert events == [('done', {'description': 'Clear and mild.', 'source': 'cache'})]
+    assert metrics.get('description.stream.cache') == 1
+
+def test_failure_mid_stream_ends_with_fallback(client, weather, monkeypatch):
+    """A failed generation ends with the fallback, which replaces the streamed text."""
+    def failing_stream(weather_data):
+        yield "Clear "
+        raise Exception("API Error")
+    monkeypatch.setattr("services.ai_service.stream_ai_description", failing_stream)
+
+    events = parse_events(client.get(URL).data)
+
+    assert events[-1] == ('done', {
+        'description': ai_service.generate_fallback_description(weather), 'source': 'fallback'
+    })
+    assert description_cache.get(weather_fingerprint(weather)) is None
+
+def test_missing_params(client):
+    assert client.get('/api/weather_description/stream').status_code == 400
+
+def chunk(text):
+    return MagicMock(choices=[MagicMock(delta=MagicMock(content=text))])
+
+@patch('services.ai_service.openai')
+def test_stream_ai_description_yields_deltas(mock_openai, sample_weather_data):
+    circuit_breaker.reset()
+    stream = mock_openai.chat.completions.create.return_value.__enter__.return_value
+    stream.__iter__.return_value = iter([chunk("Clear "), chunk(None), chunk("and mild.")])
+
+    assert list(ai_service.stream_ai_description(sample_weather_data)) == ["Clear ", "and mild."]
+    assert mock_openai.chat.completions.create.call_args.kwargs['stream'] is True
+
+def test_asgi_stream(monkeypatch, sample_weather_data):
+    """The ASGI app streams the same events."""
+    async def mock_get_weather_data(lat, lon):
+        return sample_weather_data
+
+    async def mock_stream(weather_data):
+        for text in ["Clear ", "and mild."]:
+            yield text
+
+    monkeypatch.setattr("services.weather_service.async_get_weather_data", mock_get_weather_data)
+    monkeypatch.setattr("services.ai_service.async_stream_ai_description", mock_stream)
+    asgi.cache.clear()
+    description_cache.clear()
+
+    with TestClient(asgi.app) as client:
+        response = client.get(URL)
+
+    assert response.headers['content-type'].startswith('text/event-stream')
+    assert parse_events(response.content)[-1] == ('done', {'description': 'Clear and mild.', 'source': 'ai'})
+    description_cache.clear()
+
+def test_dashboard_without_description(client, weather, monkeypatch, sample_forecast_data):
+    """Clients that stream the description can leave it out of the dashboard."""
+    monkeypatch.setattr("services.weather_service.get_weather_forecast", lambda lat, lon: sample_forecast_data)
+    request_ai_description = MagicMock()
+    monkeypatch.setattr("services.ai_service.request_ai_description", request_ai_description)
+
+    data = json.loads(client.get('/api/dashboard?lat=40.7128&lon=-74.006&description=false').data)
+
+    assert data['description'] is None
+    assert data['weather'] == weather
+    request_ai_description.assert_not_called()
@@ -0,0 +1,84 @@
+import copy
+import json
+import pytest
+from unittest.mock import patch
+from services import description_cache, description_templates, metrics
+from services.description_templates import regime, regime_key, render
+
+@pytest.fixture
+def tiered(monkeypatch):
+    monkeypatch.setattr(description_cache, "DESCRIPTION_ENGINE", "tiered")
+    description_cache.description_cache.clear()
+    metrics.reset()
+
+def conditions(sample_weather_data, **current):
+    weather_data = copy.deepcopy(sample_weather_data)
+    main = current.pop('main', None)
+    if main:
+        weather_data['current']['weather']['main'] = main
+    weather_data['current'].update(current)
+    return weather_data
+
+def test_regime_bands(sample_weather_data):
+    assert regime(sample_weather_data) == ('mild', 'Clear', 'normal', 'breezy')
+    assert regime(conditions(sample_weather_data, temp=-2, humidity=90, wind_speed=1, main='Drizzle')) == (
+        'freezing', 'Rain', 'humid', 'calm'
+    )
+
+@pytest.mark.parametrize("current", [
+    {'temp': 41},
+    {'temp': -20},
+    {'wind_speed': 20},
+])
+def test_extreme_conditions_have_no_regime(sample_weather_data, current):
+    assert regime(conditions(sample_weather_data, **current)) is None
+
+def test_render_prefers_the_most_specific_entry(sample_weather_data):
+    """The exact regime wins over entries that leave humidity and wind open."""
+    table = {
+        regime_key('mild', 'Clear'): ["{location} is mild at {temp}°C."],
+        regime_key('mild', 'Clear', 'normal'): ["{location}, {country}: {description}, {humidity}% humidity."]
+    }
+
+    assert render(sample_weather_data, table) == "New York, US: clear sky, 65% humidity."
+    assert render(conditions(sample_weather_data, humidity=20, temp=20.4), table) == "New York is mild at 20°C."
+    assert render(conditions(sample_weather_data, main='Thunderstorm'), table) is None
+
+def test_variant_is_stable_per_location(sample_weather_data):
+    table = {regime_key('mild', 'Clear'): [f"Variant {n} for {{location}}." for n in range(5)]}
+
+    assert render(sample_weather_data, table) == render(copy.deepcopy(sample_weather_data), table)
+
+def test_shipped_table_covers_common_regimes():
+    """Every common regime has variants, and they only use known placeholders."""
+    table = description_templates.load_table(description_templates.DESCRIPTION_TEMPLATES_PATH)
+    values = {name: 0 for name in description_templates.PLACEHOLDERS}
+
+    assert set(description_templates.common_regimes()) <= set(table)
+    for variants in table.values():
+        assert len(variants) >= 2
+        for variant in variants:
+            variant.format(**values)
+
+@patch('services.ai_service.request_ai_description')
+def test_common_conditions_skip_openai(mock_request, tiered, sample_weather_data):
+    """Common regimes are rendered from templates, unusual ones still go to gpt-4o."""
+    mock_request.return_value = "Thunderstorms rolling through New York."
+
+    description = description_cache.cached_description(sample_weather_data)
+    unusual = description_cache.cached_description(conditions(sample_weather_data, main='Thunderstorm'))
+
+    assert description.startswith(("It's a lovely day in New York", "New York has clear sky"))
+    assert unusual == "Thunderstorms rolling through New York."
+    mock_request.assert_called_once()
+    assert metrics.get('description.template.rendered') == 1
+    assert metrics.get('description.template.unusual') == 1
+
+def test_stream_sends_template_as_one_event(client, tiered, monkeypatch, sample_weather_data):
+    monkeypatch.setattr("services.weather_service.get_weather_data", lambda lat, lon: sample_weather_data)
+
+    response = client.get('/api/weather_description/stream?lat=40.7128&lon=-74.006')
+
+    assert response.data.count(b"event: ") == 1
+    data = json.loads(response.data.decode().split("data: ", 1)[1])
+    assert data['source'] == 'template'
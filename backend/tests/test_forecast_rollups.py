@@ -0,0 +1,106 @@
+import json
+import pytest
+from services import forecast_rollups, forecast_updates
+from services.forecast_rollups import daily, hourly
+
+# 2021-08-10 00:00 UTC
+MIDNIGHT = 1628553600
+
+def slot(datetime, temp, main='Clear', **fields):
+    return {
+        'datetime': datetime, 'temp': temp, 'feels_like': temp - 1, 'temp_min': temp - 2, 'temp_max': temp + 2,
+        'humidity': 60, 'pressure': 1012,
+        'weather': {'main': main, 'description': main.lower(), 'icon': '01d'},
+        'wind_speed': 4, 'wind_direction': 270, 'clouds': 0, 'precipitation_prob': 0.1,
+        **fields
+    }
+
+def five_days(timezone=0):
+    """A full 40-slot forecast starting at midnight UTC."""
+    return {
+        'location': {'name': 'New York', 'country': 'US', 'lat': 40.71, 'lon': -74.01, 'timezone': timezone},
+        'forecast': [slot(MIDNIGHT + i * 10800, 10 + i % 8) for i in range(40)]
+    }
+
+def test_daily_rollup():
+    """Slots are summarized per local day."""
+    forecast_data = {
+        'location': {'timezone': 0},
+        'forecast': [
+            slot(MIDNIGHT, 10, 'Rain', precipitation_prob=0.8),
+            slot(MIDNIGHT + 10800, 14, 'Clear', humidity=None),
+            slot(MIDNIGHT + 21600, 18, 'Rain', wind_speed=9),
+            slot(MIDNIGHT + 86400, 20, 'Clouds'),
+            slot(MIDNIGHT + 97200, 22, 'Clear')
+        ]
+    }
+
+    days = daily(forecast_data)
+
+    assert [day['date'] for day in days] == ['2021-08-10', '2021-08-11']
+    assert days[0] == {
+        'date': '2021-08-10', 'datetime': MIDNIGHT, 'temp_min': 8.0, 'temp_max': 20.0, 'temp': 14.0,
+        'humidity': 60.0, 'wind_speed_max': 9.0, 'precipitation_prob_max': 0.8,
+        'weather': {'main': 'Rain', 'description': 'rain', 'icon': '01d'}, 'slots': 3
+    }
+    # A tie goes to the condition seen first that day
+    assert days[1]['weather']['main'] == 'Clouds'
+    assert daily({'location': {}, 'forecast': []}) == []
+
+def test_daily_rollup_uses_local_days():
+    """Days start at local midnight of the forecast's location."""
+    days = daily(five_days(timezone=-4 * 3600))
+
+    assert len(days) == 6
+    assert days[0]['slots'] == 2
+    # First slot after local midnight (04:00 UTC)
+    assert days[1]['datetime'] == MIDNIGHT + 6 * 3600
+    assert sum(day['slots'] for day in days) == 40
+
+def test_hourly_rollup():
+    """The hourly view keeps the next day of slots and the fields a timeline needs."""
+    slots = hourly(five_days())
+
+    assert len(slots) == forecast_rollups.FORECAST_HOURLY_SLOTS
+    assert set(slots[0]) == {'datetime', 'temp', 'feels_like', 'humidity', 'wind_speed', 'precipitation_prob', 'weather'}
+
+def test_views_computed_once_per_revision(client, monkeypatch):
+    """Rollups are computed when a forecast is fetched, not per request, and are much smaller."""
+    forecast_data = five_days()
+    calls = []
+    rollups = forecast_rollups.rollups
+    monkeypatch.setattr("services.weather_service.get_weather_forecast", lambda lat, lon: forecast_data)
+    monkeypatch.setattr(forecast_rollups, 'rollups', lambda data: calls.append(1) or rollups(data))
+    url = '/api/forecast?lat=40.7128&lon=-74.006'
+
+    raw = client.get(url, headers={'Accept-Encoding': 'identity'})
+    days = client.get(f"{url}&view=daily", headers={'Accept-Encoding': 'identity'})
+    client.get(f"{url}&view=daily")
+    client.get(f"{url}&view=hourly")
+
+    assert calls == [1]
+    assert 'rollups' not in json.loads(raw.data)
+    body = json.loads(days.data)
+    assert body['view'] == 'daily'
+    assert body['revision'] == json.loads(raw.data)['revision']
+    assert [day['slots'] for day in body['forecast']] == [8] * 5
+    assert len(raw.data) > 6 * len(days.data)
+    assert client.get(f"{url}&view=weekly").status_code == 400
+
+def test_dashboard_forecast_view(client, monkeypatch, sample_weather_data):
+    """The dashboard can include a rollup instead of the raw forecast."""
+    monkeypatch.setattr("services.weather_service.get_weather_data", lambda lat, lon: sample_weather_data)
+    monkeypatch.setattr("services.weather_service.get_weather_forecast", lambda lat, lon: five_days())
+
+    response = client.get('/api/dashboard?lat=40.7128&lon=-74.006&description=false&forecast_view=hourly')
+
+    forecast = json.loads(response.data)['forecast']
+    assert forecast['view'] == 'hourly'
+    assert len(forecast['forecast']) == forecast_rollups.FORECAST_HOURLY_SLOTS
+    assert client.get('/api/dashboard?lat=40.7128&lon=-74.006&forecast_view=weekly').status_code == 400
+
+def test_view_of_entry_without_rollups(sample_forecast_data):
+    """Forecasts cached before rollups existed are summarized on the fly."""
+    assert forecast_updates.view({**sample_forecast_data, 'revision': 'r1'}, 'daily')['forecast'][0]['slots'] == 2
+    with pytest.raises(ValueError):
+        forecast_updates.view(sample_forecast_data, 'weekly')
@@ -0,0 +1,97 @@
+import copy
+import json
+import time
+import pytest
+from cachelib import SimpleCache
+from services import data_cache, forecast_updates, metrics
+from services.forecast_updates import delta, next_update, revise
+
+# 2021-08-10 01:00 UTC, an hour into the 00:00-03:00 update period
+FETCHED_AT = 1628557200
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    metrics.reset()
+
+def updated(forecast_data, slot, **changes):
+    forecast_data = copy.deepcopy(forecast_data)
+    forecast_data['forecast'][slot].update(changes)
+    return forecast_data
+
+def test_first_fetch_is_issued_at_period_start(sample_forecast_data):
+    """Without a previous forecast the issue time is the start of the update period."""
+    revised = revise(None, sample_forecast_data, FETCHED_AT)
+
+    assert revised['issued_at'] == 1628553600
+    assert revised['changes'] is None
+    assert revised['forecast'] == sample_forecast_data['forecast']
+    assert revise(None, copy.deepcopy(sample_forecast_data), FETCHED_AT)['revision'] == revised['revision']
+
+def test_unchanged_refetch_keeps_previous(sample_forecast_data):
+    """A refetch with the same slots is the cached revision."""
+    previous = revise(None, sample_forecast_data, FETCHED_AT)
+
+    assert revise(previous, copy.deepcopy(sample_forecast_data), FETCHED_AT + 3600) is previous
+    assert metrics.get('forecast.revision.unchanged') == 1
+
+def test_changed_slots_are_listed(sample_forecast_data):
+    """Only the slots that differ are reported, and a changed slot means a new issue."""
+    previous = revise(None, sample_forecast_data, FETCHED_AT)
+
+    revised = revise(previous, updated(sample_forecast_data, 1, temp=21), FETCHED_AT + 7200)
+
+    assert revised['revision'] != previous['revision']
+    assert revised['issued_at'] == FETCHED_AT + 7200
+    assert revised['changes'] == {'since': previous['revision'], 'updated': [1628564400], 'removed': []}
+
+def test_rolling_slots_is_not_a_new_issue(sample_forecast_data):
+    """Dropping a past slot and appending a new one keeps the issue time."""
+    previous = revise(None, sample_forecast_data, FETCHED_AT)
+    rolled = copy.deepcopy(sample_forecast_data)
+    rolled['forecast'] = rolled['forecast'][1:] + [{**rolled['forecast'][1], 'datetime': 1628575200}]
+
+    revised = revise(previous, rolled, FETCHED_AT + 7200)
+
+    assert revised['issued_at'] == previous['issued_at']
+    assert revised['changes']['updated'] == [1628575200]
+    assert revised['changes']['removed'] == [1628553600]
+
+def test_refresh_aligned_to_update_cadence(sample_forecast_data):
+    """Forecasts turn stale when the next update is due, then are rechecked until it shows up."""
+    revised = revise(None, sample_forecast_data, FETCHED_AT)
+
+    assert next_update(revised, FETCHED_AT) == 1628553600 + 3 * 3600
+    assert next_update(revised, 1628564400) == 1628564400 + forecast_updates.FORECAST_RECHECK_INTERVAL
+
+def test_delta(sample_forecast_data):
+    """Clients one revision behind get the changed slots, others the full forecast."""
+    previous = revise(None, sample_forecast_data, FETCHED_AT)
+    revised = revise(previous, updated(sample_forecast_data, 0, temp=25), FETCHED_AT + 7200)
+
+    changes = delta(revised, previous['revision'])
+    assert changes['updated'] == [revised['forecast'][0]]
+    assert changes['removed'] == []
+    assert delta(revised, revised['revision'])['updated'] == []
+    assert delta(revised, 'unknown') is None
+
+def test_scheduled_entries_stay_fresh_until_due():
+    """Scheduled entries outlive the soft TTL and are refreshed once due."""
+    cache = SimpleCache()
+    now = time.time()
+    cache.set('forecast:1.0,2.0', {'value': {'temp': 1}, 'fetched_at': now - 3600, 'stale_at': now + 60})
+    cache.set('forecast:3.0,4.0', {'value': {'temp': 1}, 'fetched_at': now - 3600, 'stale_at': now - 60})
+
+    assert data_cache._lookup(cache, 'forecast', 'forecast:1.0,2.0', now) == (cache.get('forecast:1.0,2.0'), False)
+    assert data_cache._lookup(cache, 'forecast', 'forecast:3.0,4.0', now)[1] is True
+
+def test_forecast_endpoint_serves_deltas(client, monkeypatch, sample_forecast_data):
+    """/api/forecast carries the revision and answers ?since= with the changed slots."""
+    monkeypatch.setattr("services.weather_service.get_weather_forecast", lambda lat, lon: sample_forecast_data)
+    url = '/api/forecast?lat=40.7128&lon=-74.006'
+
+    response = client.get(url)
+    first = json.loads(response.data)
+    max_age = int(response.headers['Cache-Control'].split('max-age=')[1].split(',')[0])
+    assert 0 < max_age <= forecast_updates.FORECAST_UPDATE_INTERVAL
+    assert json.loads(client.get(f"{url}&since={first['revision']}").data)['updated'] == []
+    assert 'forecast' in json.loads(client.get(f"{url}&since=unknown").data)
@@ -0,0 +1,138 @@
+import json
+import zlib
+import struct
+import numpy as np
+from starlette.testclient import TestClient
+from services import city_snapshot, heatmap_raster, heatmap_tiles, metrics
+from benchmarks.stub_upstream import box_payload
+import asgi
+
+BOUNDS = {'north': 50, 'south': 30, 'east': -70, 'west': -90}
+
+def snapshot_of(*cities):
+    """Snapshot of (lat, lon, temp) cities."""
+    return city_snapshot.from_box_response({'list': [
+        {'coord': {'lat': lat, 'lon': lon}, 'main': {'temp': temp}} for lat, lon, temp in cities
+    ]})
+
+def test_raster_size_follows_viewport_aspect():
+    """Heights follow the viewport aspect and sizes are clamped."""
+    assert heatmap_raster.raster_size({'north': 10, 'south': -10, 'east': 20, 'west': -20}) == (256, 128)
+    assert heatmap_raster.raster_size(BOUNDS, width=5000, height=0)[0] == heatmap_raster.RASTER_MAX_SIZE
+
+def test_interpolation_weights_by_distance():
+    """Cells take the value of a source on top of them and blend in between."""
+    snapshot = snapshot_of((40, -85, -20), (40, -75, 40))
+
+    grid = heatmap_raster.interpolate(snapshot, 'temperature', BOUNDS, width=20, height=20)
+
+    assert grid.shape == (20, 20)
+    assert grid.dtype == np.float32
+    # Cell (10, 5) is centred on the cold city, (10, 15) on the warm one
+    assert grid[10, 5] < 0.01
+    assert grid[10, 15] > 0.99
+    assert 0.4 < grid[10, 10] < 0.6
+    assert np.all(np.diff(grid[10, 5:16]) >= 0)
+
+def test_interpolation_without_data_is_empty():
+    """A viewport without readings is all NaN."""
+    grid = heatmap_raster.interpolate(city_snapshot.empty(), 'temperature', BOUNDS, width=4, height=3)
+    assert np.isnan(grid).all()
+
+def test_many_sources_are_binned():
+    """Sources above the limit are averaged into bins with the same overall field."""
+    data = box_payload(BOUNDS['west'], BOUNDS['south'], BOUNDS['east'], BOUNDS['north'])
+    snapshot = city_snapshot.from_box_response(data)
+    full = heatmap_raster.interpolate(snapshot, 'humidity', BOUNDS, width=32, height=32)
+
+    original = heatmap_raster.RASTER_MAX_SOURCES
+    try:
+        heatmap_raster.RASTER_MAX_SOURCES = 64
+        binned = heatmap_raster.interpolate(snapshot, 'humidity', BOUNDS, width=32, height=32)
+    finally:
+        heatmap_raster.RASTER_MAX_SOURCES = original
+
+    assert abs(float(np.mean(full)) - float(np.mean(binned))) < 0.05
+
+def test_png_encoding():
+    """The PNG is a valid 8-bit gray+alpha image with transparent gaps."""
+    grid = np.array([[0.0, 1.0], [np.nan, 0.5]], dtype=np.float32)
+
+    png = heatmap_raster.encode_png(grid)
+
+    assert png.startswith(b"\x89PNG\r\n\x1a\n")
+    width, height, depth, color_type = struct.unpack(">IIBB", png[16:26])
+    assert (width, height, depth, color_type) == (2, 2, 8, 4)
+    idat_length = struct.unpack(">I", png[33:37])[0]
+    rows = zlib.decompress(png[41:41 + idat_length])
+    assert rows == bytes([0, 0, 255, 255, 255, 0, 0, 0, 128, 255])
+
+def test_heatmap_raster_endpoint(client, monkeypatch):
+    """format=float32 and format=png return binary rasters described by headers."""
+    monkeypatch.setattr(
+        "services.weather_service.get_city_snapshot",
+        lambda bounds: city_snapshot.from_box_response(
+            box_payload(bounds['west'], bounds['south'], bounds['east'], bounds['north'])
+        )
+    )
+    # Fetch every tile so the JSON carries the full stub field
+    monkeypatch.setattr(heatmap_tiles, 'HEATMAP_MAX_TILE_FETCHES', heatmap_tiles.HEATMAP_MAX_TILES)
+    query = 'type=temperature&north=60&south=20&east=-60&west=-130'
+
+    response = client.get(f'/api/heatmap?{query}&format=float32&width=64&height=32')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/octet-stream'
+    assert response.headers['X-Raster-Width'] == '64'
+    assert response.headers['X-Raster-Height'] == '32'
+    assert response.headers['X-Raster-Bounds'] == '-130.0,20.0,-60.0,60.0'
+    grid = np.frombuffer(response.data, dtype='<f4').reshape(32, 64)
+    assert np.all((grid >= 0) & (grid <= 1))
+
+    points = client.get(f'/api/heatmap?{query}').data
+    png = client.get(f'/api/heatmap?{query}&format=png')
+    assert png.mimetype == 'image/png'
+    # Even the stub's noisy field is several times smaller than the JSON triples
+    assert len(png.data) * 4 < len(points)
+
+def test_heatmap_invalid_raster_size(client):
+    """Both serving modes reject a non-integer raster size before fetching anything."""
+    response = client.get('/api/heatmap?format=png&width=abc')
+    assert response.status_code == 400
+    assert 'Invalid raster size' in json.loads(response.data)['error']
+
+    with TestClient(asgi.app) as asgi_client:
+        response = asgi_client.get('/api/heatmap?format=png&height=1.5')
+    assert response.status_code == 400
+    assert 'Invalid raster size' in response.json()['error']
+
+def test_heatmap_unsupported_format(client):
+    """Unknown formats are rejected."""
+    response = client.get('/api/heatmap?format=gif')
+    assert response.status_code == 400
+    assert 'Unsupported format' in json.loads(response.data)['error']
+
+def test_heatmap_raster_rendered_once_per_view(client, monkeypatch):
+    """An unchanged viewport is served from the cached raster; other sizes and formats render again."""
+    monkeypatch.setattr(
+        "services.weather_service.get_city_snapshot",
+        lambda bounds: city_snapshot.from_box_response(
+            box_payload(bounds['west'], bounds['south'], bounds['east'], bounds['north'])
+        )
+    )
+    renders = []
+    render = heatmap_raster.render
+    monkeypatch.setattr(heatmap_raster, 'render', lambda *args: renders.append(args[3:]) or render(*args))
+    url = '/api/heatmap?type=temperature&north=60&south=20&east=-60&west=-130&width=64'
+
+    first = client.get(f'{url}&format=float32')
+    second = client.get(f'{url}&format=float32')
+    compressed = client.get(f'{url}&format=float32', headers={'Accept-Encoding': 'gzip'})
+    client.get(f'{url}&format=png')
+    client.get(f'{url}&format=png&height=10')
+
+    assert second.data == first.data
+    assert second.headers['X-Raster-Width'] == '64'
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert zlib.decompress(compressed.data, 16 + zlib.MAX_WBITS) == first.data
+    assert [args[0] for args in renders] == ['float32', 'float32', 'png', 'png']
+    assert metrics.get('encoded.heatmap.hit') == 1
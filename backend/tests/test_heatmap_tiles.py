@@ -0,0 +1,174 @@
+import json
+import time
+from starlette.testclient import TestClient
+from services import city_snapshot, heatmap_tiles, metrics, rate_limit
+from services.heatmap_tiles import Tile, tile_bounds, tile_cache_key, tile_levels, tiles_for_bounds
+import asgi
+
+def observations_for(bounds):
+    """One city in the middle of the requested box."""
+    lat = (bounds['north'] + bounds['south']) / 2
+    lon = (bounds['east'] + bounds['west']) / 2
+    return city_snapshot.from_box_response({'list': [{
+        'coord': {'lat': lat, 'lon': lon},
+        'main': {'temp': 10.0, 'humidity': 50, 'pressure': 1013},
+        'clouds': {'all': 0},
+        'weather': [{'id': 800}]
+    }]})
+
+def test_tiles_cover_viewport():
+    """A viewport maps onto the fixed tiles it overlaps."""
+    tiles = tiles_for_bounds({'north': 44, 'south': 36, 'east': -71, 'west': -79})
+
+    assert tiles == [Tile(5, 25, 20), Tile(5, 25, 21), Tile(5, 26, 20), Tile(5, 26, 21)]
+    assert tile_bounds(tiles[0]) == {'north': 40, 'south': 35, 'east': -75, 'west': -80}
+
+def test_edges_on_tile_boundaries_stay_inside():
+    """Bounds that sit exactly on tile edges don't pull in neighbouring tiles."""
+    assert tiles_for_bounds({'north': 40, 'south': 35, 'east': -75, 'west': -80}) == [Tile(5, 25, 20)]
+
+def test_zoomed_out_viewport_uses_larger_tiles():
+    """Wide viewports switch to a coarser level to bound the tile count."""
+    assert tile_levels() == [5, 10, 20, 40]
+
+    tiles = tiles_for_bounds({'north': 90, 'south': -90, 'east': 180, 'west': -180})
+
+    assert len(tiles) <= heatmap_tiles.HEATMAP_MAX_TILES
+    assert {tile.size for tile in tiles} == {40}
+
+def test_tiles_wrap_across_antimeridian():
+    """Tiles past 180 share the cache entry of the tile they wrap to."""
+    east_of_dateline = Tile(5, 25, 72)
+
+    assert tile_bounds(east_of_dateline) == tile_bounds(Tile(5, 25, 0))
+    assert tile_cache_key(east_of_dateline) == tile_cache_key(Tile(5, 25, 0)) == "heatmap:5:25:0"
+
+def test_panning_fetches_only_new_tiles(client, monkeypatch):
+    """Moving the viewport by one tile fetches just the newly covered tiles."""
+    fetched = []
+
+    def mock_get_city_snapshot(bounds):
+        fetched.append((bounds['west'], bounds['south']))
+        return observations_for(bounds)
+
+    monkeypatch.setattr("services.weather_service.get_city_snapshot", mock_get_city_snapshot)
+
+    response = client.get('/api/heatmap?type=temperature&north=44&south=36&east=-71&west=-79')
+    assert response.status_code == 200
+    assert len(json.loads(response.data)) == 4
+    assert len(fetched) == 4
+
+    response = client.get('/api/heatmap?type=temperature&north=44&south=36&east=-66&west=-74')
+    assert len(json.loads(response.data)) == 4
+    assert sorted(fetched[4:]) == [(-70, 35), (-70, 40)]
+
+    # Switching layers reuses the cached observations
+    response = client.get('/api/heatmap?type=humidity&north=44&south=36&east=-66&west=-74')
+    assert sorted(point[2] for point in json.loads(response.data)) == [0.5] * 4
+    assert len(fetched) == 6
+
+def test_query_string_is_part_of_the_cache(client, monkeypatch):
+    """Different viewports and layers get different results."""
+    monkeypatch.setattr("services.weather_service.get_city_snapshot", observations_for)
+
+    east = json.loads(client.get('/api/heatmap?north=44&south=36&east=-71&west=-79').data)
+    west = json.loads(client.get('/api/heatmap?north=44&south=36&east=-111&west=-119').data)
+
+    assert {round(point[1]) for point in east} != {round(point[1]) for point in west}
+
+def test_failed_tiles_are_left_out(client, monkeypatch):
+    """One failing tile doesn't fail the viewport, all failing does."""
+    def flaky(bounds):
+        if bounds['west'] == -80:
+            raise Exception("Failed to fetch heatmap data: 503")
+        return observations_for(bounds)
+
+    monkeypatch.setattr("services.weather_service.get_city_snapshot", flaky)
+
+    response = client.get('/api/heatmap?north=44&south=36&east=-71&west=-79')
+    assert response.status_code == 200
+    assert len(json.loads(response.data)) == 2
+    assert metrics.get('heatmap.tile_failed') == 2
+
+    response = client.get('/api/heatmap?north=39&south=36&east=-76&west=-79')
+    assert response.status_code == 500
+
+def test_partial_views_are_marked_and_not_stored(client, monkeypatch):
+    """A view missing tiles says so and isn't served again once the tiles recover."""
+    failing = {'enabled': True}
+
+    def flaky(bounds):
+        if failing['enabled'] and bounds['west'] == -80:
+            raise Exception("Failed to fetch heatmap data: 503")
+        return observations_for(bounds)
+
+    monkeypatch.setattr("services.weather_service.get_city_snapshot", flaky)
+    query = '/api/heatmap?north=44&south=36&east=-71&west=-79'
+
+    partial = client.get(query)
+    assert partial.headers['X-Heatmap-Missing-Tiles'] == '2'
+    assert partial.headers['Cache-Control'] == 'no-store'
+
+    failing['enabled'] = False
+    complete = client.get(query)
+    assert 'X-Heatmap-Missing-Tiles' not in complete.headers
+    assert len(json.loads(complete.data)) == 4
+
+def test_cold_viewport_falls_back_to_one_box_call(client, monkeypatch):
+    """More missing tiles than a request may fetch are replaced by one call for the viewport."""
+    fetched = []
+
+    def mock_get_city_snapshot(bounds):
+        fetched.append(bounds)
+        return observations_for(bounds)
+
+    monkeypatch.setattr("services.weather_service.get_city_snapshot", mock_get_city_snapshot)
+    monkeypatch.setattr(heatmap_tiles, 'HEATMAP_MAX_TILE_FETCHES', 2)
+
+    response = client.get('/api/heatmap?north=44&south=36&east=-71&west=-79')
+
+    assert response.status_code == 200
+    assert 'X-Heatmap-Missing-Tiles' not in response.headers
+    assert fetched == [{'north': 44.0, 'south': 36.0, 'east': -71.0, 'west': -79.0}]
+    assert len(json.loads(response.data)) == 1
+    assert metrics.get('heatmap.box_fallback') == 1
+
+def test_skipped_tiles_are_warmed_at_prefetch_priority(client, monkeypatch):
+    """Tiles left out of a request are fetched in the background on the prefetch reserve."""
+    priorities = []
+
+    def mock_get_city_snapshot(bounds):
+        priorities.append(rate_limit.current_priority())
+        return observations_for(bounds)
+
+    monkeypatch.setattr("services.weather_service.get_city_snapshot", mock_get_city_snapshot)
+    monkeypatch.setattr(heatmap_tiles, 'HEATMAP_MAX_TILE_FETCHES', 2)
+    monkeypatch.setattr(heatmap_tiles, 'HEATMAP_WARM_TILES', True)
+
+    client.get('/api/heatmap?north=44&south=36&east=-71&west=-79')
+
+    deadline = time.monotonic() + 5
+    while metrics.get('heatmap.tile_warmed') < 4 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    # The box call answers the request, the four tiles are warmed alongside it
+    assert sorted(priorities) == [rate_limit.INTERACTIVE] + [rate_limit.PREFETCH] * 4
+    response = client.get('/api/heatmap?north=44&south=36&east=-71&west=-79')
+    assert len(json.loads(response.data)) == 4
+
+def test_invalid_bounds(client):
+    """Non-numeric bounds are rejected."""
+    assert client.get('/api/heatmap?north=abc').status_code == 400
+
+def test_async_heatmap_assembles_tiles(monkeypatch):
+    """The ASGI mode assembles the same tiles, shifted to the viewport's world copy."""
+    async def mock_get_city_snapshot(bounds):
+        return observations_for(bounds)
+
+    monkeypatch.setattr("services.weather_service.async_get_city_snapshot", mock_get_city_snapshot)
+    asgi.cache.clear()
+
+    with TestClient(asgi.app) as client:
+        points = client.get('/api/heatmap?north=39&south=36&east=184&west=181').json()
+
+    assert points == [[37.5, 182.5, 0.5]]
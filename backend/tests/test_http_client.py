@@ -0,0 +1,110 @@
+import asyncio
+import threading
+import pytest
+import requests
+from services import http_client
+
+@pytest.fixture(autouse=True)
+def fresh_session():
+    """Make sure every test starts with a fresh pooled session."""
+    http_client.close_session()
+    yield
+    http_client.close_session()
+
+def test_connection_count_stays_flat(stub_upstream):
+    """Many sequential requests should reuse a single keep-alive connection."""
+    for _ in range(50):
+        response = http_client.get(f"{stub_upstream.url}/weather", params={"lat": 1, "lon": 2})
+        assert response.status_code == 200
+        assert response.json() == {"ok": True}
+
+    assert stub_upstream.request_count == 50
+    assert stub_upstream.connection_count == 1
+
+def test_session_is_reused_within_worker():
+    """The same session should be returned until it is closed."""
+    session = http_client.get_session()
+    assert http_client.get_session() is session
+
+    http_client.close_session()
+    assert http_client.get_session() is not session
+
+def test_retries_on_server_errors(stub_upstream, monkeypatch):
+    """429 and 5xx responses should be retried before giving up."""
+    monkeypatch.setattr(http_client, "BACKOFF_FACTOR", 0)
+    stub_upstream.status_codes = [503, 429]
+
+    response = http_client.get(f"{stub_upstream.url}/weather", timeout=(1, 1))
+
+    assert response.status_code == 200
+    assert stub_upstream.request_count == 3
+
+def test_gives_up_after_max_retries(stub_upstream, monkeypatch):
+    """The final error response is returned once retries are exhausted."""
+    monkeypatch.setattr(http_client, "BACKOFF_FACTOR", 0)
+    monkeypatch.setattr(http_client, "MAX_RETRIES", 2)
+    stub_upstream.status_codes = [500, 500, 500, 500]
+
+    response = http_client.get(f"{stub_upstream.url}/weather", timeout=(1, 1))
+
+    assert response.status_code == 500
+    assert stub_upstream.request_count == 3
+    with pytest.raises(requests.exceptions.HTTPError):
+        response.raise_for_status()
+
+def test_session_does_not_retry_responses(stub_upstream):
+    """The session itself hands error responses back without calling upstream again."""
+    stub_upstream.status_codes = [503]
+    session = http_client.create_session(max_retries=3, backoff_factor=0)
+
+    assert session.get(f"{stub_upstream.url}/weather", timeout=(1, 1)).status_code == 503
+    assert stub_upstream.request_count == 1
+
+def test_every_retry_takes_quota(stub_upstream, monkeypatch):
+    """Each attempt goes through the governor and Retry-After waits are capped."""
+    acquired = []
+    sleeps = []
+    monkeypatch.setattr(http_client.upstream_governor, "acquire", lambda level=None: acquired.append(level))
+    monkeypatch.setattr(http_client.time, "sleep", sleeps.append)
+    monkeypatch.setattr(http_client, "_retry_after", lambda response: 600.0)
+    stub_upstream.status_codes = [503, 503]
+
+    response = http_client.get(f"{stub_upstream.url}/weather", timeout=(1, 1))
+
+    assert response.status_code == 200
+    assert len(acquired) == 3
+    assert sleeps == [http_client.READ_TIMEOUT] * 2
+
+def test_read_timeout(stub_upstream, monkeypatch):
+    """A slow upstream should raise instead of hanging the worker."""
+    stub_upstream.delay = 0.5
+    monkeypatch.setattr(http_client, "MAX_RETRIES", 0)
+
+    with pytest.raises(requests.exceptions.RequestException):
+        http_client.get(f"{stub_upstream.url}/weather", timeout=(1, 0.1))
+
+def test_async_clients_of_a_previous_loop_are_closed(stub_upstream):
+    """Moving to a new event loop closes the clients of the old one, finished or still running."""
+    url = f"{stub_upstream.url}/weather"
+
+    async def request():
+        await http_client.async_get(url)
+        await asyncio.sleep(0.01)
+        return list(http_client._async_clients)
+
+    finished_loop_clients = asyncio.run(request())
+    running = asyncio.new_event_loop()
+    thread = threading.Thread(target=running.run_forever, daemon=True)
+    thread.start()
+    try:
+        running_loop_clients = asyncio.run_coroutine_threadsafe(request(), running).result(timeout=5)
+        current_clients = asyncio.run(request())
+        asyncio.run_coroutine_threadsafe(asyncio.sleep(0.01), running).result(timeout=5)
+    finally:
+        running.call_soon_threadsafe(running.stop)
+        thread.join(timeout=5)
+        running.close()
+
+    assert all(client.is_closed for client in finished_loop_clients + running_loop_clients)
+    assert not any(client.is_closed for client in current_clients)
+    asyncio.run(http_client.close_async_client())
@@ -0,0 +1,47 @@
+import json
+import numpy as np
+import pytest
+from starlette.testclient import TestClient
+from services import json_codec
+import asgi
+
+@pytest.fixture(params=["auto", "json"])
+def json_library(request, monkeypatch):
+    """Run a test with orjson (when installed) and with the stdlib fallback."""
+    monkeypatch.setattr(json_codec, "JSON_LIBRARY", request.param)
+    return request.param
+
+def test_backends_round_trip(json_library, sample_forecast_data):
+    """Both backends produce the same compact document."""
+    encoded = json_codec.dumps_bytes(sample_forecast_data)
+
+    assert json_codec.backend() == ("json" if json_library == "json" else "orjson")
+    assert encoded == json.dumps(sample_forecast_data, separators=(",", ":")).encode()
+    assert json_codec.loads(encoded) == sample_forecast_data
+    assert json_codec.loads(encoded.decode()) == sample_forecast_data
+    with pytest.raises(ValueError):
+        json_codec.loads(b"{not json")
+
+def test_orjson_serializes_numpy():
+    """NumPy values from snapshots can be returned without converting them first."""
+    if json_codec.backend() != "orjson":
+        pytest.skip("orjson is not installed")
+
+    assert json_codec.dumps({"lat": np.array([1.5, 2.0]), "n": np.int16(3)}) == '{"lat":[1.5,2.0],"n":3}'
+
+def test_flask_uses_fast_provider(app, client, json_library, sample_weather_data, monkeypatch):
+    """jsonify and request bodies go through the codec."""
+    monkeypatch.setattr("services.weather_service.get_weather_data", lambda lat, lon: sample_weather_data)
+
+    response = client.get('/api/weather?lat=40.7128&lon=-74.006')
+
+    assert response.data == json_codec.dumps_bytes(sample_weather_data)
+    assert client.get('/api/health').data == b'{"status":"ok"}\n'
+    assert app.json.loads(b'{"a": [1, 2]}') == {"a": [1, 2]}
+
+def test_asgi_json_response(json_library):
+    """The ASGI app renders JSON with the codec as well."""
+    with TestClient(asgi.app) as client:
+        response = client.get('/api/health')
+
+    assert response.content == b'{"status":"ok"}'
@@ -0,0 +1,146 @@
+import json
+import time
+import pytest
+from cachelib import SimpleCache
+from services import data_cache, metrics, observation_index, weather_service
+from services.observation_index import ObservationIndex, haversine_km
+
+def test_haversine_distance():
+    """Distances match known great-circle values."""
+    assert haversine_km(40.7128, -74.006, 40.7128, -74.006) == 0
+    # New York to Philadelphia is about 130 km
+    assert 125 < haversine_km(40.7128, -74.006, 39.9526, -75.1652) < 135
+
+def test_nearest_within_radius_and_age():
+    """Only observations close and fresh enough are returned, closest first."""
+    index = ObservationIndex(cell_km=2, max_age=600)
+    index.record(40.70, -74.00, {'id': 'near'})
+    index.record(40.75, -74.00, {'id': 'farther'})
+    index.record(40.71, -74.01, {'id': 'old'}, observed_at=time.time() - 700)
+
+    data, distance, age = index.nearest(40.705, -74.0, radius_km=10)
+    assert data == {'id': 'near'}
+    assert distance < 1
+    assert age < 5
+
+    assert index.nearest(41.5, -74.0, radius_km=10) is None
+    assert index.nearest(40.71, -74.01, radius_km=0.5) is None
+
+def test_nearest_searches_neighbouring_cells():
+    """Observations in adjacent grid cells are found."""
+    index = ObservationIndex(cell_km=1)
+    index.record(40.7, -74.0, {'id': 'a'})
+
+    assert index.nearest(40.7 + 3 / 111.32, -74.0, radius_km=5)[0] == {'id': 'a'}
+
+def test_recording_same_station_replaces_it():
+    """A newer observation at the same coordinates replaces the older one."""
+    index = ObservationIndex()
+    index.record(40.7, -74.0, {'temp': 1})
+    index.record(40.7, -74.0, {'temp': 2})
+
+    assert len(index) == 1
+    assert index.nearest(40.7, -74.0, radius_km=1)[0] == {'temp': 2}
+
+def test_index_is_bounded():
+    """Past the size limit expired and then the oldest observations are dropped to the low-water mark."""
+    index = ObservationIndex(max_size=10, max_age=600)
+    now = time.time()
+    index.record(1, 1, {'id': 'expired'}, observed_at=now - 1000)
+    for i in range(10):
+        index.record(10 + i, 10, {'id': i}, observed_at=now - 10 + i)
+
+    assert len(index) == 9
+    assert index.nearest(1, 1, radius_km=1, max_age=2000) is None
+    assert index.nearest(10, 10, radius_km=1) is None
+    index.record(30, 30, {'id': 'newest'})
+
+    assert len(index) == 10
+    assert index.nearest(30, 30, radius_km=1)[0] == {'id': 'newest'}
+
+def test_observations_aged_by_observation_time(monkeypatch):
+    """An old observation fetched just now isn't fresh, and doesn't replace a newer one."""
+    index = ObservationIndex(max_age=600)
+    now = time.time()
+    index.record(40.7, -74.0, {'temp': 2}, observed_at=now - 60)
+    index.record(40.7, -74.0, {'temp': 1}, observed_at=now - 120)
+
+    assert index.nearest(40.7, -74.0, radius_km=1)[0] == {'temp': 2}
+
+    monkeypatch.setattr(observation_index, 'NEAREST_OBSERVATION_KM', 5)
+    monkeypatch.setattr(observation_index, 'observation_index', index)
+    observation_index.record_weather({'location': {'lat': 41.0, 'lon': -74.0}, 'current': {'datetime': int(now) - 3600}})
+    assert observation_index.nearest_weather(41.0, -74.0) is None
+
+@pytest.fixture
+def nearest_mode(monkeypatch, stub_upstream):
+    """Enable the nearest-observation mode against the stub upstream."""
+    monkeypatch.setattr(observation_index, 'NEAREST_OBSERVATION_KM', 5)
+    monkeypatch.setattr(weather_service, 'BASE_URL', stub_upstream.url)
+    return stub_upstream
+
+def test_weather_answered_from_nearby_observation(client, nearest_mode):
+    """A lookup a few km from a fresh observation doesn't go upstream."""
+    nearest_mode.payload = {
+        'name': 'New York', 'sys': {'country': 'US'}, 'coord': {'lat': 40.71, 'lon': -74.01},
+        'main': {'temp': 20}, 'weather': [{'main': 'Clear'}], 'dt': int(time.time())
+    }
+
+    first = json.loads(client.get('/api/weather?lat=40.71&lon=-74.01').data)
+    second = json.loads(client.get('/api/weather?lat=40.73&lon=-74.03').data)
+
+    assert nearest_mode.request_count == 1
+    assert 'nearest' not in first
+    assert second['location']['name'] == 'New York'
+    assert 0 < second['nearest']['distance_km'] < 5
+    assert metrics.get('observation_index.hit') == 1
+
+    # Beyond the radius the lookup goes upstream
+    client.get('/api/weather?lat=41.2&lon=-74.01')
+    assert nearest_mode.request_count == 2
+
+def test_refresh_skips_nearby_observation(nearest_mode):
+    """A stale entry is refreshed from the upstream, not from the observation it was answered with."""
+    nearest_mode.payload = {'coord': {'lat': 40.71, 'lon': -74.01}, 'main': {'temp': 20}, 'dt': int(time.time())}
+    weather_service.get_weather_data(40.71, -74.01)
+    assert weather_service.get_weather_data(40.73, -74.03)['nearest']
+    requests_before = nearest_mode.request_count
+    cache = SimpleCache()
+    cache.set('weather:40.73,-74.03', {'value': {'temp': 19}, 'fetched_at': time.time() - 600})
+
+    value = data_cache.cached_fetch(
+        cache, 'weather', 'weather:40.73,-74.03', lambda: weather_service.get_weather_data(40.73, -74.03)
+    )
+
+    assert value == {'temp': 19}
+    deadline = time.monotonic() + 2
+    while metrics.get('refresh.weather.completed') < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert nearest_mode.request_count == requests_before + 1
+    assert 'nearest' not in cache.get('weather:40.73,-74.03')['value']
+
+def test_heatmap_cities_feed_the_index(client, nearest_mode):
+    """Cities from heatmap tiles answer later single-location lookups."""
+    nearest_mode.payload = {'list': [{
+        'name': 'Hoboken', 'coord': {'lat': 40.74, 'lon': -74.03},
+        'main': {'temp': 18, 'humidity': 60, 'pressure': 1012}, 'weather': [{'id': 800, 'main': 'Clear'}]
+    }]}
+    client.get('/api/heatmap?north=44&south=36&east=-71&west=-79')
+    requests_for_heatmap = nearest_mode.request_count
+
+    data = json.loads(client.get('/api/weather?lat=40.745&lon=-74.03').data)
+
+    assert nearest_mode.request_count == requests_for_heatmap
+    assert data['location']['name'] == 'Hoboken'
+    assert data['current']['temp'] == 18
+
+def test_nearest_mode_disabled_by_default(client, stub_upstream, monkeypatch):
+    """Without a radius every miss goes upstream and nothing is indexed."""
+    monkeypatch.setattr(weather_service, 'BASE_URL', stub_upstream.url)
+    stub_upstream.payload = {'coord': {'lat': 40.71, 'lon': -74.01}, 'main': {'temp': 20}}
+
+    client.get('/api/weather?lat=40.71&lon=-74.01')
+    client.get('/api/weather?lat=40.72&lon=-74.01')
+
+    assert stub_upstream.request_count == 2
+    assert len(observation_index.observation_index) == 0
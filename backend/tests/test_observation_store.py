@@ -0,0 +1,200 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import subprocess
+import pytest
+from cachelib import SimpleCache
+from sqlalchemy import insert
+from services import data_cache, metrics, observation_store, weather_service
+from services.observation_store import ObservationStore, decode_block, encode_block
+
+def observation(temp, observed_at, lat=40.71, lon=-74.01, name='New York'):
+    return {
+        'location': {'name': name, 'country': 'US', 'lat': lat, 'lon': lon},
+        'current': {
+            'temp': temp, 'feels_like': temp, 'temp_min': temp, 'temp_max': temp, 'humidity': 60,
+            'pressure': 1012, 'wind_speed': 3.5, 'wind_direction': 180, 'clouds': 0,
+            'weather': {'main': 'Clear', 'description': 'clear sky', 'icon': '01d'},
+            'visibility': 10000, 'datetime': observed_at
+        }
+    }
+
+@pytest.fixture
+def store(monkeypatch):
+    """An in-memory store standing in for the module's store."""
+    store = ObservationStore('sqlite://', flush_interval=60)
+    monkeypatch.setattr(observation_store, 'store', store)
+    metrics.reset()
+    return store
+
+def test_recent_observation_round_trip(store):
+    """A flushed observation answers lookups in its cell until it is too old."""
+    now = int(time.time())
+    store.record_weather(observation(20, now))
+
+    assert store.recent_weather(40.71, -74.01) is None
+    assert store.flush() == 1
+    assert store.recent_weather(40.712, -74.008) == observation(20.0, now)
+    assert store.recent_weather(41.71, -74.01) is None
+    assert store.recent_weather(40.71, -74.01, max_age=0) is None
+
+def test_repeated_observations_are_stored_once(store):
+    """Refetching an observation that hasn't changed doesn't add a row."""
+    now = int(time.time())
+    store.record_weather_batch([observation(20, now), observation(20, now)])
+    store.flush()
+    store.record_weather(observation(20, now))
+    store.flush()
+
+    assert len(store.history(40.71, -74.01, hours=1)) == 1
+
+def test_blocks_round_trip():
+    """Compacted columns decode back to the original rows."""
+    rows = [
+        {'observed_at': 1700000000 + i * 600, 'fetched_at': 1700000000.5 + i * 600, 'lat': 40.71, 'lon': -74.01,
+         'name': 'New York', 'country': 'US', 'temp': 20 + i, 'feels_like': None, 'temp_min': 19, 'temp_max': 21,
+         'humidity': 60, 'pressure': 1012, 'wind_speed': 3.5, 'wind_direction': 180, 'clouds': 0,
+         'visibility': 10000, 'main': 'Clear', 'description': 'clear sky', 'icon': '01d'}
+        for i in range(50)
+    ]
+
+    data = encode_block(rows)
+
+    assert decode_block(data) == rows
+    assert len(data) < len(json.dumps(rows)) / 10
+
+def test_history_spans_compacted_blocks(store):
+    """Old observations move into blocks and are still part of the history."""
+    now = int(time.time())
+    store.record_weather_batch([observation(10 + hour, now - hour * 3600) for hour in range(10)])
+    store.record_weather(observation(30, now, lat=48.85, lon=2.35, name='Paris'))
+    store.flush()
+
+    assert store.compact(older_than=3 * 3600) == 6
+    assert store.compact(older_than=3 * 3600) == 0
+
+    history = store.history(40.71, -74.01, hours=7.5)
+    assert [item['datetime'] for item in history] == [now - hour * 3600 for hour in range(7, -1, -1)]
+    assert [item['temp'] for item in history] == [float(10 + hour) for hour in range(7, -1, -1)]
+    assert history[0]['weather'] == {'main': 'Clear', 'description': 'clear sky', 'icon': '01d'}
+    assert len(store.history(48.85, 2.35, hours=8)) == 1
+    with pytest.raises(ValueError):
+        store.history(40.71, -74.01, hours=0)
+
+def test_history_has_one_sample_per_time(store):
+    """Overlapping blocks, e.g. from two workers compacting at once, don't duplicate samples."""
+    now = int(time.time())
+    store.record_weather_batch([observation(10 + hour, now - hour * 3600) for hour in range(3)])
+    store.flush()
+    cell = observation_store._cell(40.71, -74.01)
+    rows = [observation_store._observation_row(observation(10 + hour, now - hour * 3600), cell, now) for hour in (2, 1)]
+    with store.engine().begin() as connection:
+        connection.execute(insert(observation_store.observation_blocks), [
+            {'cell': cell, 'start': now - 7200, 'end': now - 3600, 'count': 2, 'data': encode_block(rows)}
+        ])
+
+    assert [item['temp'] for item in store.history(40.71, -74.01, hours=3)] == [12.0, 11.0, 10.0]
+
+def test_workers_compacting_claim_rows_once(tmp_path):
+    """Stores sharing a database never compact the same rows twice."""
+    url = f"sqlite:///{tmp_path / 'observations.db'}"
+    first, second = ObservationStore(url, flush_interval=60), ObservationStore(url, flush_interval=60)
+    now = int(time.time())
+    first.record_weather_batch([observation(10 + hour, now - hour * 3600) for hour in range(10)])
+    first.flush()
+
+    assert first.compact(older_than=3 * 3600) + second.compact(older_than=3 * 3600) == 6
+    assert len(second.history(40.71, -74.01, hours=12)) == 10
+
+def test_repeat_lookups_served_from_store(store, stub_upstream, monkeypatch, sample_forecast_data):
+    """Weather and forecasts fetched once are answered from disk, e.g. by another worker."""
+    monkeypatch.setattr(weather_service, 'BASE_URL', stub_upstream.url)
+    stub_upstream.payload = {
+        'name': 'New York', 'sys': {'country': 'US'}, 'coord': {'lat': 40.71, 'lon': -74.01},
+        'main': {'temp': 20}, 'weather': [{'main': 'Clear'}], 'dt': int(time.time())
+    }
+
+    fetched = weather_service.get_weather_data(40.71, -74.01)
+    store.flush()
+    stored = weather_service.get_weather_data(40.71, -74.01)
+
+    assert stub_upstream.request_count == 1
+    assert stored['location'] == fetched['location']
+    assert stored['current']['temp'] == 20
+    assert metrics.get('observation_store.hit') == 1
+
+    observation_store.record_forecast(40.71, -74.01, sample_forecast_data)
+    store.flush()
+    assert weather_service.get_weather_forecast(40.71, -74.01) == sample_forecast_data
+    assert stub_upstream.request_count == 1
+
+def test_refresh_goes_upstream_past_soft_ttl(store, stub_upstream, monkeypatch):
+    """A stale entry is refreshed from the upstream even while the store still answers lookups."""
+    monkeypatch.setattr(weather_service, 'BASE_URL', stub_upstream.url)
+    monkeypatch.setattr(observation_store, 'OBSERVATION_STORE_MAX_AGE', 3600)
+    stub_upstream.payload = {'coord': {'lat': 40.71, 'lon': -74.01}, 'main': {'temp': 25}, 'dt': int(time.time())}
+    soft_ttl = data_cache.ttl_for('weather').soft
+    fetched_at = time.time() - soft_ttl - 60
+    row = observation_store._observation_row(
+        observation(20, int(fetched_at)), observation_store._cell(40.71, -74.01), fetched_at
+    )
+    with store.engine().begin() as connection:
+        connection.execute(insert(observation_store.observations), [row])
+    assert weather_service.get_weather_data(40.71, -74.01)['current']['temp'] == 20
+
+    cache = SimpleCache()
+    cache.set('weather:sync', {'value': {'temp': 20}, 'fetched_at': fetched_at})
+    data_cache.cached_fetch(cache, 'weather', 'weather:sync', lambda: weather_service.get_weather_data(40.71, -74.01))
+
+    async def refresh_async():
+        cache.set('weather:async', {'value': {'temp': 20}, 'fetched_at': fetched_at})
+        await data_cache.async_cached_fetch(
+            cache, 'weather', 'weather:async', lambda: weather_service.async_get_weather_data(40.71, -74.01)
+        )
+        while metrics.get('refresh.weather.completed') < 2:
+            await asyncio.sleep(0.01)
+
+    asyncio.run(asyncio.wait_for(refresh_async(), timeout=2))
+
+    assert stub_upstream.request_count == 2
+    assert cache.get('weather:sync')['value']['current']['temp'] == 25
+    assert cache.get('weather:async')['value']['current']['temp'] == 25
+
+def test_history_endpoint(client, store):
+    """/api/history returns the stored observations, oldest first."""
+    now = int(time.time())
+    store.record_weather_batch([observation(20, now - 7200), observation(22, now)])
+    store.flush()
+
+    data = json.loads(client.get('/api/history?lat=40.71&lon=-74.01&hours=3').data)
+
+    assert data['hours'] == 3
+    assert [item['temp'] for item in data['observations']] == [20, 22]
+    assert client.get('/api/history?lat=40.71&lon=-74.01&hours=-1').status_code == 400
+    assert client.get('/api/history?lat=40.71').status_code == 400
+
+def test_disabled_by_default(stub_upstream, monkeypatch):
+    """Without a database URL nothing is persisted and lookups never touch a database."""
+    env = {name: value for name, value in os.environ.items() if name not in ('OBSERVATION_STORE_URL', 'DATABASE_URL')}
+    default_url = subprocess.run(
+        [sys.executable, '-c', 'from services import observation_store; print(repr(observation_store.OBSERVATION_STORE_URL))'],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), env=env, capture_output=True, text=True, check=True
+    ).stdout.strip()
+    assert default_url == "''"
+
+    store = ObservationStore('')
+    monkeypatch.setattr(observation_store, 'store', store)
+    monkeypatch.setattr(weather_service, 'BASE_URL', stub_upstream.url)
+    stub_upstream.payload = {'coord': {'lat': 40.71, 'lon': -74.01}, 'main': {'temp': 20}, 'dt': int(time.time())}
+
+    weather_service.get_weather_data(40.71, -74.01)
+    weather_service.get_weather_data(40.71, -74.01)
+
+    assert stub_upstream.request_count == 2
+    assert store._engine is None and store._writer_pid is None
+
+def test_history_endpoint_when_disabled(client):
+    """Without a database URL there is no history to serve."""
+    assert client.get('/api/history?lat=40.71&lon=-74.01').status_code == 503
@@ -0,0 +1,152 @@
+import time
+import json
+import asyncio
+import pytest
+import fakeredis
+from cachelib import SimpleCache
+from services import data_cache, heatmap_tiles, http_client, metrics, rate_limit
+from services.cache_backends import CompactRedisCache, SharedFileCache
+from services.rate_limit import INTERACTIVE, PREFETCH, REFRESH, QuotaExhaustedError, QuotaGovernor
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    metrics.reset()
+
+def drain(governor, level):
+    """Take calls at a priority until the governor refuses, returning how many went through."""
+    taken = 0
+    while True:
+        try:
+            governor.acquire(level)
+        except QuotaExhaustedError:
+            return taken
+        taken += 1
+
+def test_lower_priorities_leave_a_reserve():
+    """Prefetches stop first, then refreshes; interactive calls use what's left."""
+    governor = QuotaGovernor(per_minute=10, max_wait=0)
+
+    assert drain(governor, PREFETCH) == 6
+    assert governor.available(REFRESH)
+    assert drain(governor, REFRESH) == 2
+    assert governor.available(INTERACTIVE)
+    assert drain(governor, INTERACTIVE) == 2
+    assert governor.status()['minute'] == {'limit': 10, 'remaining': 0}
+    assert metrics.get('quota.prefetch.denied') == 1
+
+def test_interactive_calls_wait_for_a_token():
+    """An interactive call waits for the bucket to refill instead of failing."""
+    governor = QuotaGovernor(per_minute=600, max_wait=0)
+    drain(governor, INTERACTIVE)
+    governor.max_wait = 1
+
+    started = time.monotonic()
+    governor.acquire(INTERACTIVE)
+
+    assert 0.05 < time.monotonic() - started < 0.5
+    with pytest.raises(QuotaExhaustedError):
+        governor.acquire(REFRESH)
+
+def test_daily_quota():
+    """The per-day budget is never waited for."""
+    governor = QuotaGovernor(per_minute=0, per_day=5, max_wait=5)
+
+    assert drain(governor, INTERACTIVE) == 5
+    assert governor.status()['day'] == {'limit': 5, 'remaining': 0}
+    with pytest.raises(QuotaExhaustedError) as error:
+        governor.acquire(INTERACTIVE)
+    assert error.value.retry_after is None
+
+def test_quota_shared_between_workers(monkeypatch):
+    """Workers counting in the shared cache tier split one per-minute budget."""
+    server = fakeredis.FakeServer()
+    one, two = (
+        QuotaGovernor(per_minute=10, max_wait=0, workers=4,
+                      shared=CompactRedisCache(host=fakeredis.FakeStrictRedis(server=server), key_prefix='test:'))
+        for _ in range(2)
+    )
+    # Stay inside one minute window
+    monkeypatch.setattr(rate_limit.time, "time", lambda: 1700000010.0)
+
+    for _ in range(4):
+        one.acquire(INTERACTIVE)
+    assert drain(two, PREFETCH) == 2
+    assert drain(two, INTERACTIVE) == 4
+    assert one.status()['minute'] == {'limit': 10, 'remaining': 0}
+
+    one.pause(30)
+    assert two.status()['paused_seconds'] > 0
+
+def test_daily_quota_shared_on_one_host(tmp_path):
+    """Workers sharing the file cache tier split one per-day budget."""
+    one, two = (QuotaGovernor(per_minute=0, per_day=5, max_wait=0, shared=SharedFileCache(str(tmp_path))) for _ in range(2))
+
+    assert drain(one, INTERACTIVE) + drain(two, INTERACTIVE) == 5
+    assert two.status()['day'] == {'limit': 5, 'remaining': 0}
+
+def test_quota_split_without_shared_tier():
+    """Without a shared tier each worker gets its share, also when the shared cache fails."""
+    assert drain(QuotaGovernor(per_minute=10, max_wait=0, workers=2), INTERACTIVE) == 5
+
+    server = fakeredis.FakeServer()
+    server.connected = False
+    broken = CompactRedisCache(host=fakeredis.FakeStrictRedis(server=server))
+    governor = QuotaGovernor(per_minute=10, max_wait=0, workers=2, shared=broken)
+    assert drain(governor, INTERACTIVE) == 5
+    assert governor.status()['minute'] == {'limit': 5, 'remaining': 0}
+    assert metrics.get('quota.shared.error') > 0
+
+def test_priority_context():
+    """Calls default to interactive; priority() sets it for a block."""
+    assert rate_limit.current_priority() == INTERACTIVE
+    with rate_limit.priority(REFRESH):
+        assert rate_limit.current_priority() == REFRESH
+    assert rate_limit.current_priority() == INTERACTIVE
+
+def test_rate_limited_upstream_pauses_calls(stub_upstream, monkeypatch):
+    """A 429 from upstream holds back every further call."""
+    governor = QuotaGovernor(per_minute=0, max_wait=0)
+    monkeypatch.setattr(http_client, "upstream_governor", governor)
+    monkeypatch.setattr(http_client, "MAX_RETRIES", 0)
+    stub_upstream.status_codes = [429]
+
+    async def fetch():
+        try:
+            return (await http_client.async_get(f"{stub_upstream.url}/weather")).status_code
+        finally:
+            await http_client.close_async_client()
+
+    assert asyncio.run(fetch()) == 429
+    assert governor.status()['paused_seconds'] > 0
+    with pytest.raises(QuotaExhaustedError):
+        http_client.get(f"{stub_upstream.url}/weather")
+    assert stub_upstream.request_count == 1
+
+def test_refresh_deferred_when_quota_is_low(monkeypatch):
+    """Stale entries keep being served while the refresh budget is spent."""
+    governor = QuotaGovernor(per_minute=10, max_wait=0)
+    drain(governor, REFRESH)
+    monkeypatch.setattr(data_cache, "upstream_governor", governor)
+    cache = SimpleCache()
+    cache_key = 'weather:1.0,2.0'
+    cache.set(cache_key, {'value': {'temp': 1}, 'fetched_at': time.time() - 600})
+
+    value = data_cache.cached_fetch(cache, 'weather', cache_key, lambda: {'temp': 2})
+
+    assert value == {'temp': 1}
+    assert metrics.get('refresh.weather.deferred') == 1
+    assert metrics.get('refresh.weather.scheduled') == 0
+
+def test_heatmap_tiles_are_interactive_priority(client, monkeypatch):
+    """Tiles a user waits for are fetched as interactive calls, and the quota is reported in the metrics."""
+    priorities = set()
+
+    def mock_get_city_snapshot(bounds):
+        priorities.add(rate_limit.current_priority())
+        return heatmap_tiles.city_snapshot.empty()
+
+    monkeypatch.setattr("services.weather_service.get_city_snapshot", mock_get_city_snapshot)
+    client.get('/api/heatmap?north=44&south=36&east=-71&west=-79')
+
+    assert priorities == {INTERACTIVE}
+    assert 'upstream_quota' in json.loads(client.get('/api/metrics').data)
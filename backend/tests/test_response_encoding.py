@@ -0,0 +1,114 @@
+import gzip
+import json
+import brotli
+import msgpack
+import pytest
+from cachelib import SimpleCache
+from starlette.testclient import TestClient
+from services import city_snapshot, metrics, response_encoding
+from services.response_encoding import UnsupportedFormatError, negotiate
+from benchmarks.stub_upstream import box_payload
+import asgi
+
+@pytest.mark.parametrize("requested, accept, accept_encoding, expected", [
+    (None, None, None, ('json', None)),
+    ('columnar', 'application/msgpack', 'gzip', ('columnar', 'gzip')),
+    (None, 'application/x-msgpack, application/json;q=0.5', 'gzip, deflate, br', ('msgpack', 'br')),
+    (None, 'application/vnd.weatherwizard.columnar+json', 'br;q=0, gzip', ('columnar', 'gzip')),
+    (None, 'application/msgpack;q=0, */*', 'identity', ('json', None))
+])
+def test_negotiation(requested, accept, accept_encoding, expected):
+    """The format parameter wins over Accept; br is preferred over gzip."""
+    assert negotiate(requested, accept, accept_encoding) == expected
+
+def test_unknown_format_is_rejected():
+    with pytest.raises(UnsupportedFormatError, match="Unsupported format: xml"):
+        negotiate('xml')
+
+def test_columns(sample_forecast_data):
+    """Records become one list per field, nested records nested columns."""
+    columns = response_encoding.columnar_forecast(sample_forecast_data)['forecast']
+
+    assert columns['temp'] == [20, 18]
+    assert columns['weather']['icon'] == ['01d', '02n']
+    assert response_encoding.columns([]) == {}
+
+def test_encoded_body_is_cached_per_version():
+    """Bodies are built once per data version and compressed above the threshold."""
+    cache = SimpleCache()
+    builds = []
+
+    def build(shape):
+        builds.append(shape)
+        return {"values": list(range(1000))}
+
+    first = response_encoding.encoded_body(cache, 'forecast', 'k', '1', build, 'json', 'gzip')
+    again = response_encoding.encoded_body(cache, 'forecast', 'k', '1', build, 'json', 'gzip')
+    assert builds == ['json']
+    assert again == first
+    assert first.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(first.body)) == {"values": list(range(1000))}
+
+    response_encoding.encoded_body(cache, 'forecast', 'k', '2', build, 'json', 'gzip')
+    assert builds == ['json', 'json']
+
+    small = response_encoding.encoded_body(cache, 'forecast', 's', '1', lambda shape: {}, 'msgpack', 'br')
+    assert small.body == msgpack.packb({})
+    assert 'Content-Encoding' not in small.headers
+
+def test_forecast_formats(client, monkeypatch, sample_forecast_data):
+    """The forecast is available as MessagePack and columns, encoded once per fetch."""
+    monkeypatch.setattr("services.weather_service.get_weather_forecast", lambda lat, lon: sample_forecast_data)
+    url = '/api/forecast?lat=40.7128&lon=-74.006'
+
+    response = client.get(url)
+    assert response.mimetype == 'application/json'
+    assert json.loads(response.data).items() >= sample_forecast_data.items()
+
+    packed = client.get(url, headers={'Accept': 'application/msgpack'})
+    assert packed.mimetype == 'application/msgpack'
+    assert msgpack.unpackb(packed.data).items() >= sample_forecast_data.items()
+    assert len(packed.data) < len(response.data)
+
+    columnar = client.get(f'{url}&format=columnar')
+    assert json.loads(columnar.data)['forecast']['datetime'] == [1628553600, 1628564400]
+
+    client.get(url)
+    assert metrics.get('encoded.forecast.miss') == 3
+    assert metrics.get('encoded.forecast.hit') == 1
+
+    assert client.get(f'{url}&format=xml').status_code == 400
+
+def test_heatmap_compressed_columns(client, monkeypatch):
+    """Heatmap columns are served brotli-compressed and match the points."""
+    monkeypatch.setattr(
+        "services.weather_service.get_city_snapshot",
+        lambda bounds: city_snapshot.from_box_response(
+            box_payload(bounds['west'], bounds['south'], bounds['east'], bounds['north'])
+        )
+    )
+    url = '/api/heatmap?type=humidity&north=50&south=30&east=-70&west=-100'
+
+    points = json.loads(client.get(url).data)
+    response = client.get(f'{url}&format=columnar', headers={'Accept-Encoding': 'gzip, br'})
+
+    assert response.headers['Content-Encoding'] == 'br'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    columns = json.loads(brotli.decompress(response.data))
+    assert list(zip(columns['lat'], columns['lon'], columns['intensity'])) == [tuple(point) for point in points]
+
+def test_asgi_forecast_msgpack(monkeypatch, sample_forecast_data):
+    """The ASGI app negotiates the same encodings."""
+    async def mock_get_weather_forecast(lat, lon):
+        return sample_forecast_data
+
+    monkeypatch.setattr("services.weather_service.async_get_weather_forecast", mock_get_weather_forecast)
+    asgi.cache.clear()
+
+    with TestClient(asgi.app) as client:
+        response = client.get('/api/forecast?lat=40.7128&lon=-74.006&format=msgpack')
+        unsupported = client.get('/api/forecast?lat=40.7128&lon=-74.006&format=xml')
+
+    assert response.headers['content-type'] == 'application/msgpack'
+    assert msgpack.unpackb(response.content).items() >= sample_forecast_data.items()
+    assert unsupported.status_code == 400
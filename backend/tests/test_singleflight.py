@@ -0,0 +1,90 @@
+import json
+import threading
+import time
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask
+from flask_caching import Cache
+from services import data_cache
+from services.data_cache import cached_fetch
+from services.singleflight import SingleFlight
+
+def test_concurrent_calls_run_once():
+    """Concurrent callers with the same key share one execution."""
+    flight = SingleFlight()
+    calls = []
+
+    def slow_fetch():
+        calls.append(1)
+        time.sleep(0.2)
+        return {'temp': 20}
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: flight.do('weather:40.71,-74.01', slow_fetch), range(8)))
+
+    assert len(calls) == 1
+    assert results == [{'temp': 20}] * 8
+    assert flight.in_flight() == 0
+
+def test_errors_are_shared_with_waiters():
+    """Every waiting caller sees the leader's exception."""
+    flight = SingleFlight()
+    started = threading.Event()
+
+    def failing_fetch():
+        started.set()
+        time.sleep(0.1)
+        raise Exception("upstream down")
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(flight.do, 'key', failing_fetch)
+        started.wait()
+        waiter = executor.submit(flight.do, 'key', failing_fetch)
+        for future in (leader, waiter):
+            with pytest.raises(Exception, match="upstream down"):
+                future.result()
+
+def test_cross_worker_waits_for_lock_holder(monkeypatch):
+    """A worker that finds the shared lock taken reuses the holder's result."""
+    monkeypatch.setattr(data_cache, 'SINGLEFLIGHT_POLL_INTERVAL', 0.01)
+    app = Flask(__name__)
+    cache = Cache(app, config={'CACHE_TYPE': 'SimpleCache'})
+
+    with app.app_context():
+        # Another worker holds the lock and stores its result shortly after
+        cache.add('lock:weather:1.0,2.0', 1234, timeout=15)
+        timer = threading.Timer(0.1, lambda: cache.set(
+            'weather:1.0,2.0', {'value': {'temp': 5}, 'fetched_at': time.time()}
+        ))
+        timer.start()
+
+        def fetch():
+            raise AssertionError("should not fetch while another worker holds the lock")
+
+        value = cached_fetch(cache, 'weather', 'weather:1.0,2.0', fetch, cross_worker=True)
+        timer.join()
+
+    assert value == {'temp': 5}
+
+def test_concurrent_weather_requests_fetch_once(app, monkeypatch, sample_weather_data):
+    """Concurrent cache misses for one location make one upstream call."""
+    calls = []
+
+    def mock_get_weather_data(lat, lon):
+        calls.append((lat, lon))
+        time.sleep(0.2)
+        return sample_weather_data
+
+    monkeypatch.setattr("services.weather_service.get_weather_data", mock_get_weather_data)
+
+    def request_weather(_):
+        with app.test_client() as client:
+            return client.get('/api/weather?lat=40.7128&lon=-74.006')
+
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        responses = list(executor.map(request_weather, range(6)))
+
+    assert len(calls) == 1
+    for response in responses:
+        assert response.status_code == 200
+        assert json.loads(response.data) == sample_weather_data
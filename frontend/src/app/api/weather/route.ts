@@ -1,6 +1,7 @@
 import { NextRequest, NextResponse } from 'next/server';
 import { getWeatherData } from '@/utils/weather-service';
 import cache from '@/utils/cache';
+import { cacheMaxAge, conditionalJson } from '@/utils/conditional';
 
 export async function GET(request: NextRequest) {
   try {
@@ -22,7 +23,7 @@ export async function GET(request: NextRequest) {
     // Check if we have cached data
     const cachedData = cache.get(cacheKey);
     if (cachedData) {
-      return NextResponse.json(cachedData);
+      return conditionalJson(request, cachedData, cacheMaxAge(cacheKey));
     }
     
     // Fetch fresh data
@@ -31,7 +32,7 @@ export async function GET(request: NextRequest) {
     // Cache the result
     cache.set(cacheKey, weatherData);
     
-    return NextResponse.json(weatherData);
+    return conditionalJson(request, weatherData, cacheMaxAge(cacheKey));
   } catch (error) {
     console.error('Weather API error:', error);
     return NextResponse.json(
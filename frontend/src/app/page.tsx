@@ -1,12 +1,24 @@
 'use client';
 
-import { useState } from 'react';
+import { useEffect, useState } from 'react';
 import Header from '@/components/Header';
 import Footer from '@/components/Footer';
 import WeatherMap from '@/components/WeatherMap';
-import CurrentWeather from '@/components/CurrentWeather';
-import WeatherForecast from '@/components/WeatherForecast';
+import CurrentWeather, { WeatherData } from '@/components/CurrentWeather';
+import WeatherForecast, { ForecastData } from '@/components/WeatherForecast';
 import WeatherDescription from '@/components/WeatherDescription';
+import { streamDescription } from '@/utils/description-stream';
+
+interface DashboardData {
+  weather: WeatherData | null;
+  forecast: ForecastData | null;
+  description: string | null;
+  errors?: {
+    weather?: string;
+    forecast?: string;
+    description?: string;
+  };
+}
 
 export default function Home() {
   const [selectedLocation, setSelectedLocation] = useState<{
@@ -14,6 +26,74 @@ export default function Home() {
     lon: number;
     name?: string;
   } | null>(null);
+  const [dashboard, setDashboard] = useState<DashboardData | null>(null);
+  const [loading, setLoading] = useState<boolean>(true);
+  const [error, setError] = useState<string | null>(null);
+  const [description, setDescription] = useState<string | null>(null);
+  const [describing, setDescribing] = useState<boolean>(true);
+  const [descriptionError, setDescriptionError] = useState<boolean>(false);
+
+  // Fetch weather and forecast for the selected location in one request
+  useEffect(() => {
+    if (!selectedLocation) return;
+
+    const { lat, lon } = selectedLocation;
+    let cancelled = false;
+
+    const fetchDashboard = async () => {
+      setLoading(true);
+      setError(null);
+      try {
+        // The description is streamed separately below; the forecast card only shows the next day
+        const response = await fetch(`/api/dashboard?lat=${lat}&lon=${lon}&description=false&forecast_view=hourly`);
+
+        if (!response.ok) {
+          throw new Error('Failed to fetch weather data');
+        }
+
+        const data = await response.json();
+        if (!cancelled) {
+          setDashboard(data);
+        }
+      } catch (error) {
+        console.error('Error fetching weather data:', error);
+        if (!cancelled) {
+          setDashboard(null);
+          setError('Failed to load weather data. Please try again.');
+        }
+      } finally {
+        if (!cancelled) {
+          setLoading(false);
+        }
+      }
+    };
+
+    fetchDashboard();
+
+    return () => {
+      cancelled = true;
+    };
+  }, [selectedLocation]);
+
+  // Stream the AI description so it renders while gpt-4o is still generating it
+  useEffect(() => {
+    if (!selectedLocation) return;
+
+    setDescription(null);
+    setDescribing(true);
+    setDescriptionError(false);
+
+    return streamDescription(selectedLocation.lat, selectedLocation.lon, {
+      onText: (text, done) => {
+        setDescription(text);
+        setDescribing(!done);
+      },
+      onError: () => {
+        setDescribing(false);
+        setDescriptionError(true);
+      },
+    });
+  }, [selectedLocation]);
 
   // Handle location selection from map
   const handleMapLocationSelect = (lat: number, lon: number) => {
@@ -50,24 +130,27 @@ export default function Home() {
               {/* Current Weather */}
               <div className="col-md-6 mb-4">
                 <CurrentWeather 
-                  lat={selectedLocation.lat} 
-                  lon={selectedLocation.lon} 
+                  weatherData={dashboard?.weather ?? null}
+                  loading={loading}
+                  error={error || (dashboard?.errors?.weather ? 'Failed to load weather data. Please try again.' : null)}
                 />
               </div>
               
               {/* AI Description */}
               <div className="col-md-6 mb-4">
                 <WeatherDescription 
-                  lat={selectedLocation.lat} 
-                  lon={selectedLocation.lon} 
+                  description={description}
+                  loading={describing}
+                  error={descriptionError ? 'Failed to load AI weather description. Please try again.' : null}
                 />
               </div>
               
               {/* Forecast */}
               <div className="col-12 mb-4">
                 <WeatherForecast 
-                  lat={selectedLocation.lat} 
-                  lon={selectedLocation.lon} 
+                  forecastData={dashboard?.forecast ?? null}
+                  loading={loading}
+                  error={error || (dashboard?.errors?.forecast ? 'Failed to load forecast data. Please try again.' : null)}
                 />
               </div>
             </section>
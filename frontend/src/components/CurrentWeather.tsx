@@ -1,6 +1,6 @@
 'use client';
 
-import { useEffect, useRef, useState } from 'react';
+import { useEffect, useRef } from 'react';
 import dynamic from 'next/dynamic';
 
 // Import Chart.js directly for client-side rendering
@@ -29,7 +29,7 @@ ChartJS.register(
   Legend
 );
 
-interface WeatherData {
+export interface WeatherData {
   location: {
     name: string;
     country: string;
@@ -57,40 +57,14 @@ interface WeatherData {
 }
 
 interface CurrentWeatherProps {
-  lat: number;
-  lon: number;
+  weatherData: WeatherData | null;
+  loading: boolean;
+  error: string | null;
 }
 
-const CurrentWeather: React.FC<CurrentWeatherProps> = ({ lat, lon }) => {
-  const [weatherData, setWeatherData] = useState<WeatherData | null>(null);
-  const [loading, setLoading] = useState<boolean>(true);
-  const [error, setError] = useState<string | null>(null);
+const CurrentWeather: React.FC<CurrentWeatherProps> = ({ weatherData, loading, error }) => {
   const chartRef = useRef<any>(null);
 
-  useEffect(() => {
-    const fetchWeatherData = async () => {
-      setLoading(true);
-      setError(null);
-      try {
-        const response = await fetch(`/api/weather?lat=${lat}&lon=${lon}`);
-        
-        if (!response.ok) {
-          throw new Error('Failed to fetch weather data');
-        }
-        
-        const data = await response.json();
-        setWeatherData(data);
-      } catch (error) {
-        console.error('Error fetching weather data:', error);
-        setError('Failed to load weather data. Please try again.');
-      } finally {
-        setLoading(false);
-      }
-    };
-
-    fetchWeatherData();
-  }, [lat, lon]);
-
   // Create temperature chart
   useEffect(() => {
     if (!weatherData || !document.getElementById('temperature-chart')) return;
@@ -1,42 +1,14 @@
 'use client';
 
-import { useEffect, useState } from 'react';
-
 interface WeatherDescriptionProps {
-  lat: number;
-  lon: number;
+  description: string | null;
+  loading: boolean;
+  error: string | null;
 }
 
-const WeatherDescription: React.FC<WeatherDescriptionProps> = ({ lat, lon }) => {
-  const [description, setDescription] = useState<string>('');
-  const [loading, setLoading] = useState<boolean>(true);
-  const [error, setError] = useState<string | null>(null);
-
-  useEffect(() => {
-    const fetchWeatherDescription = async () => {
-      setLoading(true);
-      setError(null);
-      try {
-        const response = await fetch(`/api/weather_description?lat=${lat}&lon=${lon}`);
-        
-        if (!response.ok) {
-          throw new Error('Failed to fetch weather description');
-        }
-        
-        const data = await response.json();
-        setDescription(data.description);
-      } catch (error) {
-        console.error('Error fetching weather description:', error);
-        setError('Failed to load AI weather description. Please try again.');
-      } finally {
-        setLoading(false);
-      }
-    };
-
-    fetchWeatherDescription();
-  }, [lat, lon]);
-
-  if (loading) {
+const WeatherDescription: React.FC<WeatherDescriptionProps> = ({ description, loading, error }) => {
+  // While streaming, the text received so far is shown instead of the spinner
+  if (loading && !description) {
     return (
       <div className="card weather-card bg-dark text-light">
         <div className="card-body text-center py-5">
@@ -49,13 +21,13 @@ const WeatherDescription: React.FC<WeatherDescriptionProps> = ({ lat, lon }) =>
     );
   }
 
-  if (error) {
+  if (error || !description) {
     return (
       <div className="card weather-card bg-dark text-light">
         <div className="card-body text-center py-5">
           <i className="fas fa-exclamation-circle fa-2x mb-3 text-danger"></i>
           <h3>Error</h3>
-          <p className="text-light">{error}</p>
+          <p className="text-light">{error || 'Failed to load AI weather description'}</p>
         </div>
       </div>
     );
@@ -67,7 +39,10 @@ const WeatherDescription: React.FC<WeatherDescriptionProps> = ({ lat, lon }) =>
         <h3 className="card-title">
           <i className="fas fa-robot me-2"></i>AI Weather Insights
         </h3>
-        <p className="ai-description mt-3">{description}</p>
+        <p className="ai-description mt-3" aria-busy={loading}>
+          {description}
+          {loading && <span className="spinner-grow spinner-grow-sm text-info ms-1" role="status"></span>}
+        </p>
       </div>
     </div>
   );
@@ -1,6 +1,6 @@
 'use client';
 
-import { useEffect, useRef, useState } from 'react';
+import { useEffect, useRef } from 'react';
 import dynamic from 'next/dynamic';
 
 // Import Chart.js directly for client-side rendering
@@ -29,70 +29,48 @@ ChartJS.register(
   Legend
 );
 
+// Slots of the raw forecast; the hourly view (forecast_view=hourly) leaves out the optional fields
 interface ForecastItem {
   datetime: number;
   temp: number;
   feels_like: number;
-  temp_min: number;
-  temp_max: number;
+  temp_min?: number;
+  temp_max?: number;
   humidity: number;
-  pressure: number;
+  pressure?: number;
   weather: {
     main: string;
     description: string;
     icon: string;
   };
   wind_speed: number;
-  wind_direction: number;
-  clouds: number;
+  wind_direction?: number;
+  clouds?: number;
   precipitation_prob: number;
 }
 
-interface ForecastData {
+export interface ForecastData {
   location: {
     name: string;
     country: string;
     lat: number;
     lon: number;
   };
+  revision?: string;
+  issued_at?: number;
+  view?: 'hourly';
   forecast: ForecastItem[];
 }
 
 interface WeatherForecastProps {
-  lat: number;
-  lon: number;
+  forecastData: ForecastData | null;
+  loading: boolean;
+  error: string | null;
 }
 
-const WeatherForecast: React.FC<WeatherForecastProps> = ({ lat, lon }) => {
-  const [forecastData, setForecastData] = useState<ForecastData | null>(null);
-  const [loading, setLoading] = useState<boolean>(true);
-  const [error, setError] = useState<string | null>(null);
+const WeatherForecast: React.FC<WeatherForecastProps> = ({ forecastData, loading, error }) => {
   const chartRef = useRef<any>(null);
 
-  useEffect(() => {
-    const fetchForecastData = async () => {
-      setLoading(true);
-      setError(null);
-      try {
-        const response = await fetch(`/api/forecast?lat=${lat}&lon=${lon}`);
-        
-        if (!response.ok) {
-          throw new Error('Failed to fetch forecast data');
-        }
-        
-        const data = await response.json();
-        setForecastData(data);
-      } catch (error) {
-        console.error('Error fetching forecast data:', error);
-        setError('Failed to load forecast data. Please try again.');
-      } finally {
-        setLoading(false);
-      }
-    };
-
-    fetchForecastData();
-  }, [lat, lon]);
-
   // Create forecast chart
   useEffect(() => {
     if (!forecastData || !document.getElementById('forecast-chart')) return;
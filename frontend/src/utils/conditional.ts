@@ -0,0 +1,37 @@
+import { createHash } from 'crypto';
+import { NextRequest, NextResponse } from 'next/server';
+import cache from './cache';
+
+/**
+ * Seconds until a cached entry expires, used as the response's max-age.
+ */
+export function cacheMaxAge(cacheKey: string): number {
+  const expiresAt = cache.getTtl(cacheKey);
+  return expiresAt ? Math.max(0, Math.floor((expiresAt - Date.now()) / 1000)) : 0;
+}
+
+/**
+ * Respond with JSON carrying a strong ETag, or 304 Not Modified when the
+ * request's If-None-Match already names this body.
+ */
+export function conditionalJson(request: NextRequest, data: unknown, maxAge: number): NextResponse {
+  const body = JSON.stringify(data);
+  const etag = `"${createHash('sha1').update(body).digest('hex')}"`;
+  const headers = {
+    ETag: etag,
+    'Cache-Control': `public, max-age=${maxAge}, stale-while-revalidate=${maxAge}`,
+  };
+
+  const ifNoneMatch = request.headers.get('if-none-match');
+  const matches = ifNoneMatch
+    ?.split(',')
+    .map((tag) => tag.trim().replace(/^W\//, ''))
+    .some((tag) => tag === etag || tag === '*');
+  if (matches) {
+    return new NextResponse(null, { status: 304, headers });
+  }
+
+  return new NextResponse(body, {
+    headers: { ...headers, 'Content-Type': 'application/json' },
+  });
+}
@@ -0,0 +1,45 @@
+/**
+ * Client for the Server-Sent Events description endpoint.
+ *
+ * The backend sends "delta" events with each new piece of text while gpt-4o
+ * generates it, then one "done" event with the complete description (the
+ * only event when the description was cached).
+ */
+
+export interface DescriptionStreamHandlers {
+  /** Called with the text received so far, and done once it is complete. */
+  onText: (text: string, done: boolean) => void;
+  onError: () => void;
+}
+
+/**
+ * Stream the AI description for a location. Returns a function that closes
+ * the stream, e.g. when another location is selected.
+ */
+export function streamDescription(lat: number, lon: number, handlers: DescriptionStreamHandlers): () => void {
+  const source = new EventSource(`/api/weather_description/stream?lat=${lat}&lon=${lon}`);
+  let text = '';
+  let done = false;
+
+  source.addEventListener('delta', (event) => {
+    text += JSON.parse((event as MessageEvent).data).text;
+    handlers.onText(text, false);
+  });
+
+  source.addEventListener('done', (event) => {
+    done = true;
+    source.close();
+    // The final text replaces the deltas, e.g. with a fallback after a failure
+    handlers.onText(JSON.parse((event as MessageEvent).data).description, true);
+  });
+
+  source.onerror = () => {
+    // EventSource would reconnect and generate the description again
+    source.close();
+    if (!done) {
+      handlers.onError();
+    }
+  };
+
+  return () => source.close();
+}